@@ -17,24 +17,15 @@ from rich.logging import RichHandler
 from rich.panel import Panel
 
 # custom libs and constants
+# NOTE: the k8s, bitwarden, and TUI libraries are imported in main() only
+# once we need them, so that the TUI's first frame isn't waiting on them
 from .constants import INITIAL_USR_CONFIG, XDG_CONFIG_FILE, load_yaml
 from .env_config import check_os_support, process_configs
-from .bitwarden.bw_cli import BwCLI
-from .bitwarden.tui.bitwarden_app import BitwardenCredentialsApp
 from .constants import KUBECONFIG, VERSION
-from .k8s_apps import (setup_oidc_provider, setup_base_apps,
-                       setup_k8s_secrets_management, setup_federated_apps)
-from .k8s_apps.monitoring.prometheus_stack import configure_prometheus_stack
-from .k8s_apps.networking.netmaker import configure_netmaker
-from .k8s_apps.operators import setup_operators
-from .k8s_apps.operators.minio import configure_minio_tenant
-from .k8s_apps.social.libre_translate import configure_libretranslate
-from .k8s_apps.valkey import configure_valkey
-from .k8s_distros import create_k8s_distro, delete_cluster
-from .tui import launch_config_tui
+from .utils.artifacts import set_offline
+from .utils.events import EVENTS, JsonLinesRenderer, RichLiveRenderer, phase
 from .utils.rich_cli.console_logging import CONSOLE, sub_header, header
 from .utils.rich_cli.help_text import RichCommand, options_help
-from .utils.run.final_cmd import run_final_cmd
 
 
 HELP = options_help()
@@ -115,12 +106,38 @@ def process_log_config(log_dict: dict = {"level": "warn", "file": ""}):
         type=str,
         default="",
         help=HELP['command'])
+@option("--backup", "-b",
+        is_flag=True,
+        help=HELP['backup'])
+@option("--apps", "-a", "backup_app_names",
+        metavar="APP,APP",
+        type=str,
+        default="",
+        help=HELP['apps'])
+@option("--parallel", "-p",
+        metavar="N",
+        type=int,
+        default=4,
+        help=HELP['parallel'])
+@option("--offline", "-o",
+        is_flag=True,
+        help=HELP['offline'])
+@option("--events", "-e", "events_file",
+        metavar="EVENTS_FILE",
+        type=str,
+        default="",
+        help=HELP['events'])
 def main(config: str = "",
          delete: bool = False,
          log_file: str = "",
          version: bool = False,
          interactive: bool = False,
-         final_cmd: str = ""):
+         final_cmd: str = "",
+         backup: bool = False,
+         backup_app_names: str = "",
+         parallel: int = 4,
+         offline: bool = False,
+         events_file: str = ""):
     """
     Quickly install a k8s distro for a homelab setup. Installs k3s
     with metallb, ingess-nginx, cert-manager, and argocd
@@ -133,9 +150,18 @@ def main(config: str = "",
     # make sure this OS is supported
     check_os_support()
 
+    # only use installers and manifests we've already downloaded
+    if offline:
+        set_offline()
+
+    # write every progress event to a file, for other tools to follow along
+    if events_file:
+        EVENTS.subscribe(JsonLinesRenderer(events_file))
+
     # if we're just deleting a cluster, do that immediately
     if delete:
         logging.debug("Cluster deletion was requested")
+        from .k8s_distros import delete_cluster
         # exits the script after deleting the cluster
         delete_cluster(delete)
 
@@ -153,7 +179,8 @@ def main(config: str = "",
     else:
         config_dict = INITIAL_USR_CONFIG
 
-    if interactive or tui_enabled:
+    if (interactive or tui_enabled) and not backup:
+        from .tui import launch_config_tui
         cluster_name, USR_CFG, SECRETS, bitwarden_credentials = launch_config_tui(config_dict)
     else:
         # process all of the config file, or create a new one and also grab secrets
@@ -164,7 +191,8 @@ def main(config: str = "",
         using_bw_pw_manager = pw_mngr['enabled'] and pw_mngr['name'] == 'bitwarden'
         using_bweso = SECRETS['global_external_secrets']
 
-        if using_bw_pw_manager or using_bweso == 'bitwarden':
+        # backups don't need bitwarden, so don't bother unlocking it
+        if (using_bw_pw_manager or using_bweso == 'bitwarden') and not backup:
             # get bitwarden credentials from the env if there are any
             password = env.get("BW_PASSWORD", None)
             client_id = env.get("BW_CLIENTID", None)
@@ -172,6 +200,7 @@ def main(config: str = "",
 
             # if any of the credentials are missing from the env, launch the tui
             if not any([password, client_id, client_secret]):
+                from .bitwarden.tui.bitwarden_app import BitwardenCredentialsApp
                 bitwarden_credentials = BitwardenCredentialsApp().run()
                 if not bitwarden_credentials:
                     raise Exception("Exiting because no credentials were passed in "
@@ -185,6 +214,39 @@ def main(config: str = "",
     log = process_log_config(USR_CFG['smol_k8s_lab']['log'])
     log.debug("Logging configured.")
 
+    # if we're just backing up apps, do that and exit
+    if backup:
+        from .k8s_tools.backup_orchestrator import backup_apps, print_backup_summary
+        header("Backing up apps", "💾")
+        app_names = [app.strip() for app in backup_app_names.split(",") if app.strip()]
+
+        # many backups run at once, so draw all of their progress in one place
+        live_renderer = RichLiveRenderer(CONSOLE)
+        EVENTS.subscribe(live_renderer)
+        try:
+            with phase("backing up apps"):
+                results = backup_apps(USR_CFG['apps'], app_names, parallel)
+        finally:
+            EVENTS.unsubscribe(live_renderer)
+        print_backup_summary(results)
+        EVENTS.flush()
+        return True
+
+    # everything we need to actually create the cluster and install the apps
+    from .bitwarden.bw_cli import BwCLI
+    from .k8s_apps import (setup_oidc_provider, setup_base_apps,
+                           setup_k8s_secrets_management, setup_federated_apps)
+    from .k8s_apps.identity_provider.zitadel_provisioning import build_oidc_plan
+    from .k8s_apps.monitoring.prometheus_stack import configure_prometheus_stack
+    from .k8s_apps.networking.netmaker import configure_netmaker
+    from .k8s_apps.operators import setup_operators
+    from .k8s_apps.operators.minio import configure_minio_tenant
+    from .k8s_apps.social.libre_translate import configure_libretranslate
+    from .k8s_apps.valkey import configure_valkey
+    from .k8s_distros import create_k8s_distro
+    from .k8s_tools.backup_schedule import apply_backup_schedules, plan_backup_schedules
+    from .utils.run.final_cmd import run_final_cmd
+
     k8s_distros = USR_CFG['k8s_distros']
 
     # if we have bitwarden credetials unlock the vault
@@ -211,8 +273,9 @@ def main(config: str = "",
             break
 
     # install the actual KIND, k3s, or k3d cluster
-    k8s_obj = create_k8s_distro(cluster_name, selected_distro, metadata,
-                                metallb_enabled, cilium_enabled)
+    with phase(f"creating {selected_distro} cluster"):
+        k8s_obj = create_k8s_distro(cluster_name, selected_distro, metadata,
+                                    metallb_enabled, cilium_enabled)
 
     # run the final command immediately after k8s is up, if it's running in a
     # new tab, window, or pane
@@ -228,27 +291,29 @@ def main(config: str = "",
     argo_enabled = apps['argo_cd']['enabled']
 
     # installs all the base apps: metallb/cilium, ingess-nginx, cert-manager, and argocd
-    argocd = setup_base_apps(k8s_obj,
-                             distro,
-                             apps.get('cilium', {}),
-                             apps['metallb'],
-                             apps.get('ingress_nginx', {}),
-                             apps.get('cert_manager', {}),
-                             apps.get('cnpg_operator', {}),
-                             apps['argo_cd'],
-                             SECRETS,
-                             bw)
+    with phase("installing base apps"):
+        argocd = setup_base_apps(k8s_obj,
+                                 distro,
+                                 apps.get('cilium', {}),
+                                 apps['metallb'],
+                                 apps.get('ingress_nginx', {}),
+                                 apps.get('cert_manager', {}),
+                                 apps.get('cnpg_operator', {}),
+                                 apps['argo_cd'],
+                                 SECRETS,
+                                 bw)
 
     # 🦑 Install Argo CD: continuous deployment app for k8s
     if argo_enabled:
         # setup k8s secrets management and secret stores
-        setup_k8s_secrets_management(argocd,
-                                     distro,
-                                     apps.pop('external_secrets_operator', {}),
-                                     SECRETS['global_external_secrets'],
-                                     apps.pop('infisical', {}),
-                                     apps.pop('vault', {}),
-                                     bw)
+        with phase("setting up secrets management"):
+            setup_k8s_secrets_management(argocd,
+                                         distro,
+                                         apps.pop('external_secrets_operator', {}),
+                                         SECRETS['global_external_secrets'],
+                                         apps.pop('infisical', {}),
+                                         apps.pop('vault', {}),
+                                         bw)
 
         # if the global cluster issuer is set to letsencrypt-staging don't
         # verify TLS certs in requests to APIs
@@ -259,16 +324,21 @@ def main(config: str = "",
 
         # Setup minio, our local s3 provider, is essential for creating buckets
         # and cnpg operator, our postgresql operator for creating postgres clusters
-        setup_operators(argocd,
-                        apps.pop('prometheus_crds', {'enabled': False}),
-                        apps.pop('longhorn', {'enabled': False}),
-                        apps.pop('k8up', {'enabled': False}),
-                        apps.pop('minio_operator', {'enabled': False}),
-                        apps.pop('seaweedfs', {'enabled': False}),
-                        apps.pop('cnpg_operator', {'enabled': False}),
-                        apps.pop('postgres_operator', {'enabled': False}),
-                        apps.pop('openbao', {'enabled': False}),
-                        bw)
+        with phase("setting up operators"):
+            setup_operators(argocd,
+                            apps.pop('prometheus_crds', {'enabled': False}),
+                            apps.pop('longhorn', {'enabled': False}),
+                            apps.pop('k8up', {'enabled': False}),
+                            apps.pop('minio_operator', {'enabled': False}),
+                            apps.pop('seaweedfs', {'enabled': False}),
+                            apps.pop('cnpg_operator', {'enabled': False}),
+                            apps.pop('postgres_operator', {'enabled': False}),
+                            apps.pop('openbao', {'enabled': False}),
+                            bw)
+
+        # stagger the default backup schedules, so they don't all run at midnight
+        backup_plan = plan_backup_schedules(apps)
+        apply_backup_schedules(apps, backup_plan, argocd)
 
         # global pvc storage class
         pvc_storage_class = SECRETS.get('global_pvc_storage_class', 'local-path')
@@ -276,14 +346,22 @@ def main(config: str = "",
         # check if zitadel is enabled
         zitadel_enabled = apps['zitadel']['enabled']
 
+        # collect every app's OIDC needs, so zitadel can create them all at once
+        if zitadel_enabled and apps['zitadel']['init']['enabled']:
+            oidc_plan = build_oidc_plan(argocd, apps)
+        else:
+            oidc_plan = {}
+
         # setup OIDC for securing all endpoints with SSO
-        oidc_obj = setup_oidc_provider(argocd,
-                                       api_tls_verify,
-                                       apps.pop('zitadel', {}),
-                                       apps.pop('vouch', {}),
-                                       pvc_storage_class,
-                                       bw,
-                                       SECRETS['argo_cd_hostname'])
+        with phase("setting up the OIDC provider"):
+            oidc_obj = setup_oidc_provider(argocd,
+                                           api_tls_verify,
+                                           apps.pop('zitadel', {}),
+                                           apps.pop('vouch', {}),
+                                           pvc_storage_class,
+                                           bw,
+                                           SECRETS['argo_cd_hostname'],
+                                           oidc_plan)
 
         # we need this for all the oidc apps we need to create
         zitadel_hostname = SECRETS.get('zitadel_hostname', "")
@@ -314,21 +392,22 @@ def main(config: str = "",
             libretranslate_api_key = ""
 
         # setup nextcloud, home assistant, mastodon, gotosocial, and matrix
-        setup_federated_apps(
-                argocd,
-                api_tls_verify,
-                apps.pop('home_assistant', {}),
-                apps.pop('nextcloud', {}),
-                apps.pop('mastodon', {}),
-                apps.pop('gotosocial', {}),
-                apps.pop('matrix', {}),
-                apps.pop('peertube', {}),
-                pvc_storage_class,
-                zitadel_hostname,
-                oidc_obj,
-                libretranslate_api_key,
-                bw
-                )
+        with phase("setting up federated apps"):
+            setup_federated_apps(
+                    argocd,
+                    api_tls_verify,
+                    apps.pop('home_assistant', {}),
+                    apps.pop('nextcloud', {}),
+                    apps.pop('mastodon', {}),
+                    apps.pop('gotosocial', {}),
+                    apps.pop('matrix', {}),
+                    apps.pop('peertube', {}),
+                    pvc_storage_class,
+                    zitadel_hostname,
+                    oidc_obj,
+                    libretranslate_api_key,
+                    bw
+                    )
 
         # stand alone valkey
         if apps.get('valkey'):
@@ -355,7 +434,12 @@ def main(config: str = "",
             if app_meta['enabled']:
                 argo_app = app_key.replace('_', '-')
                 sub_header(f"Installing app: {argo_app}")
-                argocd.install_app(argo_app, app_meta['argo'])
+                with phase(f"installing {argo_app}"):
+                    argocd.install_app(argo_app, app_meta['argo'])
+
+        # in debug mode, show how long each of the zitadel api calls took
+        if oidc_obj:
+            oidc_obj.print_latency_stats()
 
         # lock the bitwarden vault on the way out, to be polite :3
         if bw:
@@ -434,6 +518,9 @@ def main(config: str = "",
                         border_style="cornflower_blue"))
     print("")
 
+    # make sure every progress event has been written before we move on
+    EVENTS.flush()
+
     # run final command after it all ends
     if final_cmd and window_behavior == "same-window":
         run_final_cmd(final_cmd, terminal, window_behavior)
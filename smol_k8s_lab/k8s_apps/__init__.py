@@ -75,10 +75,14 @@ def setup_oidc_provider(argocd: ArgoCD,
                         vouch_dict: dict = {},
                         pvc_storage_class: str = "local-path",
                         bw: BwCLI = None,
-                        argocd_fqdn: str = "") -> Zitadel | None:
+                        argocd_fqdn: str = "",
+                        oidc_plan: dict = {}) -> Zitadel | None:
     """
     sets up oidc provider. only zitadel is supported right now
 
+    oidc_plan is a dict of other apps to create OIDC apps for in Zitadel all at
+    once, see identity_provider.zitadel_provisioning.build_oidc_plan()
+
     Returns Zitadel object for configuring other Zitadel authed services
 
     IF we choose to add keycloak back, we'll be adding the following arg
@@ -110,7 +114,8 @@ def setup_oidc_provider(argocd: ArgoCD,
                     zitadel_dict,
                     pvc_storage_class,
                     api_tls_verify,
-                    bitwarden=bw
+                    bitwarden=bw,
+                    oidc_plan=oidc_plan
                     )
         else:
             configure_zitadel(argocd, zitadel_dict, bitwarden=bw)
@@ -2,6 +2,7 @@ import logging as log
 from rich.prompt import Prompt
 from smol_k8s_lab.bitwarden.bw_cli import BwCLI, create_custom_field
 from smol_k8s_lab.k8s_apps.identity_provider.zitadel_api import Zitadel
+from smol_k8s_lab.k8s_apps.identity_provider.zitadel_provisioning import get_oidc_creds
 from smol_k8s_lab.k8s_tools.argocd_util import ArgoCD
 from smol_k8s_lab.utils.rich_cli.console_logging import header
 from smol_k8s_lab.utils.passwords import create_password
@@ -198,14 +199,8 @@ def create_vouch_app(provider_hostname: str,
     """
     # create Vouch OIDC Application
     # if provider == 'zitadel':
-    log.info("Creating an OIDC application for Vouch via Zitadel...")
-    vouch_dict = zitadel.create_application(
-            "vouch",
-            f"https://{vouch_hostname}/auth",
-            [f"https://{vouch_hostname}"]
-            )
-    zitadel.create_role("vouch_users", "Vouch Users", "vouch_users")
-    zitadel.update_user_grant(['vouch_users'])
+    log.info("Getting the OIDC application for Vouch from Zitadel...")
+    vouch_dict = get_oidc_creds(zitadel, 'vouch', {'hostname': vouch_hostname})
 
     client_id = vouch_dict['client_id']
     client_secret = vouch_dict['client_secret']
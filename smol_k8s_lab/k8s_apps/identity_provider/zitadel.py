@@ -3,9 +3,14 @@ from json import loads
 import logging as log
 from smol_k8s_lab.bitwarden.bw_cli import BwCLI, create_custom_field
 from smol_k8s_lab.k8s_apps.identity_provider.zitadel_api import Zitadel
+from smol_k8s_lab.k8s_apps.identity_provider.zitadel_provisioning import (
+        argocd_oidc_spec, grant_role_keys, provision_oidc_apps)
 from smol_k8s_lab.k8s_apps.operators.minio import create_minio_alias
 from smol_k8s_lab.k8s_tools.argocd_util import ArgoCD
-from smol_k8s_lab.k8s_tools.restores import restore_seaweedfs, restore_cnpg_cluster
+from smol_k8s_lab.k8s_tools.restores import (restore_seaweedfs,
+                                             restore_cnpg_cluster,
+                                             restore_step,
+                                             run_restore_plan)
 from smol_k8s_lab.utils.value_from import process_backup_vals, extract_secret
 from smol_k8s_lab.utils.passwords import create_password
 from smol_k8s_lab.utils.rich_cli.console_logging import sub_header, header
@@ -15,10 +20,12 @@ def configure_zitadel(argocd: ArgoCD,
                       cfg: dict,
                       pvc_storage_class: str = "",
                       api_tls_verify: bool = False,
-                      bitwarden: BwCLI = None) -> dict | None:
+                      bitwarden: BwCLI = None,
+                      oidc_plan: dict = {}) -> dict | None:
     """
     Installs zitadel as a Argo CD Applications. If cfg['init']['enabled']
-    is True, it also configures Argo CD as OIDC Clients.
+    is True, it also configures Argo CD as OIDC Clients, as well as any other
+    apps in the oidc_plan.
 
     Required Arguments:
         argocd:             ArgoCD obj for doing Argo operations
@@ -28,6 +35,8 @@ def configure_zitadel(argocd: ArgoCD,
     Optional Arguments:
         api_tls_verify:    bool, enable https verification for zitadel api
         bitwarden:         BwCLI obj, [optional] contains bitwarden session
+        oidc_plan:         dict, other apps to create OIDC apps for, see
+                           zitadel_provisioning.build_oidc_plan()
 
     If no init: Returns True if successful.
     If init AND vouch_hostname, returns vouch credentials
@@ -173,7 +182,8 @@ def configure_zitadel(argocd: ArgoCD,
                                         zitadel_namespace=zitadel_namespace,
                                         api_tls_verify=api_tls_verify,
                                         user_dict=initial_user_dict,
-                                        bitwarden=bitwarden)
+                                        bitwarden=bitwarden,
+                                        oidc_plan=oidc_plan)
         return vouch_dict
     else:
         log.info("Zitadel is already installed 🎉")
@@ -207,6 +217,9 @@ def configure_zitadel(argocd: ArgoCD,
                 log.error(e)
                 raise Exception(e)
 
+            # create all the other apps' OIDC apps and roles in one go
+            provision_oidc_apps(zitadel, oidc_plan)
+
             refresh_bitwarden(argocd, zitadel_hostname, bitwarden)
 
             # argocd.sync_app('argo-cd')
@@ -262,9 +275,10 @@ def initialize_zitadel(argocd: ArgoCD,
                        zitadel_namespace: str = "zitadel",
                        api_tls_verify: bool = False,
                        user_dict: dict = {},
-                       bitwarden: BwCLI = None) -> dict | None:
+                       bitwarden: BwCLI = None,
+                       oidc_plan: dict = {}) -> dict | None:
     """
-    Sets up initial zitadel user, Argo CD client
+    Sets up initial zitadel user, Argo CD client, and any other OIDC clients
     Arguments:
       zitadel_hostname:  str, the hostname of Zitadel
       api_tls_verify:    bool, whether or not to verify the TLS cert on request to api
@@ -272,6 +286,7 @@ def initialize_zitadel(argocd: ArgoCD,
                          gender, and project to create
       argocd_hostname:   str, the hostname of Argo CD for oidc app
       bitwarden:         BwCLI obj, [optional] session to use for bitwarden
+      oidc_plan:         dict, [optional] other apps to create OIDC clients for
 
     returns Zitadel() with admin user/admin service account created with session token
     """
@@ -296,18 +311,13 @@ def initialize_zitadel(argocd: ArgoCD,
     log.info("Creating a groups Zitadel Action (sends group info to Argo CD)")
     zitadel.create_groups_claim_action()
 
-    # create Argo CD OIDC Application
+    # create the Argo CD OIDC Application and roles for both Argo CD Admins and
+    # regular users, along with every other planned app. The user doesn't exist
+    # yet, so we grant all the roles at once after creating them below
     log.info("Creating an Argo CD application...")
-    redirect_uris = f"https://{argocd_hostname}/auth/callback"
-    logout_uris = [f"https://{argocd_hostname}"]
-    argocd_client = zitadel.create_application("argocd",
-                                               redirect_uris,
-                                               logout_uris)
-
-    # create roles for both Argo CD Admins and regular users
-    zitadel.create_role("argocd_administrators", "Argo CD Administrators",
-                        "argocd_administrators")
-    zitadel.create_role("argocd_users", "Argo CD Users", "argocd_users")
+    oidc_plan = {'argo_cd': argocd_oidc_spec({'hostname': argocd_hostname}),
+                 **oidc_plan}
+    argocd_client = provision_oidc_apps(zitadel, oidc_plan, grant=False)['argo_cd']
 
     # fields for updating the appset secret
     fields = {
@@ -336,11 +346,12 @@ def initialize_zitadel(argocd: ArgoCD,
     header("Creating a Zitadel user...")
     user_id = zitadel.create_user(bitwarden=bitwarden, **user_dict)
     zitadel.set_user_by_login_name(user_dict['admin_user'])
+    role_keys = grant_role_keys(oidc_plan)
     try:
-        zitadel.create_user_grant(['argocd_administrators'])
+        zitadel.create_user_grant(role_keys)
     except Exception as e:
         log.error(e)
-        zitadel.update_user_grant(['argocd_administrators'])
+        zitadel.update_user_grant(role_keys)
 
     # grant admin access to first user
     sub_header("creating user IAM membership with IAM_OWNER")
@@ -555,35 +566,40 @@ def restore_zitadel(argocd: ArgoCD,
 
     # then we create all the seaweedfs pvcs we lost and restore them
     snapshot_ids = restore_dict['restic_snapshot_ids']
-    restore_seaweedfs(
-            argocd,
-            'zitadel',
-            zitadel_namespace,
-            revision,
-            argo_path,
-            s3_backup_endpoint,
-            s3_backup_bucket,
-            access_key_id,
-            secret_access_key,
-            restic_repo_password,
-            s3_pvc_capacity,
-            pvc_storage_class,
-            "ReadWriteOnce",
-            snapshot_ids['seaweedfs_volume'],
-            snapshot_ids['seaweedfs_filer']
-            )
+    # seaweedfs has to be restored before the postgres database, because
+    # that's where the cnpg backups are
+    plan = {"seaweedfs": restore_step(restore_seaweedfs,
+                                      argocd,
+                                      'zitadel',
+                                      zitadel_namespace,
+                                      revision,
+                                      argo_path,
+                                      s3_backup_endpoint,
+                                      s3_backup_bucket,
+                                      access_key_id,
+                                      secret_access_key,
+                                      restic_repo_password,
+                                      s3_pvc_capacity,
+                                      pvc_storage_class,
+                                      "ReadWriteOnce",
+                                      snapshot_ids['seaweedfs_volume'],
+                                      snapshot_ids['seaweedfs_filer'])}
 
     # then we finally can restore the postgres database :D
     if restore_dict.get("cnpg_restore", False):
         psql_version = restore_dict.get("postgresql_version", 16)
         s3_endpoint = secrets.get('s3_endpoint', "")
-        restore_cnpg_cluster(argocd.k8s,
-                             'zitadel',
-                             zitadel_namespace,
-                             pgsql_cluster_name,
-                             psql_version,
-                             s3_endpoint,
-                             pg_access_key_id,
-                             pg_secret_access_key,
-                             pgsql_cluster_name,
-                             cnpg_backup_schedule)
+        plan["cnpg"] = restore_step(restore_cnpg_cluster,
+                                    argocd.k8s,
+                                    'zitadel',
+                                    zitadel_namespace,
+                                    pgsql_cluster_name,
+                                    psql_version,
+                                    s3_endpoint,
+                                    pg_access_key_id,
+                                    pg_secret_access_key,
+                                    pgsql_cluster_name,
+                                    cnpg_backup_schedule,
+                                    after=["seaweedfs"])
+
+    run_restore_plan('zitadel', plan)
@@ -8,14 +8,56 @@ from datetime import datetime, timezone, timedelta
 import logging as log
 from json import dumps
 import jwt
-from requests import request
-from requests.exceptions import SSLError
+import re
+from requests import Session, Response
+from requests.adapters import HTTPAdapter, Retry
+from requests.exceptions import ConnectionError, SSLError, Timeout
 from rich.prompt import Prompt
-from time import sleep
+from rich.table import Table
+from threading import Lock
+from time import monotonic, sleep
 
 # internal libraries
 from smol_k8s_lab.bitwarden.bw_cli import BwCLI
+from smol_k8s_lab.k8s_apps.identity_provider.zitadel_token import ZitadelTokenCache
 from smol_k8s_lab.utils.passwords import create_password
+from smol_k8s_lab.utils.rich_cli.console_logging import CONSOLE
+
+# (connect, read) timeouts in seconds for every call to the zitadel api
+API_TIMEOUT = (5, 30)
+
+# zitadel ids are long numeric strings, so we swap them out for a placeholder
+# when grouping latency stats per endpoint
+ID_REGEX = re.compile(r"/\d{6,}")
+
+
+def create_session(tls_verify: bool = False) -> Session:
+    """
+    Creates a requests Session that keeps connections to the zitadel api alive
+    and retries connection errors and 5xx responses with exponential backoff
+    plus a bit of jitter, so we don't hammer zitadel while it's starting up.
+
+    Read errors and 5xx responses are only retried for idempotent methods.
+    POSTs create things in zitadel, and if zitadel already did the write
+    before failing, retrying would make a duplicate, so POSTs are only
+    retried if we never connected at all.
+    """
+    retries = Retry(total=5,
+                    connect=5,
+                    read=3,
+                    status=5,
+                    backoff_factor=0.5,
+                    backoff_jitter=0.5,
+                    status_forcelist=[500, 502, 503, 504],
+                    raise_on_status=False)
+    adapter = HTTPAdapter(max_retries=retries, pool_connections=4, pool_maxsize=8)
+
+    session = Session()
+    session.verify = tls_verify
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
 
 class Zitadel():
     """
@@ -36,56 +78,163 @@ class Zitadel():
 
         self.verify = tls_verify
 
+        # one pooled session for every request, so we only do the TLS handshake once
+        self.session = create_session(tls_verify)
+
+        # per endpoint latency stats, e.g. {"POST projects": {"count": 1, ...}}
+        self.latency = {}
+        self.latency_lock = Lock()
+
         # verify the api is even up
         self.check_api_health()
 
-        # then get the token
-        self.api_token = self.generate_token(hostname, service_account_key_obj)
-
         self.headers = {
           'Content-Type': 'application/json',
-          'Accept': 'application/json',
-          'Authorization': f'Bearer {self.api_token}'
+          'Accept': 'application/json'
         }
 
+        # then get the token, reusing a cached one if it's still valid
+        self.service_account_key_obj = service_account_key_obj
+        self.token_cache = ZitadelTokenCache(hostname, service_account_key_obj)
+        self.token_lock = Lock()
+        self.api_token = ""
+        self.refresh_token()
+
         self.user_id = ""
         self.resource_owner = ""
 
-    def check_api_health(self,) -> True:
+        # credentials of the OIDC apps we've created, e.g. {"nextcloud": {...}}
+        self.oidc_apps = {}
+
+    def refresh_token(self, force: bool = False) -> None:
+        """
+        Makes sure self.api_token is valid for at least a couple more minutes.
+        Uses the cached token if it's still valid, else generates a new one.
+
+        force: bool, always generate a new token, e.g. if the api rejected ours
+        """
+        # requests can be sent from several threads at once when provisioning
+        with self.token_lock:
+            if not force and not self.token_cache.expiring():
+                return
+
+            if force or not self.token_cache.load():
+                access_token, expires_in = self.generate_token(
+                        self.hostname,
+                        self.service_account_key_obj
+                        )
+                self.token_cache.save(access_token, expires_in)
+
+            self.api_token = self.token_cache.access_token
+            self.headers['Authorization'] = f'Bearer {self.api_token}'
+
+    def request(self, method: str, url: str, **kwargs) -> Response:
+        """
+        Sends a request through our pooled session with the default timeouts
+        and records how long it took for the per endpoint latency stats.
+
+        If no headers are passed in, we use self.headers with our api token,
+        refreshing the token first if it's about to expire.
+        """
+        use_token = "headers" not in kwargs
+        if use_token:
+            self.refresh_token()
+            kwargs["headers"] = self.headers
+        kwargs.setdefault("timeout", API_TIMEOUT)
+
+        response = self.send(method, url, **kwargs)
+
+        # our token may have been revoked, so try once more with a new one
+        if use_token and response.status_code == 401:
+            log.debug("Zitadel API rejected our token, so we'll get a new one")
+            self.refresh_token(force=True)
+            response = self.send(method, url, **kwargs)
+
+        return response
+
+    def send(self, method: str, url: str, **kwargs) -> Response:
+        """
+        Sends a single request and records how long it took
+        """
+        start = monotonic()
+        try:
+            return self.session.request(method, url, **kwargs)
+        finally:
+            self.record_latency(method, url, monotonic() - start)
+
+    def record_latency(self, method: str, url: str, seconds: float) -> None:
+        """
+        adds a single request's duration to the stats for its endpoint
+        """
+        endpoint = ID_REGEX.sub("/{id}", url.split("?")[0])
+        endpoint = endpoint.replace(f"https://{self.hostname}", "")
+        # requests can be sent from several threads at once when provisioning
+        with self.latency_lock:
+            stats = self.latency.setdefault(f"{method} {endpoint}",
+                                            {"count": 0, "total": 0.0,
+                                             "min": seconds, "max": seconds})
+            stats["count"] += 1
+            stats["total"] += seconds
+            stats["min"] = min(stats["min"], seconds)
+            stats["max"] = max(stats["max"], seconds)
+
+    def print_latency_stats(self) -> None:
+        """
+        prints a table of per endpoint latency stats, but only in debug mode
+        """
+        if not self.latency or not log.getLogger().isEnabledFor(log.DEBUG):
+            return
+
+        table = Table(title="Zitadel API latency (seconds)")
+        for column in ["endpoint", "calls", "avg", "min", "max"]:
+            table.add_column(column)
+
+        for endpoint, stats in sorted(self.latency.items()):
+            table.add_row(endpoint,
+                          str(stats["count"]),
+                          f"{stats['total'] / stats['count']:.3f}",
+                          f"{stats['min']:.3f}",
+                          f"{stats['max']:.3f}")
+        CONSOLE.print(table)
+
+    def check_api_health(self, timeout: int = 600) -> True:
         """
         Loops and checks https://{self.api_url}healthz for an HTTP status.
         Returns True when the status code is 200 (success).
+
+        Raises an Exception if the api isn't up after timeout seconds.
         """
-        res = None
-        while True:
+        deadline = monotonic() + timeout
+        while monotonic() < deadline:
             log.debug("checking if api is up by querying the healthz endpoint,"
                       f" {self.api_url}, using verify={self.verify}")
 
             try:
-                res = request("GET", f"{self.api_url}healthz", verify=self.verify)
+                res = self.request("GET", f"{self.api_url}healthz", headers={})
             except SSLError:
                 log.warn(f"Looks like querying {self.api_url} gave an SSL error,"
                          "but we'll try again")
-                pass
-
-            if res:
+            except (ConnectionError, Timeout) as e:
+                log.debug(f"Zitadel API is not reachable yet: {e}")
+            else:
                 if res.status_code == 200:
                     log.info("Zitadel API is up now :)")
-                    break
-                else:
-                    # sleep just a couple of seconds to avoid being locked out or something
-                    sleep(2)
-                    log.debug("Zitadel API is not yet up :(")
-            else:
-                sleep(2)
+                    return True
+                log.debug("Zitadel API is not yet up :(")
+
+            # sleep just a couple of seconds to avoid being locked out or something
+            sleep(2)
 
-        return True
+        raise Exception(f"Zitadel API at {self.api_url} was not up after "
+                        f"{timeout} seconds")
 
-    def generate_token(self, hostname: str = "", secret_blob: dict = {}) -> str:
+    def generate_token(self, hostname: str = "", secret_blob: dict = {}) -> tuple:
         """
         Takes a Zitadel hostname string and service account private key json,
         and generates first a JWT and then an API token.
 
+        Returns tuple of (access_token, seconds until the access_token expires)
+
         For python jwt docs: https://github.com/jpadilla/pyjwt/
 
         secret_blob dictionary should look like:
@@ -121,8 +270,8 @@ class Zitadel():
                    'scope': scopes,
                    'assertion': encoded}
 
-        res = request("POST", f"https://{hostname}/oauth/v2/token",
-                      headers=headers, data=payload, verify=self.verify)
+        res = self.request("POST", f"https://{hostname}/oauth/v2/token",
+                           headers=headers, data=payload)
         log.debug(f"res is {res}")
 
         # I literally don't know if you should use json or json()
@@ -136,7 +285,10 @@ class Zitadel():
             log.debug(f"json_blob is {json_blob}")
             access_token = json_blob['access_token']
 
-        return(access_token)
+        # zitadel tells us how long the token lasts, but default to 30 minutes
+        expires_in = int(json_blob.get('expires_in', 1800))
+
+        return (access_token, expires_in)
 
     def create_project(self, project_name: str) -> None:
         """
@@ -151,13 +303,7 @@ class Zitadel():
               "privateLabelingSetting": "PRIVATE_LABELING_SETTING_UNSPECIFIED"
             })
 
-        response = request(
-                "POST",
-                self.api_url + "projects",
-                headers=self.headers,
-                data=payload,
-                verify=self.verify
-                )
+        response = self.request("POST", self.api_url + "projects", data=payload)
         log.debug(response.text)
 
         json_blob = response.json()
@@ -221,8 +367,8 @@ class Zitadel():
         log.info(f"payload for create user is {payload}")
 
         # get the user ID from the response
-        response = request("POST", self.api_url + 'users/human/_import',
-                           headers=self.headers, data=payload, verify=self.verify)
+        response = self.request("POST", self.api_url + 'users/human/_import',
+                                data=payload)
         log.info(response.text)
         return response.json()['userId']
 
@@ -247,11 +393,9 @@ class Zitadel():
           "roleKeys": role_keys
         })
 
-        response = request("POST",
-                           self.api_url + f"users/{user_id}/grants",
-                           headers=self.headers,
-                           data=payload,
-                           verify=self.verify)
+        response = self.request("POST",
+                                self.api_url + f"users/{user_id}/grants",
+                                data=payload)
         log.info(response.text)
 
         return response.json()['userGrantId']
@@ -276,15 +420,14 @@ class Zitadel():
                   }
             })
 
-        response = request("POST", url, headers=self.headers, data=payload,
-                           verify=self.verify)
+        response = self.request("POST", url, data=payload)
         log.info(response.text)
         user_roles = response.json()['result'][0]['roleKeys']
         grant_id = response.json()['result'][0]['id']
         log.info(f"{user_id} has grant id {grant_id} with roles: {user_roles}")
 
-        # now we can update the user's roles
-        role_keys.extend(user_roles)
+        # now we can update the user's roles, without duplicating any
+        role_keys = list(dict.fromkeys(role_keys + user_roles))
         log.debug(f"Assiging user_id, {user_id} the roles of "
                   f"[green]{role_keys}[/] in {self.project_id}")
 
@@ -292,8 +435,7 @@ class Zitadel():
 
         payload = dumps({"roleKeys": role_keys})
 
-        response = request("PUT", url, headers=self.headers, data=payload,
-                           verify=self.verify)
+        response = self.request("PUT", url, data=payload)
 
     def create_iam_membership(self, user_id: str, role: str):
         """
@@ -304,11 +446,7 @@ class Zitadel():
           "userId": user_id,
           "roles": [role]
         })
-        response = request("POST",
-                           url,
-                           headers=self.headers,
-                           data=payload,
-                           verify=self.verify)
+        response = self.request("POST", url, data=payload)
         log.info(response.text)
 
     def create_application(self,
@@ -356,11 +494,7 @@ class Zitadel():
         url = self.api_url + f'projects/{self.project_id}/apps/oidc'
         log.info(url)
 
-        response = request("POST",
-                           url,
-                           headers=self.headers,
-                           data=payload,
-                           verify=self.verify)
+        response = self.request("POST", url, data=payload)
         log.info(response.text)
         json_res = response.json()
 
@@ -436,11 +570,8 @@ class Zitadel():
         """
         log.info("Creating action...")
         while True:
-            response = request("POST",
-                               self.api_url + "actions",
-                               headers=self.headers,
-                               data=script,
-                               verify=self.verify)
+            response = self.request("POST", self.api_url + "actions",
+                                    data=script)
             log.debug(response.text)
             # if the response is not 200, just try again 🤷
             if response.status_code == 200:
@@ -458,11 +589,7 @@ class Zitadel():
             log.debug(f"url is {url}")
 
             while True:
-                response = request("POST",
-                                   url,
-                                   headers=self.headers,
-                                   data=action_payload,
-                                   verify=self.verify)
+                response = self.request("POST", url, data=action_payload)
                 log.debug(f"flows response is {response.text}")
 
                 # if the response is not 200, just try again 🤷
@@ -487,8 +614,7 @@ class Zitadel():
         url = f"{self.api_url}projects/{self.project_id}/roles"
         log.info(f"Creating a role, {role_key} using {url}")
 
-        response = request("POST", url, headers=self.headers, data=payload,
-                           verify=self.verify)
+        response = self.request("POST", url, data=payload)
 
         log.info(response.text)
 
@@ -498,8 +624,7 @@ class Zitadel():
         """
         url = f"{self.api_url}global/users/_by_login_name?loginName={user}"
 
-        response = request("GET", url, headers=self.headers, data={},
-                           verify=self.verify).json()
+        response = self.request("GET", url).json()
         log.debug(response)
 
         self.user_id = response['user']['id']
@@ -533,8 +658,7 @@ class Zitadel():
 
         self.headers['Content-Type'] = 'application/json'
 
-        response = request("POST", url, headers=self.headers, data=payload,
-                           verify=self.verify)
+        response = self.request("POST", url, data=payload)
 
         log.debug(f'response from set_project_by_name for "{project_name}" '
                   f'_search: {response.text}')
@@ -0,0 +1,230 @@
+"""
+Plans the Zitadel OIDC applications and roles for every enabled app up front,
+and then creates them all at once with a single user grant at the end, instead
+of each app's configure function creating its own app, roles, and grant.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import logging as log
+from ulid import ULID
+
+from smol_k8s_lab.k8s_apps.identity_provider.zitadel_api import Zitadel
+from smol_k8s_lab.k8s_tools.argocd_util import ArgoCD
+
+
+def oidc_spec(name: str,
+              redirect_uri: str,
+              logout_uris: list,
+              roles: dict,
+              grant: list,
+              extra: dict = {}) -> dict:
+    """
+    returns a dict describing one OIDC app to create in Zitadel:
+        name:         name of the OIDC application in Zitadel
+        redirect_uri: redirect uri string
+        logout_uris:  list of post logout redirect uri strings
+        roles:        dict of {role_key: display_name}, role_key is also the group
+        grant:        list of role keys to grant to the admin user
+        extra:        dict of any extra values to return with the app credentials
+    """
+    return {"name": name,
+            "redirect_uri": redirect_uri,
+            "logout_uris": logout_uris,
+            "roles": roles,
+            "grant": grant,
+            "extra": extra}
+
+
+def argocd_oidc_spec(secrets: dict) -> dict:
+    hostname = secrets['hostname']
+    return oidc_spec("argocd",
+                     f"https://{hostname}/auth/callback",
+                     [f"https://{hostname}"],
+                     {"argocd_administrators": "Argo CD Administrators",
+                      "argocd_users": "Argo CD Users"},
+                     ["argocd_administrators"])
+
+
+def vouch_oidc_spec(secrets: dict) -> dict:
+    hostname = secrets['hostname']
+    return oidc_spec("vouch",
+                     f"https://{hostname}/auth",
+                     [f"https://{hostname}"],
+                     {"vouch_users": "Vouch Users"},
+                     ["vouch_users"])
+
+
+def netmaker_oidc_spec(secrets: dict) -> dict:
+    return oidc_spec("netmaker",
+                     f"https://{secrets['api_hostname']}/api/oauth/callback",
+                     [f"https://{secrets['admin_hostname']}"],
+                     {"netmaker_users": "Netmaker Users"},
+                     ["netmaker_users"])
+
+
+def grafana_oidc_spec(secrets: dict) -> dict:
+    hostname = secrets['grafana_hostname']
+    return oidc_spec("grafana",
+                     f"https://{hostname}/login/generic_oauth",
+                     [f"https://{hostname}"],
+                     {"grafana_users": "grafana Users"},
+                     ["grafana_users"])
+
+
+def minio_oidc_spec(secrets: dict) -> dict:
+    hostname = secrets['user_console_hostname']
+    return oidc_spec("minio",
+                     f"https://{hostname}/oauth_callback",
+                     [f"https://{hostname}/login"],
+                     {"minio_users": "MinIO Users",
+                      "minio_admins": "MinIO Administrators"},
+                     ["minio_users", "minio_admins"])
+
+
+def nextcloud_oidc_spec(secrets: dict) -> dict:
+    hostname = secrets['hostname']
+    return oidc_spec("nextcloud",
+                     f"https://{hostname}/apps/oidc_login/oidc",
+                     [f"https://{hostname}"],
+                     {"nextcloud_users": "Nextcloud Users",
+                      "nextcloud_admins": "Nextcloud Admins"},
+                     ["nextcloud_admins"])
+
+
+def gotosocial_oidc_spec(secrets: dict) -> dict:
+    hostname = secrets['hostname']
+    return oidc_spec("gotosocial",
+                     f"https://{hostname}/auth/callback",
+                     [f"https://{hostname}"],
+                     {"gotosocial_users": "GoToSocial Users",
+                      "gotosocial_admins": "GoToSocial Admins"},
+                     ["gotosocial_admins"])
+
+
+def matrix_oidc_spec(secrets: dict) -> dict:
+    hostname = secrets['hostname']
+    # MAS (Matrix authentication service) needs the provider ULID in the redirect
+    provider_ulid = str(ULID())
+    auth_hostname = secrets.get("auth_hostname", "")
+    if auth_hostname:
+        redirect_uri = f"https://{auth_hostname}/upstream/callback/{provider_ulid}"
+    else:
+        redirect_uri = f"https://{hostname}/_synapse/client/oidc/callback"
+
+    return oidc_spec("matrix",
+                     redirect_uri,
+                     [f"https://{hostname}"],
+                     {"matrix_users": "Matrix Users"},
+                     ["matrix_users"],
+                     {"provider_ulid": provider_ulid})
+
+
+# smol-k8s-lab app name: (Argo CD app name, function to create the oidc spec)
+OIDC_APPS = {"vouch": ("vouch", vouch_oidc_spec),
+             "netmaker": ("netmaker", netmaker_oidc_spec),
+             "prometheus": ("prometheus", grafana_oidc_spec),
+             "minio_tenant": ("minio-tenant", minio_oidc_spec),
+             "nextcloud": ("nextcloud", nextcloud_oidc_spec),
+             "gotosocial": ("gotosocial", gotosocial_oidc_spec),
+             "matrix": ("matrix", matrix_oidc_spec)}
+
+
+def build_oidc_plan(argocd: ArgoCD, apps: dict) -> dict:
+    """
+    Collects the OIDC needs of every enabled app that will be initialized on
+    this run, so we can create them all in Zitadel before the installs start.
+
+    Returns a dict of {app_name: oidc_spec}
+    """
+    plan = {}
+    for app, (argo_app, create_spec) in OIDC_APPS.items():
+        app_cfg = apps.get(app, {})
+        if not app_cfg.get('enabled', False):
+            continue
+
+        init = app_cfg.get('init', {})
+        if not init.get('enabled', True):
+            continue
+
+        # restored apps already have their zitadel apps from the backup
+        if init.get('restore', {}).get('enabled', False):
+            continue
+
+        if argocd.check_if_app_exists(argo_app):
+            continue
+
+        plan[app] = create_spec(app_cfg['argo']['secret_keys'])
+
+    log.debug(f"zitadel OIDC plan is {plan}")
+    return plan
+
+
+def grant_role_keys(plan: dict) -> list:
+    """
+    returns the union of role keys to grant to the admin user for a plan
+    """
+    role_keys = []
+    for spec in plan.values():
+        for role_key in spec['grant']:
+            if role_key not in role_keys:
+                role_keys.append(role_key)
+    return role_keys
+
+
+def provision_oidc_apps(zitadel: Zitadel,
+                        plan: dict,
+                        grant: bool = True,
+                        max_workers: int = 8) -> dict:
+    """
+    Creates every OIDC application and role in the plan concurrently and then,
+    if grant is True, updates the admin user's grant once with all role keys.
+
+    Results are also kept in zitadel.oidc_apps for the app configure functions.
+    Returns dict of {app_name: {application_id, client_id, client_secret}}
+    """
+    if not plan:
+        return {}
+
+    log.info(f"Creating Zitadel OIDC applications for: {', '.join(plan)}")
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        app_futures = {}
+        role_futures = []
+        for app, spec in plan.items():
+            app_futures[app] = pool.submit(zitadel.create_application,
+                                           spec['name'],
+                                           spec['redirect_uri'],
+                                           spec['logout_uris'])
+            for role_key, display_name in spec['roles'].items():
+                role_futures.append(pool.submit(zitadel.create_role,
+                                                role_key,
+                                                display_name,
+                                                role_key))
+
+        # surface any errors from creating roles
+        for future in role_futures:
+            future.result()
+
+        results = {}
+        for app, future in app_futures.items():
+            app_creds = future.result()
+            if app_creds:
+                app_creds.update(plan[app]['extra'])
+            results[app] = app_creds
+
+    zitadel.oidc_apps.update(results)
+
+    if grant:
+        zitadel.update_user_grant(grant_role_keys(plan))
+
+    return results
+
+
+def get_oidc_creds(zitadel: Zitadel, app: str, secrets: dict) -> dict | None:
+    """
+    Returns the OIDC credentials for app from the provisioning results, or
+    creates the OIDC app, its roles, and grant right now if it wasn't planned.
+    """
+    if app in zitadel.oidc_apps:
+        return zitadel.oidc_apps[app]
+
+    create_spec = OIDC_APPS[app][1]
+    return provision_oidc_apps(zitadel, {app: create_spec(secrets)})[app]
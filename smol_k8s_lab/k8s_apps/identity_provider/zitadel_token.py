@@ -0,0 +1,78 @@
+"""
+Encrypted on disk cache of Zitadel API access tokens, so that re-runs of
+smol-k8s-lab can reuse a still valid token instead of re-authenticating.
+"""
+from base64 import urlsafe_b64encode
+from cryptography.fernet import Fernet, InvalidToken
+from hashlib import sha256
+from json import dumps, loads
+import logging as log
+from os import path
+from time import time
+
+from smol_k8s_lab.constants import XDG_CACHE_DIR
+from smol_k8s_lab.utils.artifacts import write_atomically
+
+# refresh the token this many seconds before it actually expires
+REFRESH_MARGIN = 120
+
+
+class ZitadelTokenCache():
+    """
+    Stores one access token per zitadel hostname and service account key id in
+    ~/.cache/smol-k8s-lab/zitadel/, encrypted with a key derived from the
+    service account's private key, so only someone holding that key can read it
+    """
+    def __init__(self,
+                 hostname: str,
+                 service_account_key_obj: dict,
+                 cache_dir: str = path.join(XDG_CACHE_DIR, 'zitadel')):
+        key_id = service_account_key_obj['keyId']
+        self.cache_file = path.join(cache_dir, f"{hostname}_{key_id}.token")
+
+        private_key = service_account_key_obj['key'].encode()
+        self.fernet = Fernet(urlsafe_b64encode(sha256(private_key).digest()))
+
+        self.access_token = ""
+        self.expires_at = 0.0
+
+    def expiring(self) -> bool:
+        """
+        returns True if there's no token or it expires within REFRESH_MARGIN
+        """
+        return not self.access_token or time() > self.expires_at - REFRESH_MARGIN
+
+    def load(self) -> bool:
+        """
+        loads the token from the cache file. Returns True if it's still valid
+        """
+        if not path.exists(self.cache_file):
+            return False
+
+        try:
+            with open(self.cache_file, 'rb') as cache_file:
+                token = loads(self.fernet.decrypt(cache_file.read()))
+        except (InvalidToken, ValueError, OSError) as e:
+            log.debug(f"Couldn't read cached zitadel token: {e}")
+            return False
+
+        self.access_token = token['access_token']
+        self.expires_at = token['expires_at']
+
+        if self.expiring():
+            log.debug("Cached zitadel token is expired or about to expire")
+            return False
+
+        log.debug("Reusing cached zitadel token")
+        return True
+
+    def save(self, access_token: str, expires_in: int) -> None:
+        """
+        saves the token to the cache file, atomically and only readable by us
+        """
+        self.access_token = access_token
+        self.expires_at = time() + expires_in
+
+        token = dumps({"access_token": access_token,
+                       "expires_at": self.expires_at})
+        write_atomically(self.cache_file, self.fernet.encrypt(token.encode()))
@@ -5,6 +5,7 @@ import logging as log
 from smol_k8s_lab.k8s_tools.argocd_util import ArgoCD
 from smol_k8s_lab.bitwarden.bw_cli import BwCLI
 from smol_k8s_lab.k8s_apps.identity_provider.zitadel_api import Zitadel
+from smol_k8s_lab.k8s_apps.identity_provider.zitadel_provisioning import get_oidc_creds
 from smol_k8s_lab.utils.rich_cli.console_logging import sub_header, header
 
 def configure_prometheus_stack(argocd: ArgoCD,
@@ -50,15 +51,9 @@ def configure_prometheus_stack(argocd: ArgoCD,
 
         # create prometheus OIDC Application
         if zitadel:
-            log.debug("Creating an OIDC application in Zitadel...")
+            log.debug("Getting the Grafana OIDC application from Zitadel...")
             zitadel_hostname = zitadel.hostname
-            logout_uris = [f"https://{grafana_hostname}"]
-            redirect_uris = f"https://{grafana_hostname}/login/generic_oauth"
-            oidc_creds = zitadel.create_application("grafana",
-                                                    redirect_uris,
-                                                    logout_uris)
-            zitadel.create_role("grafana_users", "grafana Users", "grafana_users")
-            zitadel.update_user_grant(['grafana_users'])
+            oidc_creds = get_oidc_creds(zitadel, 'prometheus', secrets)
         else:
             zitadel_hostname = ""
 
@@ -7,10 +7,10 @@ DESCRIPTION: configures metallb
 """
 # internal libraries
 from smol_k8s_lab.k8s_tools.k8s_lib import K8s
+from smol_k8s_lab.utils.artifacts import fetch_text
 
 # external libraries
 import logging as log
-import requests
 from ruamel.yaml import YAML
 
 
@@ -27,7 +27,7 @@ def configure_metallb(k8s_obj: K8s, address_pool: list = []) -> None:
     # get live metallb version to use
     appset_url = ("https://raw.githubusercontent.com/small-hack/argocd-apps"
                   "/main/metallb/metallb_argocd_app.yaml")
-    res = requests.get(appset_url).text
+    res = fetch_text(appset_url)
 
     # load the yaml file we just downloaded into memory as a dict object
     yaml = YAML()
@@ -1,6 +1,7 @@
 import logging as log
 from smol_k8s_lab.bitwarden.bw_cli import BwCLI, create_custom_field
 from smol_k8s_lab.k8s_apps.identity_provider.zitadel_api import Zitadel
+from smol_k8s_lab.k8s_apps.identity_provider.zitadel_provisioning import get_oidc_creds
 from smol_k8s_lab.k8s_tools.argocd_util import ArgoCD
 from smol_k8s_lab.utils.rich_cli.console_logging import header
 from smol_k8s_lab.utils.passwords import create_password
@@ -211,14 +212,11 @@ def create_netmaker_app(provider: str,
     """
     # create Netmaker OIDC Application
     if provider == 'zitadel':
-        log.info("Creating an OIDC application for Netmaker via Zitadel...")
-        netmaker_dict = zitadel.create_application(
-                "netmaker",
-                f"https://{api_hostname}/api/oauth/callback",
-                [f"https://{dashboard_hostname}"]
-                )
-        zitadel.create_role("netmaker_users", "Netmaker Users", "netmaker_users")
-        zitadel.update_user_grant(['netmaker_users'])
+        log.info("Getting the OIDC application for Netmaker from Zitadel...")
+        netmaker_dict = get_oidc_creds(zitadel,
+                                       'netmaker',
+                                       {'api_hostname': api_hostname,
+                                        'admin_hostname': dashboard_hostname})
 
         client_id = netmaker_dict['client_id']
         client_secret = netmaker_dict['client_secret']
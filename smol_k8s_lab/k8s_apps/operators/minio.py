@@ -6,6 +6,7 @@ from os import makedirs
 from smol_k8s_lab.constants import HOME_DIR
 from smol_k8s_lab.bitwarden.bw_cli import BwCLI
 from smol_k8s_lab.k8s_apps.identity_provider.zitadel_api import Zitadel
+from smol_k8s_lab.k8s_apps.identity_provider.zitadel_provisioning import get_oidc_creds
 from smol_k8s_lab.k8s_tools.argocd_util import ArgoCD
 from smol_k8s_lab.utils.passwords import create_password
 from smol_k8s_lab.utils.minio_lib import BetterMinio
@@ -61,15 +62,9 @@ def configure_minio_tenant(argocd: ArgoCD,
         secret_key = create_password(characters=72)
 
         if zitadel:
-            log.info("Creating a MinIO OIDC application via Zitadel...")
+            log.info("Getting the MinIO OIDC application from Zitadel...")
             redirect_uris = f"https://{minio_user_console_hostname}/oauth_callback"
-            logout_uris = [f"https://{minio_user_console_hostname}/login"]
-            minio_dict = zitadel.create_application("minio",
-                                                    redirect_uris,
-                                                    logout_uris)
-            zitadel.create_role("minio_users", "MinIO Users", "minio_users")
-            zitadel.create_role("minio_admins", "MinIO Administrators", "minio_admins")
-            zitadel.update_user_grant(['minio_users', 'minio_admins'])
+            minio_dict = get_oidc_creds(zitadel, 'minio_tenant', secrets)
 
             # creates the initial root credentials secret for the minio tenant
             credentials_exports = {
@@ -82,7 +77,7 @@ def configure_minio_tenant(argocd: ArgoCD,
             MINIO_IDENTITY_OPENID_COMMENT="zitadelOIDC"
             MINIO_IDENTITY_OPENID_SCOPES="openid,email,groups"
             MINIO_IDENTITY_OPENID_CLAIM_NAME=groups
-            MINIO_IDENTITY_OPENID_REDIRECT_URI={redirect_uris[0]}
+            MINIO_IDENTITY_OPENID_REDIRECT_URI={redirect_uris}
                                    """}
         else:
             # creates the initial root credentials secret for the minio tenant
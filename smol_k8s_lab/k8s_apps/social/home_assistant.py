@@ -3,7 +3,9 @@
 # internal libraries
 from smol_k8s_lab.bitwarden.bw_cli import BwCLI, create_custom_field
 from smol_k8s_lab.k8s_tools.argocd_util import ArgoCD
-from smol_k8s_lab.k8s_tools.restores import create_restic_restore_job
+from smol_k8s_lab.k8s_tools.restores import (create_restic_restore_job,
+                                             restore_step,
+                                             run_restore_plan)
 from smol_k8s_lab.utils.passwords import create_password
 from smol_k8s_lab.utils.rich_cli.console_logging import sub_header, header
 from smol_k8s_lab.utils.value_from import extract_secret, process_backup_vals
@@ -179,25 +181,32 @@ def restore_home_assistant(argocd: ArgoCD,
         tolerations = {}
 
     # recreates the PVC and runs a k8s restic restore job to populate it
-    create_restic_restore_job(argocd.k8s,
-                             'home-assistant',
-                             'home-assistant',
-                             home_assistant_namespace,
-                             secrets['pvc_capacity'],
-                             'home-assistant-pvc',
-                             s3_backup_endpoint,
-                             s3_backup_bucket,
-                             access_key_id,
-                             secret_access_key,
-                             restic_repo_password,
-                             pvc_storage_class,
-                             secrets.get('pvc_access_mode', 'ReadWriteOnce'),
-                             restore_dict['restic_snapshot_ids']['home_assistant'],
-                             '/config',
-                             affinity,
-                             tolerations)
-
-    argocd.k8s.reload_deployment('home-assistant', home_assistant_namespace)
+    plan = {"home-assistant pvc": restore_step(
+            create_restic_restore_job,
+            argocd.k8s,
+            'home-assistant',
+            'home-assistant',
+            home_assistant_namespace,
+            secrets['pvc_capacity'],
+            'home-assistant-pvc',
+            s3_backup_endpoint,
+            s3_backup_bucket,
+            access_key_id,
+            secret_access_key,
+            restic_repo_password,
+            pvc_storage_class,
+            secrets.get('pvc_access_mode', 'ReadWriteOnce'),
+            restore_dict['restic_snapshot_ids']['home_assistant'],
+            '/config',
+            affinity,
+            tolerations
+            )}
+
+    plan["reload"] = restore_step(argocd.k8s.reload_deployment,
+                                  'home-assistant',
+                                  home_assistant_namespace,
+                                  after=["home-assistant pvc"])
+    run_restore_plan('home-assistant', plan)
 
 
 def setup_bitwarden_items(argocd: ArgoCD,
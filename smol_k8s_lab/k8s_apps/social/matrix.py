@@ -2,11 +2,14 @@
 from smol_k8s_lab.bitwarden.bw_cli import BwCLI, create_custom_field
 from smol_k8s_lab.k8s_apps.operators.minio import create_minio_alias
 from smol_k8s_lab.k8s_apps.identity_provider.zitadel_api import Zitadel
+from smol_k8s_lab.k8s_apps.identity_provider.zitadel_provisioning import get_oidc_creds
 from smol_k8s_lab.k8s_tools.argocd_util import ArgoCD
 from smol_k8s_lab.k8s_tools.restores import (restore_seaweedfs,
                                              k8up_restore_pvc,
                                              recreate_pvc,
-                                             restore_cnpg_cluster)
+                                             restore_cnpg_cluster,
+                                             restore_step,
+                                             run_restore_plan)
 from smol_k8s_lab.utils.value_from import process_backup_vals, extract_secret
 from smol_k8s_lab.utils.rich_cli.console_logging import sub_header, header
 from smol_k8s_lab.utils.passwords import create_password
@@ -90,27 +93,19 @@ def configure_matrix(argocd: ArgoCD,
 
         # create Matrix OIDC Application
         if zitadel and not restore_enabled:
-            log.debug("Creating an OIDC application in Zitadel...")
+            log.debug("Getting the Matrix OIDC application from Zitadel...")
             mas_issuer = f"https://{zitadel.hostname}"
             mas_client_id = str(ULID())
-            mas_provider_ulid = str(ULID())
             mas_client_secret = create_password()
             mas_admin_token = create_password()
-            matrix_auth_hostname = secrets.get("auth_hostname", "")
             zitadel_hostname = zitadel.hostname
-            logout_uris = [f"https://{matrix_hostname}"]
 
-            # If using MAS (Matrix authentication service), use different redirect URI
-            if matrix_auth_hostname:
-                redirect_uris = f"https://{matrix_auth_hostname}/upstream/callback/{mas_provider_ulid}"
+            # the MAS (Matrix authentication service) redirect URI uses this ULID
+            oidc_creds = get_oidc_creds(zitadel, 'matrix', secrets)
+            if oidc_creds:
+                mas_provider_ulid = oidc_creds['provider_ulid']
             else:
-                redirect_uris = f"https://{matrix_hostname}/_synapse/client/oidc/callback"
-
-            oidc_creds = zitadel.create_application("matrix",
-                                                    redirect_uris,
-                                                    logout_uris)
-            zitadel.create_role("matrix_users", "Matrix Users", "matrix_users")
-            zitadel.update_user_grant(['matrix_users'])
+                mas_provider_ulid = str(ULID())
         else:
             zitadel_hostname = ""
 
@@ -673,38 +668,42 @@ def restore_matrix(argocd: ArgoCD,
 
     # then we create all the seaweedfs pvcs we lost and restore them
     snapshot_ids = restore_dict['restic_snapshot_ids']
-    restore_seaweedfs(
-            argocd,
-            'matrix',
-            matrix_namespace,
-            revision,
-            argo_path,
-            s3_backup_endpoint,
-            s3_backup_bucket,
-            access_key_id,
-            secret_access_key,
-            restic_repo_password,
-            s3_pvc_capacity,
-            pvc_storage_class,
-            "ReadWriteOnce",
-            snapshot_ids['seaweedfs_volume'],
-            snapshot_ids['seaweedfs_filer']
-            )
+    # seaweedfs has to be restored before the postgres database, because
+    # that's where the cnpg backups are, but the matrix PVCs can all be
+    # restored at the same time as both of those
+    plan = {"seaweedfs": restore_step(restore_seaweedfs,
+                                      argocd,
+                                      'matrix',
+                                      matrix_namespace,
+                                      revision,
+                                      argo_path,
+                                      s3_backup_endpoint,
+                                      s3_backup_bucket,
+                                      access_key_id,
+                                      secret_access_key,
+                                      restic_repo_password,
+                                      s3_pvc_capacity,
+                                      pvc_storage_class,
+                                      "ReadWriteOnce",
+                                      snapshot_ids['seaweedfs_volume'],
+                                      snapshot_ids['seaweedfs_filer'])}
 
     # then we finally can restore the postgres database :D
     if restore_dict.get("cnpg_restore", False):
         psql_version = restore_dict.get("postgresql_version", 16)
         s3_endpoint = secrets.get('s3_endpoint', "")
-        restore_cnpg_cluster(argocd.k8s,
-                             'matrix',
-                             matrix_namespace,
-                             pgsql_cluster_name,
-                             psql_version,
-                             s3_endpoint,
-                             pg_access_key_id,
-                             pg_secret_access_key,
-                             pgsql_cluster_name,
-                             cnpg_backup_schedule)
+        plan["cnpg"] = restore_step(restore_cnpg_cluster,
+                                    argocd.k8s,
+                                    'matrix',
+                                    matrix_namespace,
+                                    pgsql_cluster_name,
+                                    psql_version,
+                                    s3_endpoint,
+                                    pg_access_key_id,
+                                    pg_secret_access_key,
+                                    pgsql_cluster_name,
+                                    cnpg_backup_schedule,
+                                    after=["seaweedfs"])
 
     # then we begin the restic restore of all the matrix PVCs we lost
     for pvc in ['media', 'synapse_config', 'signing_key']:
@@ -712,24 +711,28 @@ def restore_matrix(argocd: ArgoCD,
         if pvc_enabled and pvc_enabled.lower() != 'false':
             pvc_name = "matrix-" + pvc.replace("_","-")
             # creates the matrix pvc
-            recreate_pvc(argocd.k8s,
-                         'matrix',
-                         pvc_name,
-                         matrix_namespace,
-                         secrets[f'{pvc}_storage'],
-                         pvc_storage_class,
-                         secrets[f'{pvc}_access_mode'],
-                         "matrix-pvc")
+            plan[f"{pvc_name} pvc"] = restore_step(recreate_pvc,
+                                                   argocd.k8s,
+                                                   'matrix',
+                                                   pvc_name,
+                                                   matrix_namespace,
+                                                   secrets[f'{pvc}_storage'],
+                                                   pvc_storage_class,
+                                                   secrets[f'{pvc}_access_mode'],
+                                                   "matrix-pvc")
 
             # restores the restic backup to this pvc
-            k8up_restore_pvc(argocd.k8s,
-                             'matrix',
-                             pvc_name,
-                             'matrix',
-                             s3_backup_endpoint,
-                             s3_backup_bucket,
-                             access_key_id,
-                             secret_access_key,
-                             restic_repo_password,
-                             snapshot_ids[f'matrix_{pvc}']
-                             )
+            plan[pvc_name] = restore_step(k8up_restore_pvc,
+                                          argocd.k8s,
+                                          'matrix',
+                                          pvc_name,
+                                          'matrix',
+                                          s3_backup_endpoint,
+                                          s3_backup_bucket,
+                                          access_key_id,
+                                          secret_access_key,
+                                          restic_repo_password,
+                                          snapshot_ids[f'matrix_{pvc}'],
+                                          after=[f"{pvc_name} pvc"])
+
+    run_restore_plan('matrix', plan)
@@ -2,11 +2,14 @@
 from smol_k8s_lab.bitwarden.bw_cli import BwCLI, create_custom_field
 from smol_k8s_lab.k8s_apps.operators.minio import create_minio_alias
 from smol_k8s_lab.k8s_apps.identity_provider.zitadel_api import Zitadel
+from smol_k8s_lab.k8s_apps.identity_provider.zitadel_provisioning import get_oidc_creds
 from smol_k8s_lab.k8s_apps.social.nextcloud_occ_commands import Nextcloud
 from smol_k8s_lab.k8s_tools.argocd_util import ArgoCD
 from smol_k8s_lab.k8s_tools.restores import (restore_seaweedfs,
                                              k8up_restore_pvc,
-                                             restore_cnpg_cluster)
+                                             restore_cnpg_cluster,
+                                             restore_step,
+                                             run_restore_plan)
 from smol_k8s_lab.utils.passwords import create_password
 from smol_k8s_lab.utils.rich_cli.console_logging import sub_header, header
 from smol_k8s_lab.utils.run.subproc import subproc
@@ -129,21 +132,8 @@ def configure_nextcloud(argocd: ArgoCD,
 
         # configure OIDC
         if zitadel and not restore_enabled:
-            log.debug("Creating a Nextcloud OIDC application in Zitadel...")
-            redirect_uris = f"https://{nextcloud_hostname}/apps/oidc_login/oidc"
-            logout_uris = [f"https://{nextcloud_hostname}"]
-            oidc_creds = zitadel.create_application(
-                    "nextcloud",
-                    redirect_uris,
-                    logout_uris
-                    )
-            zitadel.create_role("nextcloud_users",
-                                "Nextcloud Users",
-                                "nextcloud_users")
-            zitadel.create_role("nextcloud_admins",
-                                "Nextcloud Admins",
-                                "nextcloud_admins")
-            zitadel.update_user_grant(['nextcloud_admins'])
+            log.debug("Getting the Nextcloud OIDC application from Zitadel...")
+            oidc_creds = get_oidc_creds(zitadel, 'nextcloud', secrets)
             zitadel_hostname = zitadel.hostname
         else:
             zitadel_hostname = ""
@@ -286,65 +276,77 @@ def restore_nextcloud(argocd: ArgoCD,
     snapshot_ids = restore_dict['restic_snapshot_ids']
     s3_pvc_storage_class = secrets.get("s3_pvc_storage_class", global_pvc_storage_class)
 
-    restore_seaweedfs(
-            argocd,
-            'nextcloud',
-            nextcloud_namespace,
-            revision,
-            argo_path,
-            s3_backup_endpoint,
-            s3_backup_bucket,
-            access_key_id,
-            secret_access_key,
-            restic_repo_password,
-            s3_pvc_capacity,
-            s3_pvc_storage_class,
-            "ReadWriteOnce",
-            snapshot_ids['seaweedfs_volume'],
-            snapshot_ids['seaweedfs_filer'])
+    # seaweedfs has to be restored before the postgres database, because
+    # that's where the cnpg backups are, but the nextcloud PVCs can all be
+    # restored at the same time as both of those
+    plan = {"seaweedfs": restore_step(restore_seaweedfs,
+                                      argocd,
+                                      'nextcloud',
+                                      nextcloud_namespace,
+                                      revision,
+                                      argo_path,
+                                      s3_backup_endpoint,
+                                      s3_backup_bucket,
+                                      access_key_id,
+                                      secret_access_key,
+                                      restic_repo_password,
+                                      s3_pvc_capacity,
+                                      s3_pvc_storage_class,
+                                      "ReadWriteOnce",
+                                      snapshot_ids['seaweedfs_volume'],
+                                      snapshot_ids['seaweedfs_filer'])}
 
     # then we finally can restore the postgres database :D
     if restore_dict.get("cnpg_restore", False):
         psql_version = restore_dict.get("postgresql_version", 16)
         s3_endpoint = secrets.get('s3_endpoint', "")
-        restore_cnpg_cluster(argocd.k8s,
-                             'nextcloud',
-                             nextcloud_namespace,
-                             pgsql_cluster_name,
-                             psql_version,
-                             s3_endpoint,
-                             pg_access_key_id,
-                             pg_secret_access_key,
-                             pgsql_cluster_name,
-                             cnpg_backup_schedule)
+        plan["cnpg"] = restore_step(restore_cnpg_cluster,
+                                    argocd.k8s,
+                                    'nextcloud',
+                                    nextcloud_namespace,
+                                    pgsql_cluster_name,
+                                    psql_version,
+                                    s3_endpoint,
+                                    pg_access_key_id,
+                                    pg_secret_access_key,
+                                    pgsql_cluster_name,
+                                    cnpg_backup_schedule,
+                                    after=["seaweedfs"])
 
     podconfig_yaml = (
             f"https://raw.githubusercontent.com/small-hack/argocd-apps/{revision}/"
             f"{argo_path}pvc_argocd_appset.yaml"
             )
-    argocd.k8s.apply_manifests(podconfig_yaml, argocd.namespace)
+    plan["pvc appset"] = restore_step(argocd.k8s.apply_manifests,
+                                      podconfig_yaml,
+                                      argocd.namespace)
 
     # then we begin the restic restore of all the nextcloud PVCs we lost
     for pvc in ['files', 'config']:
         pvc_enabled = secrets.get(f'{pvc}_pvc_enabled', 'false')
         if pvc_enabled and pvc_enabled.lower() != 'false':
             # restores the nextcloud pvc
-            k8up_restore_pvc(argocd.k8s,
-                             'nextcloud',
-                             f'nextcloud-{pvc}',
-                             'nextcloud',
-                             s3_backup_endpoint,
-                             s3_backup_bucket,
-                             access_key_id,
-                             secret_access_key,
-                             restic_repo_password,
-                             snapshot_ids[f'nextcloud_{pvc}'],
-                             "file-backups-podconfig"
-                             )
-
-    # todo: from here on out, this could be async to start on other tasks
-    # install nextcloud as usual, but wait on it this time
-    argocd.install_app('nextcloud', argo_dict, True)
+            plan[f'nextcloud-{pvc}'] = restore_step(k8up_restore_pvc,
+                                                    argocd.k8s,
+                                                    'nextcloud',
+                                                    f'nextcloud-{pvc}',
+                                                    'nextcloud',
+                                                    s3_backup_endpoint,
+                                                    s3_backup_bucket,
+                                                    access_key_id,
+                                                    secret_access_key,
+                                                    restic_repo_password,
+                                                    snapshot_ids[f'nextcloud_{pvc}'],
+                                                    "file-backups-podconfig",
+                                                    after=["pvc appset"])
+
+    # install nextcloud as usual once everything is restored, but wait on it
+    plan["install"] = restore_step(argocd.install_app,
+                                   'nextcloud',
+                                   argo_dict,
+                                   True,
+                                   after=list(plan))
+    run_restore_plan('nextcloud', plan)
 
     # verify nextcloud rolled out completely, just in case
     rollout = (f"kubectl rollout status -n {nextcloud_namespace} "
@@ -2,6 +2,7 @@ from smol_k8s_lab.utils.run.subproc import subproc
 from smol_k8s_lab.k8s_tools.k8s_lib import K8s
 from json import dumps
 import logging as log
+from time import sleep
 
 
 class Nextcloud():
@@ -100,6 +101,20 @@ class Nextcloud():
                           spinner=self.quiet)
             log.info(res)
 
+            # don't return till nextcloud says maintenance mode actually changed
+            self.wait_for_maintenance_mode(mode == "on")
+
+    def wait_for_maintenance_mode(self, enabled: bool, timeout: int = 120) -> None:
+        """
+        polls nextcloud's maintenance:mode status until it's enabled/disabled
+        """
+        for _ in range(timeout // 2):
+            if self.check_maintenance_mode_status() == enabled:
+                return
+            sleep(2)
+        raise Exception(f"Nextcloud maintenance mode didn't turn "
+                        f"{'on' if enabled else 'off'} after {timeout} seconds")
+
     def scan_files(self) -> None:
         """
         scans all file metadata into the database
@@ -4,7 +4,9 @@ from smol_k8s_lab.k8s_apps.operators.minio import create_minio_alias
 from smol_k8s_lab.k8s_tools.argocd_util import ArgoCD
 from smol_k8s_lab.k8s_tools.restores import (restore_seaweedfs,
                                              k8up_restore_pvc,
-                                             restore_cnpg_cluster)
+                                             restore_cnpg_cluster,
+                                             restore_step,
+                                             run_restore_plan)
 from smol_k8s_lab.utils.passwords import create_password
 from smol_k8s_lab.utils.rich_cli.console_logging import sub_header, header
 from smol_k8s_lab.utils.run.subproc import subproc
@@ -505,43 +507,50 @@ def restore_peertube(argocd: ArgoCD,
     snapshot_ids = restore_dict['restic_snapshot_ids']
     s3_pvc_storage_class = secrets.get("s3_pvc_storage_class", global_pvc_storage_class)
 
-    restore_seaweedfs(
-            argocd,
-            'peertube',
-            peertube_namespace,
-            revision,
-            argo_path,
-            s3_backup_endpoint,
-            s3_backup_bucket,
-            access_key_id,
-            secret_access_key,
-            restic_repo_password,
-            s3_pvc_capacity,
-            s3_pvc_storage_class,
-            "ReadWriteOnce",
-            snapshot_ids['seaweedfs_volume'],
-            snapshot_ids['seaweedfs_filer'])
+    # seaweedfs has to be restored before the postgres database, because
+    # that's where the cnpg backups are, but the peertube PVCs can all be
+    # restored at the same time as both of those
+    plan = {"seaweedfs": restore_step(restore_seaweedfs,
+                                      argocd,
+                                      'peertube',
+                                      peertube_namespace,
+                                      revision,
+                                      argo_path,
+                                      s3_backup_endpoint,
+                                      s3_backup_bucket,
+                                      access_key_id,
+                                      secret_access_key,
+                                      restic_repo_password,
+                                      s3_pvc_capacity,
+                                      s3_pvc_storage_class,
+                                      "ReadWriteOnce",
+                                      snapshot_ids['seaweedfs_volume'],
+                                      snapshot_ids['seaweedfs_filer'])}
 
     # then we finally can restore the postgres database :D
     if restore_dict.get("cnpg_restore", False):
         psql_version = restore_dict.get("postgresql_version", 16)
         s3_endpoint = secrets.get('s3_endpoint', "")
-        restore_cnpg_cluster(argocd.k8s,
-                             'peertube',
-                             peertube_namespace,
-                             pgsql_cluster_name,
-                             psql_version,
-                             s3_endpoint,
-                             pg_access_key_id,
-                             pg_secret_access_key,
-                             pgsql_cluster_name,
-                             cnpg_backup_schedule)
+        plan["cnpg"] = restore_step(restore_cnpg_cluster,
+                                    argocd.k8s,
+                                    'peertube',
+                                    peertube_namespace,
+                                    pgsql_cluster_name,
+                                    psql_version,
+                                    s3_endpoint,
+                                    pg_access_key_id,
+                                    pg_secret_access_key,
+                                    pgsql_cluster_name,
+                                    cnpg_backup_schedule,
+                                    after=["seaweedfs"])
 
     podconfig_yaml = (
             f"https://raw.githubusercontent.com/small-hack/argocd-apps/{revision}/"
             f"{argo_path}pvc_argocd_appset.yaml"
             )
-    argocd.k8s.apply_manifests(podconfig_yaml, argocd.namespace)
+    plan["pvc appset"] = restore_step(argocd.k8s.apply_manifests,
+                                      podconfig_yaml,
+                                      argocd.namespace)
 
     # then we begin the restic restore of all the peertube PVCs we lost
     # for pvc in ['data', 'valkey_primary', 'valkey_replica']:
@@ -552,7 +561,8 @@ def restore_peertube(argocd: ArgoCD,
             pvc_enabled = secrets.get('data_pvc_enabled', 'false')
         if pvc_enabled and pvc_enabled.lower() != 'false':
             # restores the peertube pvc
-            k8up_restore_pvc(
+            plan[f'peertube-{pvc.replace("_","-")}'] = restore_step(
+                    k8up_restore_pvc,
                     k8s_obj=argocd.k8s,
                     app='peertube',
                     pvc=f'peertube-{pvc.replace("_","-")}',
@@ -563,9 +573,14 @@ def restore_peertube(argocd: ArgoCD,
                     secret_access_key=secret_access_key,
                     restic_repo_password=restic_repo_password,
                     snapshot_id=snapshot_ids[f'peertube_{pvc}'],
-                    pod_config="file-backups-podconfig"
+                    pod_config="file-backups-podconfig",
+                    after=["pvc appset"]
                     )
 
-    # todo: from here on out, this could be async to start on other tasks
-    # install peertube as usual, but wait on it this time
-    argocd.install_app('peertube', argo_dict, True)
+    # install peertube as usual once everything is restored, but wait on it
+    plan["install"] = restore_step(argocd.install_app,
+                                   'peertube',
+                                   argo_dict,
+                                   True,
+                                   after=list(plan))
+    run_restore_plan('peertube', plan)
@@ -1,7 +1,9 @@
 # internal libraries
 from smol_k8s_lab.bitwarden.bw_cli import BwCLI
 from smol_k8s_lab.k8s_tools.argocd_util import ArgoCD
-from smol_k8s_lab.k8s_tools.restores import k8up_restore_pvc
+from smol_k8s_lab.k8s_tools.restores import (k8up_restore_pvc,
+                                             restore_step,
+                                             run_restore_plan)
 from smol_k8s_lab.utils.passwords import create_password
 from smol_k8s_lab.utils.rich_cli.console_logging import header
 # from smol_k8s_lab.utils.value_from import process_backup_vals
@@ -176,14 +178,17 @@ def restore_valkey(argocd: ArgoCD,
             f"https://raw.githubusercontent.com/small-hack/argocd-apps/{revision}/"
             f"{argo_path}pvc_argocd_appset.yaml"
             )
-    argocd.k8s.apply_manifests(podconfig_yaml, argocd.namespace)
+    plan = {"pvc appset": restore_step(argocd.k8s.apply_manifests,
+                                       podconfig_yaml,
+                                       argocd.namespace)}
 
-    # then we begin the restic restore of all the valkey PVCs we lost
+    # then we begin the restic restore of all the valkey PVCs we lost, at once
     for pvc in ['valkey_primary', 'valkey_replica']:
         pvc_enabled = secrets.get('valkey_pvc_enabled', 'false')
         if pvc_enabled and pvc_enabled.lower() != 'false':
             # restores the valkey pvc
-            k8up_restore_pvc(
+            plan[f'valkey-{pvc.replace("_","-")}'] = restore_step(
+                    k8up_restore_pvc,
                     k8s_obj=argocd.k8s,
                     app='valkey',
                     pvc=f'valkey-{pvc.replace("_","-")}',
@@ -194,9 +199,14 @@ def restore_valkey(argocd: ArgoCD,
                     secret_access_key=secret_access_key,
                     restic_repo_password=restic_repo_password,
                     snapshot_id=snapshot_ids[f'valkey_{pvc}'],
-                    pod_config="file-backups-podconfig"
+                    pod_config="file-backups-podconfig",
+                    after=["pvc appset"]
                     )
 
-    # todo: from here on out, this could be async to start on other tasks
-    # install valkey as usual, but wait on it this time
-    argocd.install_app('valkey', argo_dict, True)
+    # install valkey as usual once everything is restored, but wait on it
+    plan["install"] = restore_step(argocd.install_app,
+                                   'valkey',
+                                   argo_dict,
+                                   True,
+                                   after=list(plan))
+    run_restore_plan('valkey', plan)
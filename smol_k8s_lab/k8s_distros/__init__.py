@@ -1,5 +1,7 @@
 # internal smol-k8s-lab libraries
+from ..constants import XDG_CACHE_DIR
 from ..k8s_tools.k8s_lib import K8s
+from ..utils.artifacts import write_atomically
 from ..utils.rich_cli.console_logging import sub_header, header
 from ..utils.run.subproc import subproc
 
@@ -8,83 +10,169 @@ from .k3d import create_k3d_cluster, delete_k3d_cluster
 from .k3s import install_k3s_cluster, uninstall_k3s
 
 # external libraries from standard lib
-from json import loads
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from json import dumps, loads
+from kubernetes import client, config
+from kubernetes.config import KUBE_CONFIG_DEFAULT_LOCATION
 import logging as log
+from os import path, pathsep
 from platform import machine, system
 from sys import exit
+from time import time
 
+# where we cache which clusters we found, and their versions
+CONTEXTS_CACHE_FILE = path.join(XDG_CACHE_DIR, 'contexts.json')
 
-def check_all_contexts() -> list:
+
+def get_kubeconfig_files() -> list:
     """
-    gets current context and returns and list of tuples like:
-        [(cluster_name, distro, version, platform)]
+    returns the kubeconfig files the kubernetes client reads, the same way
+    kubectl does: every file in $KUBECONFIG, or else ~/.kube/config
     """
-    start_context = subproc(["kubectl config current-context"],
-                            error_ok=True, quiet=True)
-    print(f"Current context at the start is {start_context}")
+    return [path.expanduser(kubeconfig)
+            for kubeconfig in KUBE_CONFIG_DEFAULT_LOCATION.split(pathsep)
+            if kubeconfig]
 
-    all_contexts = subproc(["kubectl config get-contexts --no-headers"],
-                           error_ok=True, quiet=True)
-    return_contexts = []
 
-    if all_contexts:
-        # split all contexts outputs into a list of context lines
-        for k8s_context in all_contexts.split('\n'):
+def get_kubeconfig_mtimes() -> list:
+    """
+    returns the modified time of each kubeconfig file that exists
+    """
+    return [path.getmtime(kubeconfig) for kubeconfig in get_kubeconfig_files()
+            if path.exists(kubeconfig)]
 
-            # split each context into fields
-            fields = k8s_context.split()
 
-            # HACK: I honestly have no clue why fields is empty sometimes &
-            # don't have time to troubleshoot it either 🤦
-            if fields:
-                # set the cluster name, making sure to not get the * context
-                if fields[0] and fields[0] != "*":
-                    cluster_name = fields[0]
-                    # change context only if it isn't already the current-context
-                    subproc([f"kubectl config use-context {cluster_name}"])
-                else:
-                    cluster_name = fields[1]
-
-                # get the version info for the distro and platform
-                version_json = loads(subproc(["kubectl version -o json"]))
-
-                # for k3s, this is nested in serverVersion
-                # for kind or k3d, it may not be present if docker is not enabled
-                server_version = version_json.get('serverVersion', None)
-                if server_version:
-                    version = server_version['gitVersion']
-                    os = server_version['platform']
-                else:
-                    log.error("Couldn't get server verison or platform. Is docker running?")
-                    version = "unknown"
-                    os = system() + "/" + machine()
-
-                # default the k8s distro to unknown in case we can't figure it out
-                distro = "unknown"
-
-                # if k3s is in the git version, it could be k3s OR k3d
-                if "k3d" in cluster_name:
-                    distro = "k3d"
-                elif "k3d" not in cluster_name:
-                    if "k3s" in cluster_name or "k3s" in version:
-                        distro = "k3s"
-                    else:
-                        # it might still be k3s if created outside of smol-k8s-lab
-                        # so we check the version
-
-                        # if distro not k3s/k3d, we kinda guess :)
-                        for distro_name in ["kind", "gke", "aks", "eks"]:
-                            if distro_name in cluster_name:
-                                distro = distro_name
-                                break
-
-                context_tuple = (cluster_name, distro, version, os)
-
-                return_contexts.append(context_tuple)
-
-        # set the cluster back to the starting context if we changed it
-        subproc([f"kubectl config use-context {start_context}"])
+def get_kube_contexts() -> list:
+    """
+    reads the context names straight from the kubeconfig, without touching
+    the current context or talking to any clusters
+    """
+    try:
+        contexts, _ = config.list_kube_config_contexts()
+    except Exception as e:
+        log.debug(f"Couldn't read any contexts from {KUBE_CONFIG_DEFAULT_LOCATION}: {e}")
+        return []
+    return [k8s_context['name'] for k8s_context in contexts]
+
+
+def guess_distro(cluster_name: str, version: str = "") -> str:
+    """
+    guesses the k8s distro of a cluster from its name and version
+    """
+    # if k3s is in the git version, it could be k3s OR k3d
+    if "k3d" in cluster_name:
+        return "k3d"
+
+    if "k3s" in cluster_name or "k3s" in version:
+        return "k3s"
 
+    # if distro not k3s/k3d, we kinda guess :)
+    for distro_name in ["kind", "gke", "aks", "eks"]:
+        if distro_name in cluster_name:
+            return distro_name
+
+    # default the k8s distro to unknown in case we can't figure it out
+    return "unknown"
+
+
+def probe_context(cluster_name: str, timeout: int = 3) -> tuple:
+    """
+    asks a context's cluster for its version, giving up after timeout seconds.
+    returns a tuple like (cluster_name, distro, version, platform)
+    """
+    try:
+        client_config = client.Configuration()
+        config.load_kube_config(context=cluster_name,
+                                client_configuration=client_config)
+        # don't retry dead clusters, so timeout is really the most we wait
+        client_config.retries = False
+        api_client = client.ApiClient(client_config)
+        server_version = client.VersionApi(api_client).get_code(
+                _request_timeout=timeout)
+        version = server_version.git_version
+        os = server_version.platform
+    except Exception as e:
+        # for kind or k3d, this fails if docker is not running
+        log.debug(f"Couldn't get server version or platform for {cluster_name}: {e}")
+        version = "unknown"
+        os = system() + "/" + machine()
+
+    return (cluster_name, guess_distro(cluster_name, version), version, os)
+
+
+def load_cached_contexts(ttl: int) -> list:
+    """
+    returns the contexts we found last time, if they're less than ttl seconds
+    old and the kubeconfig hasn't changed since, otherwise an empty list
+    """
+    kubeconfig_mtimes = get_kubeconfig_mtimes()
+    if not path.exists(CONTEXTS_CACHE_FILE) or not kubeconfig_mtimes:
+        return []
+
+    try:
+        with open(CONTEXTS_CACHE_FILE, 'r') as cache_file:
+            cache = loads(cache_file.read())
+    except (ValueError, OSError):
+        return []
+
+    if time() - cache.get('time', 0) > ttl or \
+            cache.get('kubeconfig_mtimes', []) != kubeconfig_mtimes:
+        return []
+
+    return [tuple(k8s_context) for k8s_context in cache.get('contexts', [])]
+
+
+def save_cached_contexts(contexts: list) -> None:
+    """
+    caches the contexts we found, with the kubeconfig's modified time
+    """
+    kubeconfig_mtimes = get_kubeconfig_mtimes()
+    if not kubeconfig_mtimes:
+        return
+
+    cache = dumps({"time": time(),
+                   "kubeconfig_mtimes": kubeconfig_mtimes,
+                   "contexts": contexts})
+    write_atomically(CONTEXTS_CACHE_FILE, cache.encode())
+
+
+def check_all_contexts(on_result: Callable = None,
+                       timeout: int = 3,
+                       ttl: int = 30) -> list:
+    """
+    probes every context in the kubeconfig at the same time, without ever
+    switching the current context, and returns a list of tuples like:
+        [(cluster_name, distro, version, platform)]
+
+    on_result is called with each tuple as soon as its probe returns.
+    Results are cached for ttl seconds, or until the kubeconfig changes
+    """
+    cached = load_cached_contexts(ttl)
+    if cached:
+        log.debug("Using cached cluster contexts")
+        if on_result:
+            for context_tuple in cached:
+                on_result(context_tuple)
+        return cached
+
+    cluster_names = get_kube_contexts()
+    if not cluster_names:
+        return []
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=min(len(cluster_names), 16)) as pool:
+        futures = [pool.submit(probe_context, cluster_name, timeout)
+                   for cluster_name in cluster_names]
+        for future in as_completed(futures):
+            context_tuple = future.result()
+            results[context_tuple[0]] = context_tuple
+            if on_result:
+                on_result(context_tuple)
+
+    # keep the same order as the kubeconfig
+    return_contexts = [results[cluster_name] for cluster_name in cluster_names]
+    save_cached_contexts(return_contexts)
     return return_contexts
 
 
@@ -159,7 +247,9 @@ def create_k8s_distro(cluster_name: str,
                             kubelet_args,
                             networking_args,
                             distro_metadata['nodes']['control_plane'],
-                            distro_metadata['nodes']['workers'])
+                            distro_metadata['nodes']['workers'],
+                            distro_metadata.get('registry_mirror', False),
+                            distro_metadata.get('prewarm_images', []))
 
     elif k8s_distro == "k3s" or k8s_distro == "k3d":
         # get any extra args the user has passed in
@@ -185,7 +275,9 @@ def create_k8s_distro(cluster_name: str,
             create_k3d_cluster(cluster_name,
                                k3s_args,
                                distro_metadata['nodes']['control_plane'],
-                               distro_metadata['nodes']['workers'])
+                               distro_metadata['nodes']['workers'],
+                               distro_metadata.get('registry_mirror', False),
+                               distro_metadata.get('prewarm_images', []))
 
     return K8s()
 
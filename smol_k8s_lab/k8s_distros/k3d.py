@@ -5,6 +5,7 @@ DESCRIPTION: install k3d :D Not affiliated with k3s, rancher, or suse. just a fa
      AUTHOR: @Jessebot
     LICENSE: GNU AFFERO GENERAL PUBLIC LICENSE Version 3
 """
+from .registry_mirror import get_registry_mirrors, prewarm_images, start_registry_mirrors
 from ..utils.rich_cli.console_logging import sub_header
 from ..utils.run.subproc import subproc
 from ..constants import XDG_CACHE_DIR
@@ -19,22 +20,33 @@ K3D_CFG_FILENAME = f"{XDG_CACHE_DIR}/k3d-config.yaml"
 def create_k3d_cluster(cluster_name: str,
                         k3s_yaml: dict,
                         control_plane_nodes: int = 1,
-                        worker_nodes: int = 0) -> None:
+                        worker_nodes: int = 0,
+                        registry_mirror: bool = False,
+                        images: list = []) -> None:
     """
-    python installation for k3d
+    python installation for k3d. If registry_mirror, nodes pull images through
+    local pull through registry mirrors, and any images get imported into the
+    nodes right after the cluster is created
     """
     sub_header("Creating k3d cluster...")
 
     k3d_cfg = K3dConfig(cluster_name,
                         k3s_yaml,
                         control_plane_nodes,
-                        worker_nodes)
+                        worker_nodes,
+                        get_registry_mirrors() if registry_mirror else {})
     k3d_cfg.write_yaml()
 
     # actually running the k3d command
     res = subproc([f'k3d cluster create --config {K3D_CFG_FILENAME}'])
     log.info(res)
 
+    # k3d creates a docker network per cluster, which the mirrors need to be on
+    if registry_mirror:
+        start_registry_mirrors(f"k3d-{cluster_name}")
+
+    prewarm_images("k3d", cluster_name, images)
+
 
 def delete_k3d_cluster(cluster_name: str) -> str:
     """
@@ -55,7 +67,8 @@ class K3dConfig():
                  cluster_name: str,
                  k3s_yaml: dict,
                  control_plane_nodes: int = 1,
-                 worker_nodes: int = 0) -> None:
+                 worker_nodes: int = 0,
+                 registry_mirrors: dict = {}) -> None:
 
         # base config for k3s
         self.k3d_cfg = {"apiVersion": "k3d.io/v1alpha5",
@@ -82,6 +95,12 @@ class K3dConfig():
         if worker_nodes > 0:
             self.node_filters.append("agent:*")
 
+        # point containerd at our local registry mirrors, via k3s' registries.yaml
+        if registry_mirrors:
+            mirrors = {registry: {"endpoint": [endpoint]}
+                       for registry, endpoint in registry_mirrors.items()}
+            self.k3d_cfg["registries"] = {"config": dump({"mirrors": mirrors})}
+
         # these are the rest of the k3s specific arguments
         if k3s_yaml:
             if not self.k3d_cfg['options'].get('k3s', None):
@@ -8,13 +8,16 @@ DESCRIPTION: install k3s :D not affiliated with rancher, suse, or k3s
 # local libraries
 from ..constants import USER, KUBECONFIG
 from ..constants import XDG_CACHE_DIR
+from ..k8s_tools.k8s_lib import K8s
+from ..utils.artifacts import fetch_file
 from ..utils.run.subproc import subproc
 
 # external libraries
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from kubernetes import watch
 import logging as log
-from os import chmod, remove, path
-import requests
-import stat
+from os import path
+from pathlib import Path
 from ruamel.yaml import YAML
 from time import sleep
 
@@ -33,19 +36,13 @@ def install_k3s_cluster(cluster_name: str,
     if not cluster_name.startswith("k3s-"):
         cluster_name = "k3s-" + cluster_name
 
-    # download the k3s installer if we don't have it here already
-    url = requests.get("https://get.k3s.io")
-    k3s_installer_file = open("./install.sh", "wb")
-    k3s_installer_file.write(url.content)
-    k3s_installer_file.close()
-
-    # make sure we can actually execute the script
-    chmod("./install.sh", stat.S_IRWXU)
+    # download the k3s installer if we don't have it cached already
+    k3s_installer = get_k3s_installer()
 
     # for creating a config file for k3s
     k3s_yaml_file = XDG_CACHE_DIR + '/k3s.yml'
     # install command to create k3s cluster (just one server, control plane, node)
-    install_cmd = f'./install.sh --config {k3s_yaml_file}'
+    install_cmd = f'{k3s_installer} --config {k3s_yaml_file}'
 
     config_dict = extra_k3s_parameters
 
@@ -59,18 +56,172 @@ def install_k3s_cluster(cluster_name: str,
     # adds our newly created cluster for k3s to the user's kubeconfig
     update_user_kubeconfig(cluster_name)
 
-    # remove the script after we're done
-    remove('./install.sh')
-
     # if we have extra remote nodes to join to the cluster...
     if extra_nodes:
         join_k3s_nodes(extra_nodes)
 
 
-def join_k3s_nodes(extra_nodes: dict) -> None:
+def get_k3s_installer(max_age_hours: int = 24) -> str:
+    """
+    returns the path to a cached copy of the k3s install script, revalidating
+    it only if it's older than max_age_hours
+    """
+    return fetch_file("https://get.k3s.io",
+                      max_age=max_age_hours * 3600,
+                      executable=True)
+
+
+def get_ssh_cmd(node: str, metadata: dict) -> str:
+    """
+    returns an ssh command for a remote node that shares one connection per
+    node, so the checks and the install for a node only connect once
+    """
+    control_dir = path.join(XDG_CACHE_DIR, 'ssh')
+    Path(control_dir).mkdir(mode=0o700, exist_ok=True)
+
+    ssh_cmd = ("ssh -o StrictHostKeyChecking=no "
+               "-o ControlMaster=auto -o ControlPersist=60 "
+               f"-o ControlPath={control_dir}/%C ")
+
+    # only add the port if it's not 22
+    ssh_port = metadata.get('ssh_port', '22')
+    if str(ssh_port) != "22":
+        ssh_cmd += f"-p {ssh_port} "
+
+    # only add the ssh key if it's not id_rsa
+    ssh_key = metadata.get('ssh_key', 'id_rsa')
+    if ssh_key and ssh_key != "id_rsa":
+        ssh_cmd += f"-i {ssh_key} "
+
+    return ssh_cmd + node
+
+
+def join_k3s_node(node: str,
+                  metadata: dict,
+                  k3s_url: str,
+                  k3s_token: str,
+                  k3s_installer: str) -> None:
+    """
+    joins one remote node to the cluster over ssh, by piping our cached k3s
+    installer to it, so the node doesn't need to download it itself
+    """
+    ssh_cmd = get_ssh_cmd(node, metadata)
+
+    # skip nodes that are already running the k3s agent, e.g. on a re-run
+    active = subproc([f"{ssh_cmd} systemctl is-active k3s-agent"],
+                     error_ok=True, quiet=True, spinner=False)
+    if isinstance(active, str) and active.strip() == "active":
+        log.info(f"k3s agent is already running on {node}, skipping install")
+        return
+
+    log.info(f"Joining {node} to the k3s cluster")
+    join_cmd = (f"{ssh_cmd} 'K3S_URL=\"{k3s_url}\" "
+                f"K3S_TOKEN=\"{k3s_token}\" sh -s -' < {k3s_installer}")
+    subproc([join_cmd], shell=True, universal_newlines=True, quiet=True,
+            spinner=False)
+
+
+def parse_node_taint(taint: str) -> dict:
+    """
+    parses a taint like key=value:NoSchedule or key:NoSchedule into a dict
+    """
+    key_value, _, effect = taint.rpartition(":")
+    key, _, value = key_value.partition("=")
+    node_taint = {"key": key, "effect": effect}
+    if value:
+        node_taint["value"] = value
+    return node_taint
+
+
+def as_list(value: str | list) -> list:
+    """
+    node labels/taints can be a list, or a comma seperated string from the tui
+    """
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [item.strip() for item in value.split(",") if item.strip()]
+    return list(value)
+
+
+def patch_node(k8s: K8s, node, metadata: dict) -> None:
+    """
+    applies all of a node's labels and taints in one patch
+    """
+    labels = {}
+    for label in as_list(metadata.get('node_labels', [])):
+        key, _, value = label.partition("=")
+        labels[key] = value
+
+    new_taints = [parse_node_taint(taint)
+                  for taint in as_list(metadata.get('node_taints', []))]
+
+    if not labels and not new_taints:
+        return
+
+    body = {"metadata": {"labels": labels}}
+    if new_taints:
+        # taints are replaced as a whole list, so keep the existing ones
+        taints = [{"key": taint.key, "value": taint.value, "effect": taint.effect}
+                  for taint in node.spec.taints or []]
+        for taint in new_taints:
+            taints = [existing for existing in taints
+                      if (existing['key'], existing['effect']) !=
+                      (taint['key'], taint['effect'])]
+            taints.append(taint)
+        body["spec"] = {"taints": taints}
+
+    log.info(f"Labeling and tainting node {node.metadata.name}")
+    log.debug(body)
+    k8s.core_v1_api.patch_node(node.metadata.name, body)
+
+
+def match_node(node, pending: dict) -> str:
+    """
+    returns the name of the pending remote node that a k8s node is, matched by
+    node name or by any of its addresses, or an empty string
+    """
+    names = {node.metadata.name}
+    for address in node.status.addresses or []:
+        names.add(address.address)
+
+    for pending_node in pending:
+        if pending_node in names or pending_node.split(".")[0] in names:
+            return pending_node
+    return ""
+
+
+def wait_for_nodes(k8s: K8s, pending: dict, timeout: int = 600) -> None:
+    """
+    watches the k8s api for our new nodes to register, and labels and taints
+    each one as soon as it shows up. pending is {node: metadata}
+    """
+    pending = dict(pending)
+    node_watch = watch.Watch()
+    for event in node_watch.stream(k8s.core_v1_api.list_node,
+                                   timeout_seconds=timeout):
+        if event['type'] == "DELETED":
+            continue
+
+        node = event['object']
+        pending_node = match_node(node, pending)
+        if not pending_node:
+            continue
+
+        log.info(f"{pending_node} registered as node {node.metadata.name}")
+        patch_node(k8s, node, pending.pop(pending_node))
+        if not pending:
+            node_watch.stop()
+            return
+
+    log.warning(f"Timed out waiting for nodes to register: {', '.join(pending)}")
+
+
+def join_k3s_nodes(extra_nodes: dict, parallel: int = 4) -> None:
     """
     process extra remote nodes to join to the cluster as well as apply any labels,
-    or taints, after we're done joining the node
+    or taints, after we're done joining the node.
+    Joins up to parallel nodes at once over ssh.
     """
     # this gets the internal ip address of our current control plane node
     ip_cmd = ("kubectl get nodes -o custom-columns=NAME:.status.addresses[0].address"
@@ -86,59 +237,38 @@ def join_k3s_nodes(extra_nodes: dict) -> None:
 
     # strips new line character from end of ip address
     internal_ip = k3s_control_plane_ip.strip()
+    k3s_url = f"https://{internal_ip}:6443"
 
     # token from the server is needed for the new agent
     k3s_token = subproc(["sudo cat /var/lib/rancher/k3s/server/node-token"]).strip()
-    k3s_cmd = ('\'curl -sfL https://get.k3s.io | '
-               f'K3S_URL="https://{internal_ip}:6443" '
-               f'K3S_TOKEN="{k3s_token}" sh -\'')
-
-    # for each node and it's meta data, ssh in and join the node
-    for node, metadata in extra_nodes.items():
-        ssh_cmd = "ssh -o StrictHostKeyChecking=no "
-
-        # only add the port if it's not 22
-        ssh_port = metadata.get('ssh_port', '22')
-        if str(ssh_port) != "22":
-            ssh_cmd += f"-p {ssh_port} "
-        else:
-            ssh_cmd += f"{node} "
-
-        # only add the ssh key if it's not id_rsa
-        ssh_key = metadata.get('ssh_key', 'id_rsa')
-        if ssh_key != "id_rsa":
-            ssh_cmd += f"-i {ssh_key} {node} "
-        else:
-            ssh_cmd += f"{node} "
-
-        # join node to cluster
-        subproc([ssh_cmd + k3s_cmd], shell=True, universal_newlines=True)
-
-
-        # check if we have taints or labels to apply to this new node
-        labels = metadata.get('node_labels', None)
-        taints = metadata.get('node_taints', None)
-        if labels or taints:
-            log.debug(f"Checking if {node} is ready for labeling and/or tainting.")
-
-            k_get_nodes = subproc(["kubectl get nodes"])
-
-            # if new node is not available, keep checking
-            while node not in k_get_nodes:
-                log.info(f"Waiting for {node} to be available")
-                sleep(1)
-                k_get_nodes = subproc(["kubectl get nodes"])
-
-            # apply labels to new node
-            if labels:
-                for label in labels:
-                    subproc([f"kubectl label nodes {node} {label}"])
-
-            # apply taints to new node
-            if taints:
-                for taint in taints:
-                    subproc([f"kubectl taint nodes {node} {taint}"],
-                            error_ok=True)
+    k3s_installer = get_k3s_installer()
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(parallel, 1)) as pool:
+        joins = {pool.submit(join_k3s_node,
+                             node,
+                             metadata,
+                             k3s_url,
+                             k3s_token,
+                             k3s_installer): node
+                 for node, metadata in extra_nodes.items()}
+
+        for future in as_completed(joins):
+            try:
+                future.result()
+            except Exception as e:
+                log.error(f"Failed to join {joins[future]}: {e}")
+                failed.append(joins[future])
+
+    # a new watch lists every node first, so we won't miss any that already
+    # registered while the others were still joining
+    joined = {node: metadata for node, metadata in extra_nodes.items()
+              if node not in failed}
+    if joined:
+        wait_for_nodes(K8s(), joined)
+
+    if failed:
+        raise Exception(f"Failed to join nodes: {', '.join(failed)}")
 
 
 def uninstall_k3s(cluster_name: str) ->  str:
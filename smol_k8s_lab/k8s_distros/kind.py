@@ -6,6 +6,7 @@ DESCRIPTION: create or delete a kind cluster, part of smol-k8s-lab
     LICENSE: GNU AFFERO GENERAL PUBLIC LICENSE Version 3
 """
 from ..constants import XDG_CACHE_DIR
+from .registry_mirror import get_registry_mirrors, prewarm_images, start_registry_mirrors
 from ..utils.rich_cli.console_logging import sub_header
 from ..utils.run.subproc import subproc
 import logging as log
@@ -26,9 +27,13 @@ def create_kind_cluster(cluster_name: str,
                         kubelet_args: dict = {},
                         networking_args: dict = {},
                         control_plane_nodes: int = 1,
-                        worker_nodes: int = 1) -> True:
+                        worker_nodes: int = 1,
+                        registry_mirror: bool = False,
+                        images: list = []) -> True:
     """
-    Run installation process for kind and create cluster
+    Run installation process for kind and create cluster. If registry_mirror,
+    nodes pull images through local pull through registry mirrors, and any
+    images get side loaded into the nodes right after the cluster is created
     returns True
     """
 
@@ -48,12 +53,19 @@ def create_kind_cluster(cluster_name: str,
     log.debug("Creating a kind cluster...")
 
     kind_cfg = path.join(XDG_CACHE_DIR, 'kind_cfg.yaml')
+    registry_mirrors = get_registry_mirrors() if registry_mirror else {}
     build_kind_config(kind_cfg, kubelet_args, networking_args,
-                      control_plane_nodes, worker_nodes)
+                      control_plane_nodes, worker_nodes, registry_mirrors)
 
     cmd = f"kind create cluster --name {cluster_name} --config={kind_cfg}"
     subproc([cmd])
 
+    # kind creates the "kind" docker network, which the mirrors need to be on
+    if registry_mirror:
+        start_registry_mirrors("kind")
+
+    prewarm_images("kind", cluster_name, images)
+
     return True
 
 
@@ -79,10 +91,12 @@ def build_kind_config(cfg_file: str = "~/.config/smol-k8s-lab/kind_cfg.yaml",
                       kubelet_extra_args: dict = {},
                       networking_args: dict = {},
                       control_plane_nodes: int = 1,
-                      worker_nodes: int = 0) -> None:
+                      worker_nodes: int = 0,
+                      registry_mirrors: dict = {}) -> None:
     """
     builds a kind config including any extra kubelet or networking args and then
-    writes it to a yaml in our cache dir
+    writes it to a yaml in our cache dir. registry_mirrors is an optional dict
+    of {registry: mirror endpoint} for containerd on each node
     """
     node_config = {'role': 'control-plane',
                    'extraPortMappings': [
@@ -123,6 +137,14 @@ def build_kind_config(cfg_file: str = "~/.config/smol-k8s-lab/kind_cfg.yaml",
     if networking_args:
         kind_cfg["networking"] = networking_args.copy()
 
+    # point containerd at our local registry mirrors
+    if registry_mirrors:
+        patch = ""
+        for registry, endpoint in registry_mirrors.items():
+            patch += ('[plugins."io.containerd.grpc.v1.cri".registry.mirrors.'
+                      f'"{registry}"]\n  endpoint = ["{endpoint}"]\n')
+        kind_cfg['containerdConfigPatches'] = [pss(patch)]
+
     # if we're testing more than one control plane node
     if control_plane_nodes > 1:
         for node in range(control_plane_nodes):
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3.11
+"""
+       Name: registry_mirror
+DESCRIPTION: persistent local pull through registry mirrors and image
+             prewarming for kind and k3d clusters, so recreating a cluster
+             pulls images from local disk instead of the internet
+     AUTHOR: @jessebot
+    LICENSE: GNU AFFERO GENERAL PUBLIC LICENSE Version 3
+"""
+from ..utils.run.subproc import subproc
+
+# external libraries
+from concurrent.futures import ThreadPoolExecutor
+import logging as log
+
+# upstream registry: url the pull through cache proxies to
+UPSTREAM_REGISTRIES = {"docker.io": "https://registry-1.docker.io",
+                       "ghcr.io": "https://ghcr.io",
+                       "quay.io": "https://quay.io",
+                       "registry.k8s.io": "https://registry.k8s.io"}
+
+MIRROR_IMAGE = "registry:2"
+MIRROR_PORT = 5000
+
+
+def mirror_name(registry: str) -> str:
+    """
+    returns the name of the mirror container (and volume) for a registry
+    """
+    return "smol-k8s-lab-mirror-" + registry.replace(".", "-")
+
+
+def get_registry_mirrors() -> dict:
+    """
+    returns {registry: mirror endpoint} for every upstream registry, for
+    containerd on the cluster nodes
+    """
+    return {registry: f"http://{mirror_name(registry)}:{MIRROR_PORT}"
+            for registry in UPSTREAM_REGISTRIES}
+
+
+def start_registry_mirrors(network: str) -> None:
+    """
+    starts a registry:2 pull through cache container for each upstream
+    registry, unless it's already running, and connects it to the cluster's
+    docker network. The images are kept in a docker volume, so they survive
+    deleting the cluster, and the mirrors.
+    """
+    running = subproc(["docker ps --format {{.Names}}"], quiet=True, spinner=False)
+    running = (running or "").split()
+
+    for registry, upstream in UPSTREAM_REGISTRIES.items():
+        name = mirror_name(registry)
+        if name not in running:
+            log.info(f"Starting a local registry mirror for {registry}")
+            # remove a stopped mirror container, but never its volume
+            subproc([f"docker rm {name}"], error_ok=True, quiet=True, spinner=False)
+            subproc([f"docker run -d --restart=always --name {name} "
+                     f"-v {name}:/var/lib/registry "
+                     f"-e REGISTRY_PROXY_REMOTEURL={upstream} {MIRROR_IMAGE}"],
+                    spinner=False)
+
+        # this fails if it's already connected, which is fine
+        subproc([f"docker network connect {network} {name}"],
+                error_ok=True, quiet=True, spinner=False)
+
+
+def prewarm_images(k8s_distro: str,
+                   cluster_name: str,
+                   images: list,
+                   parallel: int = 4) -> None:
+    """
+    side loads images into every node of a kind or k3d cluster, pulling them
+    into the local docker image cache first only if they're not there already
+    """
+    if not images:
+        return
+
+    def pull(image: str) -> None:
+        if subproc([f"docker images -q {image}"], error_ok=True,
+                   quiet=True, spinner=False):
+            log.debug(f"{image} is already in the local docker image cache")
+            return
+        subproc([f"docker pull {image}"], quiet=True, spinner=False)
+
+    log.info(f"Pulling {len(images)} images to prewarm the cluster with")
+    with ThreadPoolExecutor(max_workers=max(parallel, 1)) as pool:
+        list(pool.map(pull, images))
+
+    image_list = " ".join(images)
+    if k8s_distro == "kind":
+        subproc([f"kind load docker-image --name {cluster_name} {image_list}"])
+    elif k8s_distro == "k3d":
+        subproc([f"k3d image import --cluster {cluster_name} {image_list}"])
+    else:
+        log.warning(f"Prewarming images isn't supported for {k8s_distro}")
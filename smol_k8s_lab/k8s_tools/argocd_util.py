@@ -2,6 +2,7 @@
 import logging as log
 from .k8s_lib import K8s
 from ..utils.run.subproc import subproc
+from collections.abc import Callable
 from json import loads
 from time import sleep
 
@@ -46,9 +47,11 @@ class ArgoCD():
                  spinner: bool = True,
                  replace: bool = False,
                  force: bool = False,
-                 sleep_time: int = 1) -> str:
+                 sleep_time: int = 1,
+                 on_output: Callable = None) -> str:
         """
-        syncs an argocd app and returns the result
+        syncs an argocd app and returns the result.
+        on_output is called with a status line before each sync attempt
         """
         # build sync command
         cmd = "argocd app sync --retry-limit 3 --loglevel warn "
@@ -60,6 +63,9 @@ class ArgoCD():
 
         counter = 0
         while True:
+            if on_output:
+                on_output(f"syncing {app}, attempt {counter + 1}")
+
             # run sync command
             if spinner:
                 res = subproc([cmd], error_ok=True)
@@ -81,10 +87,15 @@ class ArgoCD():
     def delete_app(self,
                    app: str,
                    spinner: bool = True,
-                   force: bool = False) -> str:
+                   force: bool = False,
+                   on_output: Callable = None) -> str:
         """
-        delete an app and associated appsets, and returns the result for all
+        delete an app and associated appsets, and returns the result for all.
+        on_output is called with the result of each step as it finishes
         """
+        if not on_output:
+            on_output = lambda line: None
+
         # build delete command
         cmd = "argocd app delete -y "
         if force:
@@ -95,6 +106,7 @@ class ArgoCD():
         app_res = subproc([cmd], spinner=spinner, error_ok=True)
         if not app_res:
             app_res = ""
+        on_output(app_res)
 
         # clean up old appsets as well
         appsets = ["web-app-set",
@@ -110,18 +122,20 @@ class ArgoCD():
                               error_ok=True, spinner=spinner)
                 if res:
                     app_res += res
+                    on_output(res)
 
             # sometimes seaweedfs gets stuck...
             res = subproc([f"argocd app terminate-op {app}-seaweedfs-app"],
                           error_ok=True, spinner=spinner)
             if res:
                 app_res += res
+                on_output(res)
 
         # delete any remaining pods, just in case
         res = self.k8s.delete_namespaced_pods(app)
         if res:
             app_res += res
-        print(app_res)
+            on_output(res)
 
         return app_res
 
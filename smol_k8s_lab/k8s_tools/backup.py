@@ -1,17 +1,27 @@
 # local libs
 from smol_k8s_lab.utils.run.subproc import subproc
 from smol_k8s_lab.k8s_tools.k8s_lib import K8s
+from smol_k8s_lab.k8s_tools.k8up_progress import follow_k8up_job
 from smol_k8s_lab.k8s_apps.social.nextcloud_occ_commands import Nextcloud
 from smol_k8s_lab.utils.minio_lib import BetterMinio
 
 # external libs
 # import asyncio
 import base64
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AbstractContextManager, nullcontext
 from datetime import datetime
+from json import loads
 import logging as log
 from time import sleep
 
 
+# the parts of a k8up PodConfig we copy into our own backup jobs
+POD_CONFIG_KEYS = ["affinity", "nodeSelector", "priorityClassName",
+                   "securityContext", "tolerations"]
+
+
 def create_pvc_restic_backup(app: str,
                              namespace: str,
                              endpoint: str,
@@ -19,13 +29,38 @@ def create_pvc_restic_backup(app: str,
                              cnpg_backup: bool = True,
                              cnpg_s3_endpoint: str = "",
                              quiet: bool = False,
-                             needs_pod_config: bool = False) -> None:
+                             needs_pod_config: bool = False,
+                             restic_slot: AbstractContextManager = nullcontext(),
+                             on_progress: Callable = None,
+                             snapshot_class: str = "",
+                             bucket_notifications: bool = False) -> str:
     """
     a function to immediately run a restic backup job
     unless it's nextcloud, then we put it into maintenance_mode first...
 
     pass in quiet=True to disable loading spinners for logging
+    pass in restic_slot to hold a lock/semaphore only while the restic job runs
+    pass in on_progress to get restic's progress as a dict instead of a progress bar
+    pass in snapshot_class (a CSI VolumeSnapshotClass) to back up from snapshots
+    pass in bucket_notifications=True to listen for s3 bucket notifications
+    while waiting on the database backup's last wal archive
+
+    returns the name of the k8up backup job
     """
+    if snapshot_class:
+        return create_pvc_snapshot_backup(app,
+                                          namespace,
+                                          endpoint,
+                                          bucket,
+                                          snapshot_class,
+                                          cnpg_backup,
+                                          cnpg_s3_endpoint,
+                                          quiet,
+                                          needs_pod_config,
+                                          restic_slot,
+                                          on_progress,
+                                          bucket_notifications)
+
     now = datetime.now().strftime('%Y-%m-%d-%H-%M')
     # make sure we don't have any _, as some kubectl commands don't like them
     app = app.replace("_","-")
@@ -75,48 +110,346 @@ def create_pvc_restic_backup(app: str,
         nextcloud = Nextcloud(K8s(), namespace, quiet)
         nextcloud.set_maintenance_mode("on")
 
-        # then wait for maintenance_mode to be fully on
-        sleep(10)
-
-    # do the database backup if this app has one
+    # do the database backup if this app has one. While nextcloud is in
+    # maintenance mode nothing is written, so the database and files can be
+    # backed up at the same time. Otherwise the database has to go first, so it
+    # never references files that aren't in the pvc backup
+    cnpg_pool = None
     if cnpg_backup:
-        create_cnpg_cluster_backup(app, namespace, cnpg_s3_endpoint, quiet=quiet)
+        if app == "nextcloud":
+            cnpg_pool = ThreadPoolExecutor(max_workers=1)
+            cnpg_future = cnpg_pool.submit(create_cnpg_cluster_backup,
+                                           app, namespace, cnpg_s3_endpoint,
+                                           quiet=quiet,
+                                           notifications=bucket_notifications)
+        else:
+            create_cnpg_cluster_backup(app, namespace, cnpg_s3_endpoint,
+                                       quiet=quiet,
+                                       notifications=bucket_notifications)
 
     # then we can do the actual backup
     k8s = K8s()
-    k8s.apply_custom_resources([backup_yaml])
+    job_name = f"backup-{backup_name}-0"
+    try:
+        with restic_slot:
+            k8s.apply_custom_resources([backup_yaml])
 
-    # wait for backup to complete
-    wait_cmd = (f"kubectl wait job -n {namespace} --for=condition=complete "
-                f"backup-{backup_name}-0 --timeout=15m")
-    print(wait_cmd)
-    while True:
-        log.debug(f"Waiting for backup job: backup-{backup_name}-0")
-        res = subproc([wait_cmd], error_ok=True, spinner=quiet)
-        log.debug(res)
-        if "NotFound" in res:
-            sleep(1)
-        else:
-            break
+            # follow the backup job's restic progress until it's done
+            backed_up = follow_k8up_job(k8s,
+                                        namespace,
+                                        job_name,
+                                        f"💾 backing up {app}",
+                                        on_progress,
+                                        quiet)
+        if cnpg_pool:
+            # raises any errors from the database backup
+            cnpg_future.result()
+    finally:
+        if cnpg_pool:
+            # waits for the database backup, even if the restic backup failed,
+            # so nextcloud never leaves maintenance mode in the middle of it
+            cnpg_pool.shutdown()
+        if app == "nextcloud":
+            # turn nextcloud maintenance_mode off after the backup
+            nextcloud.set_maintenance_mode("off")
 
-    if app == "nextcloud":
-        # turn nextcloud maintenance_mode off after the backup
-        nextcloud.set_maintenance_mode("off")
+    if not backed_up:
+        raise Exception(f"k8up backup job {job_name} failed")
+
+    return job_name
 
-    return True
+
+def create_pvc_snapshot_backup(app: str,
+                               namespace: str,
+                               endpoint: str,
+                               bucket: str,
+                               snapshot_class: str,
+                               cnpg_backup: bool = True,
+                               cnpg_s3_endpoint: str = "",
+                               quiet: bool = False,
+                               needs_pod_config: bool = False,
+                               restic_slot: AbstractContextManager = nullcontext(),
+                               on_progress: Callable = None,
+                               bucket_notifications: bool = False) -> str:
+    """
+    backs up an app's PVCs from CSI VolumeSnapshots, so nextcloud only has to
+    be in maintenance mode while the snapshots (and database backup) are
+    taken, instead of for the whole restic upload. Restic then backs up clones
+    of the snapshots, to the same /data/{pvc} paths k8up uses, so restores work
+    the same either way.
+
+    The database is always backed up to s3 with barman, since that's what we
+    restore from. If the cnpg cluster is set up for volume snapshots, we take
+    one of those too, as an extra copy that's quicker to restore on this cluster
+
+    returns the name of the restic backup job
+    """
+    now = datetime.now().strftime('%Y-%m-%d-%H-%M')
+    app = app.replace("_","-")
+    k8s = K8s()
+    pvcs = get_backup_pvcs(k8s, namespace)
+    if not pvcs:
+        raise Exception(f"No PVCs to back up in the {namespace} namespace")
+
+    snapshots = {pvc: f"{pvc}-{now}" for pvc in pvcs}
+    clones = {pvc: f"{snapshot}-clone" for pvc, snapshot in snapshots.items()}
+    job_name = f"{app}-snapshot-backup-{now}"
+    try:
+        if app == "nextcloud":
+            nextcloud = Nextcloud(k8s, namespace, quiet)
+            nextcloud.set_maintenance_mode("on")
+
+        try:
+            # the database has to be backed up before the files, or at the same
+            # time as them if nextcloud is in maintenance mode. Leaving this
+            # block waits on any database backup that's still running
+            with ThreadPoolExecutor(max_workers=2) as cnpg_pool:
+                cnpg_futures = []
+                if cnpg_backup:
+                    cnpg_futures.append(cnpg_pool.submit(run_cnpg_backup,
+                                                         app, namespace,
+                                                         quiet=quiet))
+                    if has_cnpg_volume_snapshots(namespace, app):
+                        cnpg_futures.append(cnpg_pool.submit(run_cnpg_backup,
+                                                             app, namespace,
+                                                             quiet=quiet,
+                                                             method="volumeSnapshot"))
+                    if app != "nextcloud":
+                        for cnpg_future in cnpg_futures:
+                            cnpg_future.result()
+
+                create_volume_snapshots(k8s, namespace, snapshots, snapshot_class)
+
+                # raises any errors from the database backups
+                for cnpg_future in cnpg_futures:
+                    cnpg_future.result()
+        finally:
+            if app == "nextcloud":
+                # everything we need is snapshotted, so nextcloud can come back up
+                nextcloud.set_maintenance_mode("off")
+
+        # the barman backup is only restorable once its last wal is in s3, but
+        # that doesn't need to hold up nextcloud
+        if cnpg_futures:
+            wait_for_cnpg_backup_wal(app, namespace, cnpg_s3_endpoint,
+                                     cnpg_futures[0].result(),
+                                     bucket_notifications)
+
+        # then restic can take as long as it likes, from clones of the snapshots
+        # some apps, like home assistant, need tolerations/affinity to get scheduled
+        pod_spec = get_pod_config_spec(namespace) if needs_pod_config else {}
+        clone_volume_snapshots(k8s, namespace, pvcs, snapshots, clones)
+        with restic_slot:
+            k8s.apply_custom_resources([restic_backup_job(job_name,
+                                                          namespace,
+                                                          endpoint,
+                                                          bucket,
+                                                          clones,
+                                                          pod_spec)])
+            backed_up = follow_k8up_job(k8s,
+                                        namespace,
+                                        job_name,
+                                        f"💾 backing up {app} snapshots",
+                                        on_progress,
+                                        quiet)
+    finally:
+        # clean up everything we made, but keep the job around for its logs
+        subproc([f"kubectl delete pvc -n {namespace} {' '.join(clones.values())}",
+                 f"kubectl delete volumesnapshot -n {namespace} {' '.join(snapshots.values())}"],
+                error_ok=True, spinner=False)
+
+    if not backed_up:
+        raise Exception(f"restic snapshot backup job {job_name} failed")
+
+    return job_name
+
+
+def get_backup_pvcs(k8s: K8s, namespace: str) -> dict:
+    """
+    returns a dict of {pvc_name: pvc spec} for every bound PVC in a namespace
+    that k8up would back up. CNPG's PVCs are skipped, as cnpg backs those up
+    """
+    pvcs = {}
+    for pvc in k8s.core_v1_api.list_namespaced_persistent_volume_claim(namespace).items:
+        annotations = pvc.metadata.annotations or {}
+        labels = pvc.metadata.labels or {}
+        if annotations.get("k8up.io/backup", "true") == "false":
+            continue
+        if "cnpg.io/cluster" in labels or pvc.status.phase != "Bound":
+            continue
+        pvcs[pvc.metadata.name] = pvc.spec
+    return pvcs
+
+
+def has_cnpg_volume_snapshots(namespace: str, app: str) -> bool:
+    """
+    returns True if the app's cnpg cluster is configured for volume snapshot
+    backups
+    """
+    cmd = (f"kubectl get -n {namespace} clusters.postgresql.cnpg.io/{app}-postgres"
+           " -o jsonpath={.spec.backup.volumeSnapshot.className}")
+    return bool(subproc([cmd], error_ok=True, quiet=True, spinner=False).strip())
+
+
+def get_pod_config_spec(namespace: str,
+                        pod_config: str = "backups-podconfig") -> dict:
+    """
+    returns the scheduling parts of a k8up PodConfig's pod spec, like
+    tolerations and affinity, so our own jobs can run where k8up's jobs would.
+    Returns {} if there's no PodConfig
+    """
+    cmd = f"kubectl get -n {namespace} podconfigs.k8up.io/{pod_config} -o json"
+    res = subproc([cmd], error_ok=True, quiet=True, spinner=False)
+    try:
+        pod_spec = loads(res)['spec']['template']['spec']
+    except (TypeError, ValueError, KeyError) as e:
+        log.warning(f"Couldn't get the {pod_config} PodConfig in {namespace}: {e}")
+        return {}
+    return {key: value for key, value in pod_spec.items() if key in POD_CONFIG_KEYS}
+
+
+def create_volume_snapshots(k8s: K8s,
+                            namespace: str,
+                            snapshots: dict,
+                            snapshot_class: str) -> None:
+    """
+    creates a VolumeSnapshot of each pvc in a dict of {pvc_name: snapshot_name}
+    and waits till they're ready to use
+    """
+    k8s.apply_custom_resources([
+        {"apiVersion": "snapshot.storage.k8s.io/v1",
+         "kind": "VolumeSnapshot",
+         "metadata": {"name": snapshot, "namespace": namespace},
+         "spec": {"volumeSnapshotClassName": snapshot_class,
+                  "source": {"persistentVolumeClaimName": pvc}}}
+        for pvc, snapshot in snapshots.items()])
+
+    for snapshot in snapshots.values():
+        log.info(f"Waiting on VolumeSnapshot {snapshot} to be ready to use")
+        subproc([f"kubectl wait -n {namespace} volumesnapshot/{snapshot} "
+                 "--for=jsonpath={.status.readyToUse}=true --timeout=10m"],
+                spinner=False)
+
+
+def clone_volume_snapshots(k8s: K8s,
+                           namespace: str,
+                           pvcs: dict,
+                           snapshots: dict,
+                           clones: dict) -> None:
+    """
+    creates a new pvc named clones[pvc] from each VolumeSnapshot, that k8up
+    won't back up
+    """
+    k8s.apply_custom_resources([
+        {"apiVersion": "v1",
+         "kind": "PersistentVolumeClaim",
+         "metadata": {"name": clones[pvc],
+                      "namespace": namespace,
+                      "annotations": {"k8up.io/backup": "false"}},
+         "spec": {"storageClassName": pvcs[pvc].storage_class_name,
+                  "accessModes": ["ReadWriteOnce"],
+                  "dataSource": {"name": snapshot,
+                                 "kind": "VolumeSnapshot",
+                                 "apiGroup": "snapshot.storage.k8s.io"},
+                  "resources": {"requests": {
+                      "storage": pvcs[pvc].resources.requests['storage']}}}}
+        for pvc, snapshot in snapshots.items()])
+
+
+def restic_backup_job(job_name: str,
+                      namespace: str,
+                      endpoint: str,
+                      bucket: str,
+                      clones: dict,
+                      pod_spec: dict = {}) -> dict:
+    """
+    returns a k8s job to restic backup each clone pvc, mounted read only at
+    /data/{original pvc name} with the namespace as the host, like k8up does.
+    pod_spec is merged into the job's pod spec, e.g. for tolerations
+    """
+    volumes = []
+    mounts = []
+    for pvc, clone in clones.items():
+        volumes.append({"name": pvc, "persistentVolumeClaim": {"claimName": clone,
+                                                               "readOnly": True}})
+        mounts.append({"name": pvc, "mountPath": f"/data/{pvc}", "readOnly": True})
+    volumes.append({"name": "restic-repo-password",
+                    "secret": {"secretName": "s3-backups-credentials"}})
+    mounts.append({"name": "restic-repo-password",
+                   "readOnly": True,
+                   "mountPath": "/secrets/"})
+
+    backup_cmd = ("for pvc in /data/*; do "
+                  f"restic backup --host {namespace} --json $pvc || exit 1; done")
+    return {
+      "apiVersion": "batch/v1",
+      "kind": "Job",
+      "metadata": {"name": job_name, "namespace": namespace},
+      "spec": {
+        "backoffLimit": 2,
+        "template": {
+          "spec": {
+            **pod_spec,
+            "volumes": volumes,
+            "containers": [{
+              "name": "restic-backup",
+              "image": "instrumentisto/restic:latest",
+              "command": ["/bin/sh", "-c", backup_cmd],
+              "volumeMounts": mounts,
+              "env": [
+                {"name": "RESTIC_REPOSITORY", "value": f"s3:{endpoint}/{bucket}"},
+                {"name": "RESTIC_PASSWORD_FILE",
+                 "value": "/secrets/resticRepoPassword"},
+                {"name": "AWS_ACCESS_KEY_ID",
+                 "valueFrom": {"secretKeyRef": {"key": "accessKeyId",
+                                                "name": "s3-backups-credentials"}}},
+                {"name": "AWS_SECRET_ACCESS_KEY",
+                 "valueFrom": {"secretKeyRef": {"key": "secretAccessKey",
+                                                "name": "s3-backups-credentials"}}}
+                ]
+              }],
+            "restartPolicy": "Never"
+            }
+          }
+        }
+      }
 
 
 def create_cnpg_cluster_backup(app: str,
                                namespace: str,
                                s3_endpoint: str,
-                               quiet: bool = False) -> None:
+                               quiet: bool = False,
+                               notifications: bool = False,
+                               method: str = "barmanObjectStore") -> None:
     """
     creates a backup for cnpg clusters and waits for it to complete
 
     pass in quiet=True to disable loading spinners for logging
+    pass in notifications=True to listen for s3 bucket notifications while
+    waiting on the last wal archive, instead of only polling for it
+    pass in method="volumeSnapshot" to back up to a CSI volume snapshot instead
+    """
+    backup_name = run_cnpg_backup(app, namespace, quiet, method)
+
+    # volume snapshot backups don't have any wal archives to wait on
+    if method != "volumeSnapshot":
+        wait_for_cnpg_backup_wal(app, namespace, s3_endpoint, backup_name,
+                                 notifications)
+
+
+def run_cnpg_backup(app: str,
+                    namespace: str,
+                    quiet: bool = False,
+                    method: str = "barmanObjectStore") -> str:
+    """
+    creates a cnpg backup and waits for cnpg to report it as completed, but
+    not for its last wal archive to be in s3. Returns the backup's name
     """
     now = datetime.now().strftime('%Y-%m-%d-%H-%M')
     backup_name = f"{app}-smol-k8s-lab-cnpg-backup-{now}"
+    # a snapshot can be taken at the same time as a barman backup
+    if method == "volumeSnapshot":
+        backup_name = f"{app}-smol-k8s-lab-cnpg-snapshot-{now}"
     cluster_name = f"{app}-postgres"
     cnpg_backup = {"apiVersion": "postgresql.cnpg.io/v1",
                    "kind": "Backup",
@@ -125,7 +458,7 @@ def create_cnpg_cluster_backup(app: str,
                       "namespace": namespace
                       },
                    "spec": {
-                      "method": "barmanObjectStore",
+                      "method": method,
                       "cluster": {
                         "name": cluster_name
                         }
@@ -141,20 +474,33 @@ def create_cnpg_cluster_backup(app: str,
                 "-o custom-columns=PHASE:.status.phase "
                 f"backups.postgresql.cnpg.io/{backup_name}")
     while True:
-        log.error(f"Waiting on backups.postgresql.cnpg.io/{backup_name} to complete")
+        log.debug(f"Waiting on backups.postgresql.cnpg.io/{backup_name} to complete")
         res = subproc([wait_cmd], error_ok=True, spinner=quiet)
-        log.error(res)
+        log.debug(res)
         if "completed" in res:
             break
         sleep(1)
 
+    return backup_name
+
+
+def wait_for_cnpg_backup_wal(app: str,
+                             namespace: str,
+                             s3_endpoint: str,
+                             backup_name: str,
+                             notifications: bool = False) -> None:
+    """
+    waits for the last wal archive of a completed barman backup to be in s3
+    """
+    k8s = K8s()
+    cluster_name = f"{app}-postgres"
+
     # get credentials and setup s3 object to check if all wal archives are there
     credentials = k8s.get_secret("s3-postgres-credentials", namespace)
     access_key_id = base64.b64decode(credentials['data']['accessKeyId']).decode('utf-8')
     secret_access_key = base64.b64decode(credentials['data']['secretAccessKey']).decode('utf-8')
-    log.error("got credentials and about to check s3")
+    log.debug("got credentials and about to check s3")
     s3 = BetterMinio("", s3_endpoint, access_key_id, secret_access_key)
-    all_wals = f"{cluster_name}/wals"
 
     # after the backup is completed, check which wal archive it says is the last one
     end_wal_cmd = (
@@ -162,65 +508,28 @@ def create_cnpg_cluster_backup(app: str,
             f" -o custom-columns=endwal:.status.endWal --no-headers"
             )
     end_wal = subproc([end_wal_cmd]).strip()
-    end_wal_folder = f"{all_wals}/{end_wal[:16]}/{end_wal}"
-    log.error(f"Wal folder we expect for {cluster_name} backup is: '{end_wal_folder}'")
-    check_for_specific_wal(s3, cluster_name, all_wals, end_wal)
-
-    # wait till that wal archive is actually available before declaring the
-    # function completed
-    # while True:
-    #     log.error("Checking if file is available")
-    #     # after the backup is completed, wait for the final wal archive to complete
-    #     try:
-    #         wal_file = s3.list_object(cluster_name, end_wal_folder, recursive=True)
-    #         for sub_obj in wal_file:
-    #             log.info(sub_obj.object_name)
-    #         log.error(f"{end_wal_folder} was found. Sleeping for 15 seconds just in case.")
-    #         sleep(15)
-    #         break
-    #     except Exception as e:
-    #         log.error(e)
-    #         log.error(f"{end_wal_folder} still not found. Sleeping 5 seconds.")
-    #         sleep(5)
-    #         continue
-
-    # new_total_wals = get_total_wals(s3, cluster_name, all_wals)
-    # log.error(f"New total number of wals after is {str(new_total_wals)}")
-    # verify the wal is absolutely completed by waiting for the next one
-    # while True:
-    #     new_total_wals = get_total_wals(s3, cluster_name, all_wals)
-    #     log.error(f"New total number of wals after is {str(new_total_wals)}")
-    #     if new_total_wals > total_wals:
-    #         log.error(f"New Total number of wals is {str(new_total_wals)} which"
-    #                   f"is more than our starting wal count: {str(total_wals)}"
-    #                   ", so we break and return")
-    #         return
-    #     else:
-    #         log.error(f"Total number of wals is {str(new_total_wals)} which is "
-    #                   f"not more than our starting wal count: {str(total_wals)}"
-    #                   ", so we will wait 10 seconds")
-    #         sleep(10)
+    check_for_specific_wal(s3, cluster_name, end_wal, notifications)
+
 
 def check_for_specific_wal(s3: BetterMinio,
                            cluster_name: str,
-                           all_wals_dir: str,
-                           wall_to_chck: str):
+                           wal_to_check: str,
+                           notifications: bool = False) -> True:
     """
-    count the number of wals in s3 for this cluster and log them each
+    wait for a specific wal archive to be in s3 for this cluster, checking
+    just that one wal's path instead of listing every wal in the archive
     """
+    wal_path = f"{cluster_name}/wals/{wal_to_check[:16]}/{wal_to_check}"
+    log.info(f"Waiting for wal archive to be in s3: {wal_path}")
 
-    while True:
-        wal_files = s3.list_object(cluster_name, all_wals_dir, recursive=True)
-        total_wals = 0
-        for wal in wal_files:
-            total_wals += 1
-            log.error(f"{str(total_wals)}: Found a wal called {wal.object_name}")
-
-            # return if we found the correct wal
-            if wall_to_chck in wal.object_name:
-                log.error("wal to check present 🎉")
-                sleep(2)
-                return True
-
-        log.error(f"found {str(total_wals)} total wal files, but not the one we wanted: {wall_to_chck}. Sleeping 10 seconds...")
-        sleep(10)
+    if s3.wal_exists(cluster_name, cluster_name, wal_to_check):
+        log.info("wal to check present 🎉")
+        return True
+
+    # notifications for the whole timeline segment, so we wake up for new wals
+    s3.wait_for_object(cluster_name,
+                       wal_path,
+                       notifications=notifications,
+                       notification_prefix=f"{cluster_name}/wals/{wal_to_check[:16]}/")
+    log.info("wal to check present 🎉")
+    return True
@@ -0,0 +1,222 @@
+"""
+Runs backups for many apps at once, instead of one app at a time, while
+making sure we don't run too many restic jobs on one node or against one s3
+endpoint at the same time.
+"""
+# local libs
+from smol_k8s_lab.k8s_tools.backup import create_pvc_restic_backup
+from smol_k8s_lab.k8s_tools.k8s_lib import K8s
+from smol_k8s_lab.utils.events import EVENTS, RESOURCE_STATUS
+from smol_k8s_lab.utils.rich_cli.console_logging import CONSOLE
+
+# external libs
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, ExitStack
+from json import loads
+import logging as log
+import re
+from rich.table import Table
+from threading import Lock, Semaphore
+from time import monotonic
+
+# matches restic's plain text summary, e.g. "Added to the repository: 1.2 MiB"
+ADDED_REGEX = re.compile(r"Added to the repository: ([\d.]+) (B|KiB|MiB|GiB|TiB)")
+UNITS = {"B": 1, "KiB": 1024, "MiB": 1024**2, "GiB": 1024**3, "TiB": 1024**4}
+
+
+class BackupSlots():
+    """
+    Hands out semaphores to cap how many restic jobs can run at once for any
+    given node and any given s3 endpoint
+    """
+    def __init__(self, per_node: int = 1, per_endpoint: int = 2):
+        self.limits = {"node": per_node, "endpoint": per_endpoint}
+        self.semaphores = {}
+        self.lock = Lock()
+
+    def get_semaphore(self, kind: str, name: str) -> Semaphore:
+        with self.lock:
+            key = (kind, name)
+            if key not in self.semaphores:
+                self.semaphores[key] = Semaphore(self.limits[kind])
+            return self.semaphores[key]
+
+    @contextmanager
+    def slot(self, endpoint: str, nodes: list):
+        """
+        hold a slot for the endpoint and every node at once. Everything is
+        always acquired in the same (sorted) order, so we can't deadlock
+        """
+        keys = sorted([("endpoint", endpoint)] + [("node", node) for node in nodes])
+        with ExitStack() as stack:
+            for kind, name in keys:
+                stack.enter_context(self.get_semaphore(kind, name))
+            yield
+
+
+def get_backup_apps(apps: dict, app_names: list = []) -> dict:
+    """
+    returns a dict of {app_name: app_config} of every enabled app that has
+    backups configured, optionally limited to only the apps in app_names
+    """
+    backup_apps = {}
+    for app, app_cfg in apps.items():
+        if app_names and app not in app_names and app.replace("_", "-") not in app_names:
+            continue
+
+        if not app_cfg.get('enabled', False):
+            continue
+
+        s3 = app_cfg.get('backups', {}).get('s3', {})
+        if not s3.get('endpoint', "") or not s3.get('bucket', ""):
+            log.debug(f"Skipping backup of {app}: no backup s3 endpoint or bucket")
+            continue
+
+        backup_apps[app] = app_cfg
+
+    return backup_apps
+
+
+def get_bytes_added(k8s: K8s, job_name: str, namespace: str) -> int | None:
+    """
+    parses the restic summaries in the k8up backup job logs to get the total
+    bytes added to the restic repo. Returns None if we can't find any
+    """
+    bytes_added = None
+    for line in k8s.get_job_logs(job_name, namespace).splitlines():
+        added = None
+        try:
+            msg = loads(line)
+            if isinstance(msg, dict):
+                added = msg.get('data_added', msg.get('bytes added', None))
+        except ValueError:
+            match = ADDED_REGEX.search(line)
+            if match:
+                added = int(float(match.group(1)) * UNITS[match.group(2)])
+
+        if added is not None:
+            bytes_added = (bytes_added or 0) + int(added)
+
+    return bytes_added
+
+
+def backup_app(app: str, app_cfg: dict, slots: BackupSlots) -> dict:
+    """
+    backs up a single app's pvcs and cnpg cluster, if it has one.
+    returns a dict with the app's status, duration, and bytes transferred
+    """
+    start = monotonic()
+    result = {"app": app, "status": "failed", "duration": 0.0, "bytes": None}
+
+    namespace = app_cfg['argo']['namespace']
+    s3 = app_cfg['backups']['s3']
+
+    cnpg_backup = app_cfg.get('init', {}).get('restore', {}).get('cnpg_restore',
+                                                                   "not_applicable")
+    if cnpg_backup == "not_applicable":
+        cnpg_backup = False
+        cnpg_endpoint = ""
+    else:
+        cnpg_endpoint = app_cfg['argo']['secret_keys'].get('s3_endpoint', "")
+
+    EVENTS.emit(RESOURCE_STATUS, f"{app} backup", status="backing up")
+    try:
+        k8s = K8s()
+        nodes = k8s.get_pvc_nodes(namespace)
+        log.debug(f"{app} pvcs are on nodes: {nodes}")
+
+        job_name = create_pvc_restic_backup(
+                app=app,
+                namespace=namespace,
+                endpoint=s3['endpoint'],
+                bucket=s3['bucket'],
+                cnpg_backup=cnpg_backup,
+                cnpg_s3_endpoint=cnpg_endpoint,
+                needs_pod_config=True,
+                restic_slot=slots.slot(s3['endpoint'], nodes),
+                snapshot_class=app_cfg['backups'].get('volume_snapshot_class', ""),
+                bucket_notifications=app_cfg['backups'].get('bucket_notifications', False)
+                )
+        result['bytes'] = get_bytes_added(k8s, job_name, namespace)
+        result['status'] = "done"
+    except Exception as e:
+        log.error(f"Backup of {app} failed: {e}")
+        result['error'] = str(e)
+
+    result['duration'] = monotonic() - start
+    EVENTS.emit(RESOURCE_STATUS, f"{app} backup",
+                status=f"{result['status']} in {result['duration']:.1f}s",
+                final=True)
+    return result
+
+
+def backup_apps(apps: dict,
+                app_names: list = [],
+                parallel: int = 4,
+                per_node: int = 1,
+                per_endpoint: int = 2) -> list:
+    """
+    backs up every enabled app with backups configured (or only app_names),
+    running up to parallel app backups at once, but only per_node restic jobs
+    per node and per_endpoint restic jobs per s3 endpoint at the same time.
+
+    Returns a list of dicts with each app's status, duration, and bytes
+    """
+    backup_apps = get_backup_apps(apps, app_names)
+    if not backup_apps:
+        log.warning("No enabled apps with backups configured were found")
+        return []
+
+    log.info(f"Backing up: {', '.join(backup_apps)}")
+    slots = BackupSlots(per_node, per_endpoint)
+
+    for app in backup_apps:
+        EVENTS.emit(RESOURCE_STATUS, f"{app} backup", status="queued")
+
+    results = []
+    with ThreadPoolExecutor(max_workers=max(parallel, 1)) as pool:
+        futures = [pool.submit(backup_app, app, app_cfg, slots)
+                   for app, app_cfg in backup_apps.items()]
+        for future in as_completed(futures):
+            result = future.result()
+            log.info(f"Backup of {result['app']} {result['status']} in "
+                     f"{result['duration']:.1f}s")
+            results.append(result)
+
+    return results
+
+
+def format_bytes(num_bytes: int | None) -> str:
+    """
+    returns bytes as a human readable string, e.g. 1.5 MiB
+    """
+    if num_bytes is None:
+        return "unknown"
+
+    size = float(num_bytes)
+    for unit in UNITS:
+        if size < 1024 or unit == "TiB":
+            break
+        size /= 1024
+    return f"{size:.1f} {unit}"
+
+
+def print_backup_summary(results: list) -> None:
+    """
+    prints a table of every app's backup status, duration, and bytes transferred
+    """
+    table = Table(title="💾 Backup summary")
+    for column in ["app", "status", "duration", "transferred"]:
+        table.add_column(column)
+
+    for result in sorted(results, key=lambda result: result['app']):
+        if result['status'] == "done":
+            status = "[green]done[/]"
+        else:
+            status = "[magenta]failed[/]"
+
+        table.add_row(result['app'],
+                      status,
+                      f"{result['duration']:.1f}s",
+                      format_bytes(result['bytes']))
+    CONSOLE.print(table)
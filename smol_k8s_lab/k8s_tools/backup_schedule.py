@@ -0,0 +1,211 @@
+"""
+Staggers the scheduled backups of every app across a nightly backup window,
+so they don't all hit the same s3 endpoint and node disks at midnight.
+"""
+# local libs
+from smol_k8s_lab.k8s_tools.argocd_util import ArgoCD
+from smol_k8s_lab.k8s_tools.backup_orchestrator import get_backup_apps
+
+# external libs
+from base64 import b64decode
+import logging as log
+import re
+from rich.table import Table
+from rich.text import Text
+from ruamel.yaml import YAML
+
+# the schedules we've ever defaulted to, which are safe for us to move
+DEFAULT_PVC_SCHEDULES = ["10 0 * * *", "15 0 * * *"]
+DEFAULT_POSTGRES_SCHEDULES = ["0 0 0 * * *"]
+
+# postgres backups must happen this long before pvc backups, see the config
+DB_LEAD_MINUTES = 10
+
+# k8s quantity suffixes in bytes
+QUANTITY_UNITS = {"Ki": 1024, "Mi": 1024**2, "Gi": 1024**3, "Ti": 1024**4,
+                  "K": 1000, "M": 1000**2, "G": 1000**3, "T": 1000**4, "": 1}
+QUANTITY_REGEX = re.compile(r"^([\d.]+)(Ki|Mi|Gi|Ti|K|M|G|T|)$")
+
+
+def parse_quantity(quantity: str) -> int:
+    """
+    returns bytes for a k8s storage quantity like 20Gi, or 0 if we can't parse it
+    """
+    match = QUANTITY_REGEX.match(str(quantity).strip())
+    if not match:
+        return 0
+    return int(float(match.group(1)) * QUANTITY_UNITS[match.group(2)])
+
+
+def estimate_backup_size(app_cfg: dict) -> int:
+    """
+    estimates how much an app backs up, in bytes, from all its PVC capacities
+    """
+    size = 0
+    for key, value in app_cfg['argo'].get('secret_keys', {}).items():
+        if key.endswith("_capacity") or key.endswith("_storage"):
+            size += parse_quantity(value)
+    return size
+
+
+def uses_default_schedules(backup_cfg: dict) -> bool:
+    """
+    True if an app's backup schedules are unset or still our defaults
+    """
+    pvc_schedule = backup_cfg.get('pvc_schedule', DEFAULT_PVC_SCHEDULES[0])
+    postgres_schedule = backup_cfg.get('postgres_schedule', DEFAULT_POSTGRES_SCHEDULES[0])
+    return (pvc_schedule in DEFAULT_PVC_SCHEDULES and
+            postgres_schedule in DEFAULT_POSTGRES_SCHEDULES)
+
+
+def plan_backup_schedules(apps: dict,
+                          window_start: int = 0,
+                          window_minutes: int = 360,
+                          per_endpoint: int = 2,
+                          gib_per_minute: float = 1.0,
+                          min_minutes: int = 5) -> dict:
+    """
+    Plans staggered backup schedules for every enabled app with backups that
+    still uses the default schedules. Apps are spread over per_endpoint lanes
+    for each s3 endpoint, biggest backups first, starting at window_start
+    (minutes after midnight). Backup durations are estimated from PVC
+    capacities at gib_per_minute.
+
+    Returns a dict of {app: {endpoint, minutes, postgres_start, pvc_start,
+                             pvc_schedule, postgres_schedule}}
+    """
+    backup_apps = {app: app_cfg for app, app_cfg in get_backup_apps(apps).items()
+                   if uses_default_schedules(app_cfg['backups'])}
+
+    # biggest backups get scheduled first, so the small ones fill in the gaps
+    def minutes(app_cfg: dict) -> int:
+        size_gib = estimate_backup_size(app_cfg) / 1024**3
+        # round up to 5 minutes, so the schedules are easier on the eyes
+        estimate = max(min_minutes, int(size_gib / gib_per_minute) + 1)
+        return -(-estimate // 5) * 5
+
+    ordered = sorted(backup_apps.items(), key=lambda item: -minutes(item[1]))
+
+    # {endpoint: [minute each lane is free again]}
+    lanes = {}
+    plan = {}
+    for app, app_cfg in ordered:
+        endpoint = app_cfg['backups']['s3']['endpoint']
+        endpoint_lanes = lanes.setdefault(endpoint, [window_start] * per_endpoint)
+        lane = endpoint_lanes.index(min(endpoint_lanes))
+        start = endpoint_lanes[lane]
+
+        restore = app_cfg.get('init', {}).get('restore', {})
+        has_db = restore.get('cnpg_restore', "not_applicable") != "not_applicable"
+        pvc_start = start + DB_LEAD_MINUTES if has_db else start
+        duration = minutes(app_cfg)
+        endpoint_lanes[lane] = pvc_start + duration
+
+        # cron schedules are daily, so wrap past midnight
+        pvc_minute = pvc_start % 1440
+        plan[app] = {
+                "endpoint": endpoint,
+                "minutes": duration,
+                "postgres_start": start if has_db else None,
+                "pvc_start": pvc_start,
+                "pvc_schedule": f"{pvc_minute % 60} {pvc_minute // 60} * * *",
+                "postgres_schedule": (f"0 {start % 1440 % 60} {start % 1440 // 60} * * *"
+                                      if has_db else DEFAULT_POSTGRES_SCHEDULES[0])
+                }
+
+        if pvc_start + duration > window_start + window_minutes:
+            log.warning(f"{app}'s backup is estimated to run past the backup window")
+
+    log.debug(f"backup schedule plan is {plan}")
+    return plan
+
+
+def apply_backup_schedules(apps: dict, plan: dict, argocd: ArgoCD = None) -> None:
+    """
+    sets each app's planned backup schedules in the config, so that they get
+    used by the app installs, and if argocd is passed in, writes them all into
+    the appset-secret-vars secret at once for the apps that are already installed
+    """
+    fields = {}
+    for app, schedule in plan.items():
+        apps[app]['backups']['pvc_schedule'] = schedule['pvc_schedule']
+        apps[app]['backups']['postgres_schedule'] = schedule['postgres_schedule']
+
+        # apps that aren't installed yet write their own schedules on install
+        if argocd and argocd.check_if_app_exists(app.replace("_", "-")):
+            fields[f"{app}_pvc_backup_schedule"] = schedule['pvc_schedule']
+            fields[f"{app}_postgres_backup_schedule"] = schedule['postgres_schedule']
+
+    if fields and argocd.check_if_app_exists('appset-secrets-plugin'):
+        # don't rewrite the secret and resync the plugin if nothing changed
+        secret_vars = get_appset_secret_vars(argocd)
+        fields = {key: value for key, value in fields.items()
+                  if secret_vars.get(key, None) != value}
+        if fields:
+            argocd.update_appset_secret(fields)
+        else:
+            log.debug("appset-secret-vars already has the planned backup schedules")
+
+
+def get_appset_secret_vars(argocd: ArgoCD) -> dict:
+    """
+    returns the values in the appset-secret-vars secret, or {} if we can't read it
+    """
+    try:
+        secret = argocd.k8s.get_secret('appset-secret-vars', argocd.namespace)
+        secret_vars = b64decode(secret['data']['secret_vars.yaml']).decode('utf8')
+    except Exception as e:
+        log.debug(f"Couldn't read appset-secret-vars: {e}")
+        return {}
+    return YAML(typ='safe').load(secret_vars) or {}
+
+
+def backup_timeline(plan: dict,
+                    window_start: int = 0,
+                    window_minutes: int = 360,
+                    width: int = 48,
+                    highlight: str = "") -> Table:
+    """
+    returns a rich table with a bar for when each app's backups run
+    """
+    per_column = window_minutes / width
+    end = window_start + window_minutes
+    title = (f"📆 Backup window {window_start // 60:02}:{window_start % 60:02}"
+             f" - {end % 1440 // 60:02}:{end % 60:02}")
+    table = Table(title=title, box=None, row_styles=["", "dim"])
+    for column in ["app", "s3 endpoint", "db", "pvc", "timeline"]:
+        table.add_column(column)
+
+    for app, schedule in sorted(plan.items(), key=lambda item: item[1]['pvc_start']):
+        bar = Text()
+        pvc_end = schedule['pvc_start'] + schedule['minutes']
+        for column in range(width):
+            minute = window_start + column * per_column
+            if schedule['postgres_start'] is not None and \
+                    schedule['postgres_start'] <= minute < schedule['pvc_start']:
+                bar.append("▒", style="light_steel_blue")
+            elif schedule['pvc_start'] <= minute < pvc_end:
+                bar.append("█", style="cornflower_blue")
+            else:
+                bar.append("·", style="dim")
+
+        if schedule['postgres_start'] is not None:
+            db_time = minute_to_clock(schedule['postgres_start'])
+        else:
+            db_time = "-"
+
+        name = f"[b]{app}[/b]" if app == highlight else app
+        table.add_row(name,
+                      schedule['endpoint'],
+                      db_time,
+                      minute_to_clock(schedule['pvc_start']),
+                      bar)
+    return table
+
+
+def minute_to_clock(minute: int) -> str:
+    """
+    returns minutes after midnight as HH:MM
+    """
+    minute = minute % 1440
+    return f"{minute // 60:02}:{minute % 60:02}"
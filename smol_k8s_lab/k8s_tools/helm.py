@@ -5,13 +5,13 @@ LICENSE: AGPLv4
 """
 
 # internal libraries
+from ..utils.artifacts import fetch_text
 from ..utils.run.subproc import subproc
 from ..utils.rich_cli.console_logging import header, sub_header
 
 # external libraries
 from collections import OrderedDict
 import logging as log
-import requests
 from ruamel.yaml import YAML
 from shutil import which
 
@@ -148,9 +148,9 @@ class Helm:
             """
             # get the contents of the remote url
             if "postgres-cluster" in self.release_name:
-                res = requests.get(APPSET_URLS['cnpg-cluster']).text
+                res = fetch_text(APPSET_URLS['cnpg-cluster'])
             else:
-                res = requests.get(APPSET_URLS[self.release_name]).text
+                res = fetch_text(APPSET_URLS[self.release_name])
 
             # use the ruamel.yaml library to load the yaml
             yaml = YAML()
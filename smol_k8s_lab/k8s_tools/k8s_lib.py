@@ -11,6 +11,7 @@ from time import sleep
 
 # internal libraries
 from ..constants import XDG_CACHE_DIR
+from ..utils.artifacts import fetch_file, is_url
 from ..utils.run.subproc import subproc, simple_loading_bar
 
 
@@ -27,6 +28,7 @@ class K8s():
         client.rest.logger.setLevel(log.WARNING)
         self.api_client = client.ApiClient()
         self.core_v1_api = client.CoreV1Api(self.api_client)
+        self.batch_v1_api = client.BatchV1Api(self.api_client)
 
     def create_secret(self,
                       name: str,
@@ -203,6 +205,38 @@ class K8s():
         else:
             return []
 
+    def get_pvc_nodes(self, namespace: str) -> list:
+        """
+        get the names of the nodes running pods that mount a pvc in a namespace
+        """
+        nodes = []
+        for pod in self.core_v1_api.list_namespaced_pod(namespace).items:
+            node = pod.spec.node_name
+            if not node or node in nodes:
+                continue
+            for volume in pod.spec.volumes or []:
+                if volume.persistent_volume_claim:
+                    nodes.append(node)
+                    break
+        return nodes
+
+    def get_job_logs(self, job_name: str, namespace: str) -> str:
+        """
+        get the logs of all the pods of a given job
+        """
+        logs = ""
+        pods = self.core_v1_api.list_namespaced_pod(
+                namespace, label_selector=f"job-name={job_name}"
+                )
+        for pod in pods.items:
+            try:
+                logs += self.core_v1_api.read_namespaced_pod_log(
+                        pod.metadata.name, namespace
+                        )
+            except ApiException as e:
+                log.debug(f"couldn't get logs for {pod.metadata.name}: {e}")
+        return logs
+
     def delete_namespaced_pods(self, namespace: str = "") -> None:
         """
         deletes all the pods in a given namespace
@@ -243,8 +277,11 @@ class K8s():
                         selector: str = "component=controller"):
         """
         applies a manifest and waits with a nice loading bar if deployment name
-        is passed in
+        is passed in. Remote manifests are applied from the artifact cache
         """
+        if is_url(manifest_file_name):
+            manifest_file_name = fetch_file(manifest_file_name)
+
         if not namespace:
             cmds = [f"kubectl apply --wait -f {manifest_file_name}"]
         else:
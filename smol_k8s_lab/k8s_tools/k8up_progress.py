@@ -0,0 +1,309 @@
+"""
+Follows the restic pod of a k8up backup or restore job through the k8s API,
+parses restic's json status lines, and reports the progress to a callback,
+which defaults to a rich progress bar
+"""
+# internal libraries
+from smol_k8s_lab.k8s_tools.k8s_lib import K8s
+from smol_k8s_lab.utils.events import EVENTS, WAIT_START, WAIT_PROGRESS, WAIT_END
+from smol_k8s_lab.utils.rich_cli.console_logging import CONSOLE
+
+# external libraries
+from collections.abc import Callable
+from json import loads
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+import logging as log
+from rich.progress import (Progress, BarColumn, TaskProgressColumn, TextColumn,
+                           TimeRemainingColumn)
+from threading import Lock
+from time import monotonic
+
+
+class RichJobProgress():
+    """
+    One rich progress display shared by every job we're following, since rich
+    can only show one live display per console at a time
+    """
+    def __init__(self):
+        self.progress = Progress(TextColumn("[green]{task.description}"),
+                                 BarColumn(),
+                                 TaskProgressColumn(),
+                                 TextColumn("{task.fields[transferred]}"),
+                                 TimeRemainingColumn(),
+                                 console=CONSOLE,
+                                 transient=True)
+        self.tasks = 0
+        self.lock = Lock()
+
+    def add(self, description: str) -> Callable:
+        """
+        adds a progress bar and returns a callback to update it
+        """
+        with self.lock:
+            if not self.tasks:
+                self.progress.start()
+            self.tasks += 1
+            task_id = self.progress.add_task(description, total=100, transferred="")
+
+        def update(status: dict) -> None:
+            self.progress.update(task_id,
+                                 completed=status['percent'],
+                                 transferred=format_transferred(status))
+        update.task_id = task_id
+        return update
+
+    def remove(self, update: Callable) -> None:
+        """
+        removes a progress bar and stops the display when it's the last one
+        """
+        with self.lock:
+            self.progress.remove_task(update.task_id)
+            self.tasks -= 1
+            if not self.tasks:
+                self.progress.stop()
+
+
+RICH_PROGRESS = RichJobProgress()
+
+
+def format_transferred(status: dict) -> str:
+    """
+    returns something like 1.2/3.4 GiB, if restic told us the bytes
+    """
+    if status.get('total_bytes', None) is None:
+        return ""
+
+    done = status.get('bytes_done', 0) or 0
+    total = status['total_bytes']
+    for unit in ["B", "KiB", "MiB", "GiB", "TiB"]:
+        if total < 1024 or unit == "TiB":
+            break
+        done /= 1024
+        total /= 1024
+    return f"{done:.1f}/{total:.1f} {unit}"
+
+
+def parse_restic_status(line: str) -> dict | None:
+    """
+    parses a restic --json status or summary line, or a k8up progress line.
+    Returns a dict with percent (0-100), bytes_done, total_bytes, and
+    seconds_remaining, or None if the line isn't a progress update
+    """
+    try:
+        msg = loads(line)
+    except ValueError:
+        return None
+
+    if not isinstance(msg, dict):
+        return None
+
+    message_type = msg.get('message_type', "")
+    if message_type == "status":
+        return {"percent": float(msg.get('percent_done', 0)) * 100,
+                "bytes_done": msg.get('bytes_done', msg.get('bytes_restored', None)),
+                "total_bytes": msg.get('total_bytes', None),
+                "seconds_remaining": msg.get('seconds_remaining', None)}
+
+    if message_type == "summary":
+        return {"percent": 100.0,
+                "bytes_done": msg.get('total_bytes_processed',
+                                      msg.get('total_bytes', None)),
+                "total_bytes": msg.get('total_bytes_processed',
+                                       msg.get('total_bytes', None)),
+                "seconds_remaining": 0}
+
+    # k8up logs restic's progress itself as e.g. "percentage": "42.00%"
+    percentage = msg.get('percentage', None)
+    if isinstance(percentage, str) and percentage.endswith("%"):
+        try:
+            return {"percent": float(percentage.rstrip("%")),
+                    "bytes_done": None,
+                    "total_bytes": None,
+                    "seconds_remaining": None}
+        except ValueError:
+            return None
+
+    return None
+
+
+def wait_for_job_pod(k8s: K8s,
+                     namespace: str,
+                     name: str,
+                     seen_pods: list,
+                     timeout: int = 900):
+    """
+    watches the pods of jobs in a namespace until there's a new pod, that has
+    started or finished, for the job called name or a job k8up made for the
+    backup or restore called name. Returns the pod or None
+    """
+    # {job name: names of what owns the job}
+    job_owners = {}
+    pod_watch = watch.Watch()
+    for event in pod_watch.stream(k8s.core_v1_api.list_namespaced_pod,
+                                  namespace,
+                                  label_selector="job-name",
+                                  timeout_seconds=timeout):
+        pod = event['object']
+        if pod.metadata.name in seen_pods:
+            continue
+
+        job_name = pod.metadata.labels.get('job-name', "")
+        if job_name != name and name not in get_job_owners(k8s, namespace,
+                                                           job_name, job_owners):
+            continue
+
+        if pod.status.phase in ["Running", "Succeeded", "Failed"]:
+            pod_watch.stop()
+            return pod
+
+    return None
+
+
+def get_job_owners(k8s: K8s, namespace: str, job_name: str, job_owners: dict) -> list:
+    """
+    returns the names of what owns a job, like the k8up backup or restore that
+    made it, and caches them in job_owners
+    """
+    if job_name not in job_owners:
+        try:
+            job = k8s.batch_v1_api.read_namespaced_job(job_name, namespace)
+            job_owners[job_name] = [owner.name for owner in
+                                    job.metadata.owner_references or []]
+        except ApiException as e:
+            log.debug(f"couldn't get the owners of job {job_name}: {e}")
+            job_owners[job_name] = []
+    return job_owners[job_name]
+
+
+def stream_pod_progress(k8s: K8s,
+                        pod,
+                        on_progress: Callable) -> None:
+    """
+    follows the logs of a pod once, until the container exits, passing
+    every restic progress update to on_progress
+    """
+    try:
+        logs = k8s.core_v1_api.read_namespaced_pod_log(pod.metadata.name,
+                                                       pod.metadata.namespace,
+                                                       follow=True,
+                                                       _preload_content=False)
+    except ApiException as e:
+        log.debug(f"couldn't follow logs for {pod.metadata.name}: {e}")
+        return
+
+    # chunks from the stream don't line up with lines, so we buffer them
+    buffer = ""
+    for chunk in logs.stream():
+        buffer += chunk.decode('utf-8', errors='replace')
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            status = parse_restic_status(line)
+            if status:
+                on_progress(status)
+            elif line:
+                log.debug(line)
+    logs.release_conn()
+
+    # the last line, if it didn't end in a new line
+    status = parse_restic_status(buffer)
+    if status:
+        on_progress(status)
+
+
+def wait_for_job(k8s: K8s,
+                 namespace: str,
+                 job_name: str,
+                 attempts: int = 1,
+                 timeout: int = 900) -> str:
+    """
+    watches a job until it completes or fails.
+    Returns "complete", "failed", or "running" if all attempts (pods) so far
+    failed and it made a new pod to retry
+    """
+    job_watch = watch.Watch()
+    for event in job_watch.stream(k8s.batch_v1_api.list_namespaced_job,
+                                  namespace,
+                                  field_selector=f"metadata.name={job_name}",
+                                  timeout_seconds=timeout):
+        status = event['object'].status
+        for condition in status.conditions or []:
+            if condition.status != "True":
+                continue
+            if condition.type == "Complete":
+                job_watch.stop()
+                return "complete"
+            if condition.type == "Failed":
+                job_watch.stop()
+                return "failed"
+
+        # the job is retrying with a new pod
+        if status.active and (status.failed or 0) >= attempts:
+            job_watch.stop()
+            return "running"
+
+    return "running"
+
+
+def follow_k8up_job(k8s: K8s,
+                    namespace: str,
+                    name: str,
+                    description: str = "",
+                    on_progress: Callable = None,
+                    quiet: bool = False) -> bool:
+    """
+    follows the pod(s) of a k8up backup or restore job with name in their pod
+    name, until the job completes or fails. Progress goes to on_progress if
+    passed in, otherwise to a rich progress bar, unless quiet=True.
+
+    Returns True if the job completed and False if it failed
+    """
+    rich_update = None
+    if not on_progress:
+        # the progress events are already being drawn, so don't add a bar too
+        if quiet or EVENTS.live:
+            on_progress = lambda status: None
+        else:
+            rich_update = RICH_PROGRESS.add(description or name)
+            on_progress = rich_update
+
+    wait_name = description or name
+
+    def report_progress(status: dict) -> None:
+        EVENTS.emit(WAIT_PROGRESS, wait_name,
+                    completed=status['percent'],
+                    total=100)
+        on_progress(status)
+
+    EVENTS.emit(WAIT_START, wait_name, total=100)
+    start = monotonic()
+    ok = False
+    seen_pods = []
+    try:
+        while True:
+            pod = wait_for_job_pod(k8s, namespace, name, seen_pods)
+            if not pod:
+                log.warning(f"Timed out waiting for a k8up pod for {name}")
+                return False
+            seen_pods.append(pod.metadata.name)
+
+            stream_pod_progress(k8s, pod, report_progress)
+
+            job_name = pod.metadata.labels.get('job-name', "")
+            if not job_name:
+                ok = pod.status.phase == "Succeeded"
+                return ok
+
+            result = wait_for_job(k8s, namespace, job_name, len(seen_pods))
+            if result == "complete":
+                log.info(f"k8up job {job_name} completed")
+                ok = True
+                return True
+            if result == "failed":
+                log.error(f"k8up job {job_name} failed")
+                return False
+            log.info(f"k8up job {job_name} is retrying with a new pod")
+    finally:
+        EVENTS.emit(WAIT_END, wait_name, duration=monotonic() - start, ok=ok)
+        if rich_update:
+            RICH_PROGRESS.remove(rich_update)
@@ -0,0 +1,188 @@
+"""
+A catalog of the latest restic snapshot for every path in a restic repo, so
+that a restore only has to read the repository's snapshot index once, no
+matter how many PVCs it restores.
+"""
+# internal libraries
+from smol_k8s_lab.constants import XDG_CACHE_DIR
+from smol_k8s_lab.utils.artifacts import write_atomically
+from smol_k8s_lab.utils.run.subproc import subproc
+
+# external libraries
+from hashlib import sha256
+from json import dumps, loads
+import logging as log
+from os import environ, path
+from threading import Lock
+
+# one catalog per restic repo and tags, shared by every restore step in this run
+CATALOGS = {}
+CATALOGS_LOCK = Lock()
+
+
+class ResticCatalog():
+    """
+    Loads the latest snapshot for each path in a restic repo with one
+    "restic snapshots" call and answers "latest snapshot for PVC X" from memory.
+
+    The catalog is also cached in ~/.cache/smol-k8s-lab/restic/, keyed by the
+    repo and the ids of the snapshots in it, so a re-run only has to list the
+    snapshot ids to know the cache is still good
+    """
+    def __init__(self,
+                 s3_endpoint: str,
+                 s3_bucket: str,
+                 access_key_id: str,
+                 secret_access_key: str,
+                 restic_repo_password: str,
+                 tags: list = [],
+                 cache_dir: str = path.join(XDG_CACHE_DIR, 'restic')):
+        self.repo = f"s3:{s3_endpoint}/{s3_bucket}"
+        self.tags = tags
+        self.env = {"PATH": environ.get("PATH"),
+                    "HOME": environ.get("HOME"),
+                    "RESTIC_REPOSITORY": self.repo,
+                    "RESTIC_PASSWORD": restic_repo_password,
+                    "AWS_ACCESS_KEY_ID": access_key_id,
+                    "AWS_SECRET_ACCESS_KEY": secret_access_key}
+
+        # each set of tags has its own cache, so they don't overwrite each other
+        repo_hash = sha256(f"{self.repo}\0{','.join(tags)}".encode()).hexdigest()[:16]
+        self.cache_file = path.join(cache_dir, f"{repo_hash}.json")
+
+        # {path: snapshot dict} of the latest snapshot for each path
+        self.latest = {}
+        self.loaded = False
+        self.lock = Lock()
+
+    def restic(self, command: str) -> str:
+        """
+        run a read only restic command that doesn't lock the repo
+        """
+        return subproc([f"restic {command} --no-lock"],
+                       env=self.env,
+                       quiet=True,
+                       spinner=False)
+
+    def snapshot_ids_digest(self) -> str:
+        """
+        returns a hash of all the snapshot ids in the repo. This only lists the
+        snapshot files in s3, instead of reading and decrypting each of them
+        """
+        snapshot_ids = sorted(self.restic("list snapshots").split())
+        return sha256(" ".join(snapshot_ids).encode()).hexdigest()
+
+    def load(self, refresh: bool = False) -> None:
+        """
+        loads the latest snapshot for every path, from the cache file if the
+        repo hasn't changed since we cached it, otherwise from restic
+        """
+        with self.lock:
+            if self.loaded and not refresh:
+                return
+
+            digest = self.snapshot_ids_digest()
+            if not refresh and self.load_cache(digest):
+                self.loaded = True
+                return
+
+            # --latest 1 is the latest snapshot for each host and path
+            command = "snapshots --latest 1 --json"
+            for tag in self.tags:
+                command += f" --tag {tag}"
+
+            self.latest = {}
+            for snapshot in loads(self.restic(command) or "[]"):
+                for snapshot_path in snapshot.get("paths", []):
+                    self.add(snapshot_path, snapshot)
+
+            self.loaded = True
+            self.save_cache(digest)
+
+    def add(self, snapshot_path: str, snapshot: dict) -> None:
+        """
+        keep a snapshot for a path, if it's newer than the one we have
+        """
+        current = self.latest.get(snapshot_path, None)
+        if not current or snapshot['time'] > current['time']:
+            self.latest[snapshot_path] = {"id": snapshot['id'],
+                                          "time": snapshot['time'],
+                                          "hostname": snapshot.get('hostname', "")}
+
+    def load_cache(self, digest: str) -> bool:
+        """
+        loads the catalog from the cache file. Returns True if it's up to date
+        """
+        if not path.exists(self.cache_file):
+            return False
+
+        try:
+            with open(self.cache_file, 'r') as cache_file:
+                cache = loads(cache_file.read())
+        except (ValueError, OSError) as e:
+            log.debug(f"Couldn't read cached restic snapshot catalog: {e}")
+            return False
+
+        if cache.get("digest", "") != digest or cache.get("tags", []) != self.tags:
+            log.debug("Cached restic snapshot catalog is out of date")
+            return False
+
+        log.debug(f"Reusing cached restic snapshot catalog for {self.repo}")
+        self.latest = cache["latest"]
+        return True
+
+    def save_cache(self, digest: str) -> None:
+        """
+        saves the catalog to the cache file atomically
+        """
+        cache = dumps({"digest": digest, "tags": self.tags, "latest": self.latest})
+        write_atomically(self.cache_file, cache.encode())
+
+    def get_latest_snapshot(self, pvc: str) -> str:
+        """
+        returns the id of the latest snapshot of a pvc, which k8up backs up
+        to /data/{pvc}. Asks restic for just that path, if it's not in the catalog
+        """
+        self.load()
+        pvc_path = f"/data/{pvc}"
+
+        snapshot = self.latest.get(pvc_path, None)
+        if not snapshot:
+            log.debug(f"{pvc_path} not in restic snapshot catalog, asking restic")
+            command = f"snapshots --latest 1 --json --path {pvc_path}"
+            for tag in self.tags:
+                command += f" --tag {tag}"
+
+            with self.lock:
+                for found in loads(self.restic(command) or "[]"):
+                    self.add(pvc_path, found)
+                snapshot = self.latest.get(pvc_path, None)
+
+        if not snapshot:
+            raise Exception(f"No restic snapshots found for {pvc_path} in {self.repo}")
+
+        log.info(f"Latest restic snapshot for {pvc} is {snapshot['id']} "
+                 f"from {snapshot['time']}")
+        return snapshot['id']
+
+
+def get_restic_catalog(s3_endpoint: str,
+                       s3_bucket: str,
+                       access_key_id: str,
+                       secret_access_key: str,
+                       restic_repo_password: str,
+                       tags: list = []) -> ResticCatalog:
+    """
+    returns the shared ResticCatalog for a restic repo, and only snapshots with
+    all of the given tags, creating it if needed
+    """
+    catalog_key = (f"s3:{s3_endpoint}/{s3_bucket}", tuple(tags))
+    with CATALOGS_LOCK:
+        if catalog_key not in CATALOGS:
+            CATALOGS[catalog_key] = ResticCatalog(s3_endpoint,
+                                                  s3_bucket,
+                                                  access_key_id,
+                                                  secret_access_key,
+                                                  restic_repo_password,
+                                                  list(tags))
+        return CATALOGS[catalog_key]
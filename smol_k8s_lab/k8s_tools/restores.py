@@ -8,20 +8,98 @@ DESCRIPTION: restore stuff with k8up (restic on k8s) and cnpg operator
 from smol_k8s_lab.constants import XDG_CACHE_DIR
 from smol_k8s_lab.k8s_tools.argocd_util import ArgoCD
 from smol_k8s_lab.k8s_tools.k8s_lib import K8s
+from smol_k8s_lab.k8s_tools.k8up_progress import follow_k8up_job
 from smol_k8s_lab.k8s_tools.helm import Helm
+from smol_k8s_lab.k8s_tools.restic import get_restic_catalog
 from smol_k8s_lab.utils.run.subproc import subproc
 from smol_k8s_lab.utils.minio_lib import BetterMinio
+from smol_k8s_lab.utils.rich_cli.console_logging import CONSOLE
 
 # external libraries
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
-from json import loads
 import logging as log
-from minio.error import InvalidResponseError
-from os import path, environ
-from time import sleep
+from minio.error import InvalidResponseError, S3Error
+from os import path
+from rich.table import Table
+from time import monotonic, sleep
 import yaml
 
 
+def restore_step(func: Callable, *args, after: list = [], **kwargs) -> dict:
+    """
+    returns one step of a restore plan, which will run func(*args, **kwargs)
+    as soon as all the steps named in after are done
+    """
+    return {"func": func, "args": args, "kwargs": kwargs, "after": after}
+
+
+def run_restore_plan(name: str, plan: dict, max_workers: int = 8) -> dict:
+    """
+    runs a restore plan, a dict of {step_name: restore_step()}, running every
+    step whose dependencies are done at the same time, e.g. all the independent
+    pvc restores and the cnpg cluster restore. Steps named in after that aren't
+    in the plan (e.g. a disabled pvc) are skipped over.
+
+    Returns a dict of {step_name: seconds it took}
+    """
+    for step_name, step in plan.items():
+        for dependency in step['after']:
+            if dependency == step_name:
+                raise ValueError(f"restore step {step_name} can't come after itself")
+
+    timings = {}
+    pending = dict(plan)
+    running = {}
+    start = monotonic()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            # start every step that isn't waiting on anything anymore
+            for step_name, step in list(pending.items()):
+                waiting_on = [dependency for dependency in step['after']
+                              if dependency in plan and dependency not in timings]
+                if waiting_on:
+                    continue
+
+                log.info(f"Starting {name} restore step: {step_name}")
+                step_start = monotonic()
+                future = pool.submit(step['func'], *step['args'], **step['kwargs'])
+                running[future] = (step_name, step_start)
+                pending.pop(step_name)
+
+            if not running:
+                raise ValueError(f"{name} restore steps are waiting on each "
+                                 f"other: {', '.join(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step_name, step_start = running.pop(future)
+                # raises any exception from the step, which stops the restore
+                future.result()
+                timings[step_name] = monotonic() - step_start
+                log.info(f"Finished {name} restore step: {step_name} in "
+                         f"{timings[step_name]:.1f}s")
+
+    print_restore_timings(name, timings, monotonic() - start)
+    return timings
+
+
+def print_restore_timings(name: str, timings: dict, total: float) -> None:
+    """
+    prints a table of how long each step of a restore plan took
+    """
+    table = Table(title=f"♻️ {name} restore (seconds)")
+    table.add_column("step")
+    table.add_column("duration")
+
+    for step_name, seconds in timings.items():
+        table.add_row(step_name, f"{seconds:.1f}")
+    table.add_row("[b]total", f"[b]{total:.1f}")
+    CONSOLE.print(table)
+
+
 def restore_seaweedfs(argocd: ArgoCD,
                       app: str,
                       namespace: str,
@@ -48,33 +126,50 @@ def restore_seaweedfs(argocd: ArgoCD,
     pvc_appset = (
             f"https://raw.githubusercontent.com/small-hack/argocd-apps/{revision}/"
             f"{argocd_path}s3_pvc_appset.yaml")
-    argocd.k8s.apply_manifests(pvc_appset, argocd.namespace)
 
-    for swfs_pvc, snapshot_id in snapshots.items():
-        # build a k8up restore file and apply it
-        k8up_restore_pvc(argocd.k8s,
-                         app,
-                         swfs_pvc,
-                         namespace,
-                         s3_endpoint,
-                         s3_bucket,
-                         access_key_id,
-                         secret_access_key,
-                         restic_repo_password,
-                         snapshot_id,
-                         "s3-backups-podconfig")
-
-    # deploy the seaweedfs appset, which will use the restored PVCs above
+    # deploy the seaweedfs appset, which will use the restored PVCs
     seaweedfs_appset = (
             f"https://raw.githubusercontent.com/small-hack/argocd-apps/{revision}/"
             f"{argocd_path}s3_provider_argocd_appset.yaml")
-    argocd.k8s.apply_manifests(seaweedfs_appset, argocd.namespace)
+
+    plan = {"seaweedfs pvcs": restore_step(argocd.k8s.apply_manifests,
+                                           pvc_appset,
+                                           argocd.namespace)}
+
+    # restore both PVCs at the same time with k8up
+    for swfs_pvc, snapshot_id in snapshots.items():
+        plan[swfs_pvc] = restore_step(k8up_restore_pvc,
+                                      argocd.k8s,
+                                      app,
+                                      swfs_pvc,
+                                      namespace,
+                                      s3_endpoint,
+                                      s3_bucket,
+                                      access_key_id,
+                                      secret_access_key,
+                                      restic_repo_password,
+                                      snapshot_id,
+                                      "s3-backups-podconfig",
+                                      after=["seaweedfs pvcs"])
+
+    plan["seaweedfs appset"] = restore_step(argocd.k8s.apply_manifests,
+                                            seaweedfs_appset,
+                                            argocd.namespace,
+                                            after=list(snapshots))
 
     # and finally wait for the seaweedfs helm chart app to be ready
-    argocd.wait_for_app(f"{app}-seaweedfs", retry=True)
+    plan["seaweedfs app"] = restore_step(argocd.wait_for_app,
+                                         f"{app}-seaweedfs",
+                                         retry=True,
+                                         after=["seaweedfs appset"])
 
     # but then wait again on the pods, just in case...
-    argocd.k8s.wait(namespace, instance=f"{app}-seaweedfs")
+    plan["seaweedfs pods"] = restore_step(argocd.k8s.wait,
+                                          namespace,
+                                          instance=f"{app}-seaweedfs",
+                                          after=["seaweedfs app"])
+
+    return run_restore_plan(f"{app} seaweedfs", plan)
 
 
 def k8up_restore_pvc(k8s_obj: K8s,
@@ -87,9 +182,11 @@ def k8up_restore_pvc(k8s_obj: K8s,
                      secret_access_key: str,
                      restic_repo_password: str,
                      snapshot_id: str = "latest",
-                     pod_config: str = "backups-podconfig"):
+                     pod_config: str = "backups-podconfig",
+                     tags: list = []):
     """
-    builds a k8up restore manifest and applies it
+    builds a k8up restore manifest and applies it. If snapshot_id is latest,
+    restores the latest snapshot that has all of the given restic tags
     """
     # we timestamp this restore job just in case there's others around
     now = datetime.now().strftime('%Y-%m-%d-%H-%M')
@@ -140,28 +237,16 @@ def k8up_restore_pvc(k8s_obj: K8s,
                                                                s3_bucket,
                                                                access_key_id,
                                                                secret_access_key,
-                                                               restic_repo_password)
+                                                               restic_repo_password,
+                                                               tags)
 
     # apply the k8up restore job
     k8s_obj.apply_custom_resources([restore_dict])
 
-    # loop on check to make sure the restore is done before continuing
-    check_cmd = (f"kubectl get restore -n {namespace} --no-headers -o "
-                 f"custom-columns=COMPLETION:.status.finished {pvc}-{now}")
-    while True:
-        restore_done = subproc([check_cmd]).strip()
-        log.debug(f"restore done returns {restore_done}")
-
-        pod_cmd = (f"kubectl get pods -n {namespace} --no-headers -o "
-                   f"custom-columns=NAME:.metadata.name | grep {pvc}-{now}")
-        pod = subproc([pod_cmd], universal_newlines=True, shell=True)
-        subproc([f"kubectl logs -n {namespace} --tail=5 {pod}"], error_ok=True)
-
-        if restore_done != "true":
-            # sleep then try again
-            sleep(5)
-        else:
-            break
+    # follow the restore job's restic progress until it's done
+    restore_name = restore_dict['metadata']['name']
+    if not follow_k8up_job(k8s_obj, namespace, restore_name, f"♻️ restoring {pvc}"):
+        raise Exception(f"k8up restore {restore_name} of {pvc} failed")
 
 
 def get_latest_snapshot(pvc: str,
@@ -169,26 +254,20 @@ def get_latest_snapshot(pvc: str,
                         s3_bucket: str,
                         access_key_id: str,
                         secret_access_key: str,
-                        restic_repo_password: str) -> str:
+                        restic_repo_password: str,
+                        tags: list = []) -> str:
     """
-    gets the latest snapshot for a pvc via restic and returns the ID of it
+    gets the latest snapshot for a pvc, with all of the given tags, via restic
+    and returns the ID of it. The repo's snapshots are only read once and
+    shared by every pvc restore
     """
-    # set restic environment variables
-    env = {"PATH": environ.get("PATH"),
-           "HOME": environ.get("HOME"),
-           "RESTIC_REPOSITORY": f"s3:{s3_endpoint}/{s3_bucket}",
-           "RESTIC_PASSWORD_COMMAND": f"echo -n '{restic_repo_password}'",
-           "AWS_ACCESS_KEY_ID": access_key_id,
-           "AWS_SECRET_ACCESS_KEY": secret_access_key}
-
-    snapshots = loads(subproc(["restic snapshots --latest 1 --json"],
-                              env=env))
-
-    for snapshot in snapshots:
-        # makes sure this is the snapshot for the correct path
-        if pvc in snapshot["paths"][0]:
-            # gets the long ID of the latest snapshot for this path
-            return snapshot['id']
+    catalog = get_restic_catalog(s3_endpoint,
+                                 s3_bucket,
+                                 access_key_id,
+                                 secret_access_key,
+                                 restic_repo_password,
+                                 tags)
+    return catalog.get_latest_snapshot(pvc)
 
 
 def restore_cnpg_cluster(k8s_obj: K8s,
@@ -206,37 +285,31 @@ def restore_cnpg_cluster(k8s_obj: K8s,
     restore a CNPG operator controlled postgresql cluster
     """
     log.info(f"Beginning the restoration cnpg cluster, {cluster_name}.")
-    # need to first get the correct backup.info file and make sure s3 is up
+    # need to first get the newest completed backup and make sure s3 is up
     s3 = BetterMinio("", s3_endpoint, access_key_id, secret_access_key)
     base_folder = f"{s3_bucket}/base"
+    refresh = False
     while True:
         try:
-            s3_files = s3.list_object(s3_bucket, base_folder, recursive=True)
-            log.info(f"Found folder: {base_folder} in bucket: {s3_bucket}, continuing...")
-        except Exception as e:
+            # will be like: matrix-postgres/base/20240507T122317/backup.info
+            backup = s3.get_latest_backup(s3_bucket, s3_bucket, refresh)
+        except (InvalidResponseError, S3Error) as e:
             log.info(e)
             log.info("S3 not up yet, so couldn't find base folder: "
                      f"{base_folder} in bucket: {s3_bucket}")
+            backup = None
 
-        possible_files = []
-        try:
-            for backup_file in s3_files:
-                if "backup.info" in backup_file.object_name:
-                    # will be like: matrix-postgres/base/20240507T122317/backup.info
-                    possible_files.append(backup_file.object_name)
-        except InvalidResponseError:
-            log.info("We got a not found error... trying again in 10 seconds")
-            sleep(10)
-            continue
-        else:
+        if backup:
+            log.info(f"Found backups in {base_folder} in bucket: {s3_bucket}")
             break
 
-    backup_id = possible_files[-1].split('/')[2]
-    log.info(f"backup_id is {backup_id}")
+        log.info("No completed backups found yet... trying again in 10 seconds")
+        refresh = True
+        sleep(10)
 
-    # get the oldest object and save it to our cache dir for inspection later
-    save_path = path.join(XDG_CACHE_DIR, f'{app}_backup.info.env')
-    s3.get_object(s3_bucket, possible_files[-1], save_path)
+    backup_id = backup["backup_id"]
+    log.info(f"backup_id is {backup_id}")
+    log.debug(f"backup.info for {backup_id} is {backup['info']}")
 
     restore_dict = {
             "name": cluster_name,
@@ -487,7 +560,8 @@ def create_restic_restore_job(k8s_obj: K8s,
                   "restore",
                   f"{snapshot}:/data/{pvc}",
                   "--target",
-                  mount_path
+                  mount_path,
+                  "--json"
                 ],
                 "volumeMounts": [
                   {
@@ -545,21 +619,7 @@ def create_restic_restore_job(k8s_obj: K8s,
     # creates the restore job
     k8s_obj.apply_custom_resources([restore_job])
 
-    # wait for restore job to complete
-    wait_cmd = (f"kubectl wait job -n {namespace} --for=condition=complete "
-                f"{app}-restic-restore-{now} --timeout=15m")
-    pod_cmd = (f"kubectl get pods -n {namespace} --no-headers -o "
-               f"custom-columns=NAME:.metadata.name | grep {app}-restic-restore-{now}")
-    log.info(wait_cmd)
-    while True:
-        log.debug(f"Waiting for restore job: {app}-restic-restore-{now}")
-        res = subproc([wait_cmd], error_ok=True)
-        log.debug(res)
-
-        if "NotFound" in res:
-            sleep(1)
-        else:
-            # tail the logs out for the pod if we're done
-            pod = subproc([pod_cmd], universal_newlines=True, shell=True)
-            subproc([f"kubectl logs -n {namespace} --tail=5 {pod}"], error_ok=True)
-            break
+    # follow the restore job's restic progress until it's done
+    job_name = f"{app}-restic-restore-{now}"
+    if not follow_k8up_job(k8s_obj, namespace, job_name, f"♻️ restoring {pvc}"):
+        raise Exception(f"restic restore job {job_name} of {pvc} failed")
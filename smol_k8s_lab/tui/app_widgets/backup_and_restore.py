@@ -1,11 +1,14 @@
 from smol_k8s_lab.k8s_tools.backup import create_pvc_restic_backup
+from smol_k8s_lab.k8s_tools.backup_schedule import backup_timeline, plan_backup_schedules
+from smol_k8s_lab.tui.operations import Operation
+from smol_k8s_lab.tui.util import get_sensitive_value
 from smol_k8s_lab.utils.value_from import extract_secret
-from textual import on, work
+from textual import on
 from textual.app import ComposeResult
 from textual.containers import Horizontal, Grid, Container
 from textual.validation import Length
-from textual.widgets import Input, Label, Static, Switch, Collapsible, Button, LoadingIndicator
-from textual.worker import get_current_worker
+from textual.widgets import (Input, Label, Static, Switch, Collapsible, Button,
+                             LoadingIndicator, ProgressBar)
 
 
 class BackupWidget(Static):
@@ -38,6 +41,13 @@ class BackupWidget(Static):
         yield Label("📆 Scheduled backups", classes="header-row")
         yield Grid(id=f"{self.app_name}-backup-schedules-grid",
                    classes="backups-grid")
+        yield Collapsible(
+                Static(id=f"{self.app_name}-backup-timeline"),
+                id=f"{self.app_name}-backup-timeline-collapsible",
+                title="Staggered backup timeline",
+                classes="collapsible-with-some-room",
+                collapsed=True
+                )
 
         # third: add Collapsible with grid for remote s3 backup values
         yield Collapsible(
@@ -81,9 +91,17 @@ class BackupWidget(Static):
             loader.tooltip = "A backup is running. We'll notify you when it's completed."
             loader.display = False
             grid.mount(loader)
+            progress = ProgressBar(total=100,
+                                   show_eta=True,
+                                   id=f"{self.app_name}-backup-progress")
+            progress.tooltip = "restic's progress backing up the PVC(s)"
+            progress.display = False
+            grid.mount(progress)
 
         self.add_schedule_rows()
 
+        self.update_timeline()
+
         self.generate_s3_rows()
 
         repo_grid = self.get_widget_by_id(f"{self.app_name}-repo-password")
@@ -91,7 +109,9 @@ class BackupWidget(Static):
         repo_pw_labl = Label("restic repo password:", classes="argo-config-label")
         repo_pw_labl.tooltip = "restic repository password for encrypting your backups"
         input_id = f"{self.app_name}-restic-repository-password"
-        input_val = extract_secret(self.backup_params.get('restic_repo_password', ''))
+        input_val = (get_sensitive_value(self.screen, self.app_name,
+                                         "restic_repo_password") or
+                     extract_secret(self.backup_params.get('restic_repo_password', '')))
 
         repo_pw_input = Input(
                 placeholder="Enter a restic repo password for your encrypted backups",
@@ -154,6 +174,18 @@ class BackupWidget(Static):
                                     id=f"{self.app_name}-postgres-schedule",
                                     classes="argo-config-row"))
 
+    def update_timeline(self) -> None:
+        """
+        show when every app's backups would run, if we staggered the ones that
+        still use the default schedules
+        """
+        plan = plan_backup_schedules(self.app.cfg['apps'])
+        timeline = self.get_widget_by_id(f"{self.app_name}-backup-timeline")
+        if plan:
+            timeline.update(backup_timeline(plan, highlight=self.app_name))
+        else:
+            timeline.update("[dim]No apps with default backup schedules to stagger")
+
     def generate_s3_rows(self) -> None:
         """
         generate each row for the backup widget
@@ -171,7 +203,8 @@ class BackupWidget(Static):
                 sensitive = False
             else:
                 sensitive = True
-                input_val = extract_secret(value)
+                input_val = (get_sensitive_value(self.screen, self.app_name, key) or
+                             extract_secret(value))
 
             input = Input(placeholder=f"Enter a {key}",
                           value=input_val,
@@ -207,19 +240,18 @@ class BackupWidget(Static):
         """
         id = event.button.id
         if id == f"{self.app_name}-backup-button":
-            self.trigger_backup()
             event.button.display = False
             self.get_widget_by_id(f"{self.app_name}-backup-running").display = True
-            self.app.notify(
-                    "\nYour backup has been kicked off as a background job. "
-                    "We'll notify you when it's done 👍",
-                    title=f"💾 Backup of {self.app_name} started",
-                    timeout=10)
-
-    @work(thread=True, group="backup-worker")
-    def trigger_backup(self) -> None:
+            progress = self.get_widget_by_id(f"{self.app_name}-backup-progress")
+            progress.update(progress=0)
+            progress.display = True
+            self.app.operations.run(f"💾 backup of {self.app_name}",
+                                    self.run_backup,
+                                    self.finish_backup)
+
+    def run_backup(self, operation: Operation) -> str:
         """
-        run backup of an app in a thread so we don't lock up the UI
+        run backup of an app. This runs in a thread so we don't lock up the UI
         """
         # some apps, like home assistant need a special podConfig for k8up due
         # to needing tolerations/affinity specs
@@ -227,34 +259,57 @@ class BackupWidget(Static):
         # if "toleration" in self.screen.cfg[self.app_name]['argo']['path']:
         needs_pod_config = True
 
-        namespace = self.screen.cfg[self.app_name]['argo']['namespace']
+        app_cfg = self.screen.cfg[self.app_name]
+        namespace = app_cfg['argo']['namespace']
+        backups_cfg = app_cfg.get('backups', {})
 
-        self.log(
-                f"💾 kicking off backup for {self.app_name} in the {namespace}"
-                f" namespace to the bucket: {self.backup_s3_bucket} at the "
+        operation.output(
+                f"kicking off backup for {self.app_name} in the {namespace}"
+                f" namespace to the bucket: {self.backup_s3_bucket} at the"
                 f" endpoint: {self.backup_s3_endpoint}."
                 )
-        worker = get_current_worker()
-        if not worker.is_cancelled:
-            if self.cnpg_restore == "not_applicable":
-                cnpg_backup = False
-                cnpg_endpoint = ""
-            else:
-                cnpg_backup = self.cnpg_restore
-                cnpg_endpoint = self.screen.cfg[self.app_name]['argo']['secret_keys']['s3_endpoint']
-            create_pvc_restic_backup(app=self.app_name,
-                                     namespace=namespace,
-                                     endpoint=self.backup_s3_endpoint,
-                                     bucket=self.backup_s3_bucket,
-                                     cnpg_backup=cnpg_backup,
-                                     cnpg_s3_endpoint=cnpg_endpoint,
-                                     quiet=True,
-                                     needs_pod_config=needs_pod_config)
-            self.get_widget_by_id(f"{self.app_name}-backup-button").display = True
-            self.get_widget_by_id(f"{self.app_name}-backup-running").display = False
-            self.app.notify("\nSuccessfully backed up! 🎉",
-                            title=f"💾 backup of {self.app_name} completed",
-                            timeout=10)
+
+        if self.cnpg_restore == "not_applicable":
+            cnpg_backup = False
+            cnpg_endpoint = ""
+        else:
+            cnpg_backup = self.cnpg_restore
+            cnpg_endpoint = app_cfg['argo']['secret_keys']['s3_endpoint']
+        progress = self.get_widget_by_id(f"{self.app_name}-backup-progress")
+
+        # only log every 10% to the operations log, the progress bar gets the rest
+        logged = [-10]
+
+        def update_progress(status: dict) -> None:
+            self.app.call_from_thread(progress.update,
+                                      progress=status['percent'])
+            if status['percent'] - logged[0] >= 10:
+                logged[0] = status['percent']
+                operation.output(f"{status['percent']:.0f}% backed up")
+
+        create_pvc_restic_backup(app=self.app_name,
+                                 namespace=namespace,
+                                 endpoint=self.backup_s3_endpoint,
+                                 bucket=self.backup_s3_bucket,
+                                 cnpg_backup=cnpg_backup,
+                                 cnpg_s3_endpoint=cnpg_endpoint,
+                                 quiet=True,
+                                 needs_pod_config=needs_pod_config,
+                                 on_progress=update_progress,
+                                 snapshot_class=backups_cfg.get(
+                                     'volume_snapshot_class', ""),
+                                 bucket_notifications=backups_cfg.get(
+                                     'bucket_notifications', False))
+        return "Successfully backed up! 🎉"
+
+    def finish_backup(self, result: str = "", error: str = "") -> None:
+        """
+        show the backup button again. The operations service already let the
+        user know how the backup went
+        """
+        self.get_widget_by_id(f"{self.app_name}-backup-button").display = True
+        self.get_widget_by_id(f"{self.app_name}-backup-running").display = False
+        self.get_widget_by_id(f"{self.app_name}-backup-progress").display = False
 
 
 class RestoreApp(Static):
@@ -1,5 +1,6 @@
 # smol-k8s-lab libraries
-from smol_k8s_lab.tui.util import placeholder_grammar, create_sanitized_list
+from smol_k8s_lab.tui.util import (placeholder_grammar, create_sanitized_list,
+                                   get_sensitive_value)
 from smol_k8s_lab.utils.value_from import extract_secret
 
 # external libraries
@@ -106,7 +107,8 @@ class SmolK8sLabCollapsibleInputsWidget(Static):
             # otherwise this is a sensitive value, and we have to get it externally
             elif isinstance(value, dict):
                 input_keys['password'] = True
-                value = extract_secret(value)
+                value = (get_sensitive_value(self.screen, self.app_name, key) or
+                         extract_secret(value))
             # this is probably just a plain text string
             else:
                 input_keys['password'] = False
@@ -282,7 +284,8 @@ class SmolK8sLabInputsWidget(Static):
             # otherwise this is a sensitive value, and we have to get it externally
             elif isinstance(value, dict):
                 input_keys['password'] = True
-                value = extract_secret(value)
+                value = (get_sensitive_value(self.screen, self.app_name, key) or
+                         extract_secret(value))
 
         # add all the input_keys dictionary as args to Input widget
         input_keys['value'] = value
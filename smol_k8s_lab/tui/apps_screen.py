@@ -11,19 +11,24 @@ from smol_k8s_lab.tui.util import format_description
 from smol_k8s_lab.utils.run.subproc import subproc
 
 # external libraries
+from collections import OrderedDict
 from kubernetes.config import ConfigException
 from os import environ
 from textual import on, work
 from textual.app import ComposeResult
 from textual.binding import Binding
 from textual.containers import VerticalScroll, Container, Grid
-from textual.css.query import NoMatches
 from textual.screen import Screen
-from textual.widgets import Footer, Header, Label, SelectionList
+from textual.widgets import (Button, Footer, Header, Input, Label,
+                             SelectionList, Switch)
 from textual.widgets._toggle_button import ToggleButton
 from textual.widgets.selection_list import Selection
 
 
+# how many app config panes we keep mounted at once, the rest get rebuilt
+MAX_MOUNTED_APP_PANES = 8
+
+
 class AppsConfigScreen(Screen):
     """
     Textual screen to display smol-k8s-lab applications for configuring
@@ -84,6 +89,12 @@ class AppsConfigScreen(Screen):
         # this is state storage
         self.previous_app = ''
 
+        # {app: AppInputs} of mounted app panes, least recently used first
+        self.app_panes = OrderedDict()
+
+        # {app: [empty fields]} for every app we've validated since it changed
+        self.invalid_fields = {}
+
         # inital highlight if we got here via a link
         self.initial_app = highlighted_app
 
@@ -193,7 +204,8 @@ class AppsConfigScreen(Screen):
 
     def check_for_invalid_inputs(self, apps_dict: dict = {}) -> list:
         """
-        check each app for any empty init or secret key fields
+        check each app for any empty init or secret key fields. Only apps that
+        changed since we last checked them are checked again
         """
         invalid_apps = {}
 
@@ -202,51 +214,73 @@ class AppsConfigScreen(Screen):
                 if not metadata['enabled']:
                     continue
 
-                empty_fields = []
-
-                # check for empty init fields (some apps don't support init at all)
-                init_dict = metadata.get('init', None)
-                if init_dict:
-                    # make sure init is enabled before checking
-                    if init_dict['enabled']:
-                        # regular yaml inputs
-                        init_values = init_dict.get('values', None)
-                        if init_values:
-                            for key, value in init_values.items():
-                                if not value:
-                                    empty_fields.append(key)
-
-                        # sensitive inputs
-                        init_sensitive_values = init_dict.get('sensitive_values',
-                                                              None)
-                        if init_sensitive_values:
-
-                            prompts = self.check_for_env_vars(app, metadata)
-                            if prompts:
-                                skip = False
-
-                                # cert manager is special
-                                if app == "cert_manager":
-                                    solver = init_values['cluster_issuer_acme_challenge_solver']
-                                    if solver == "http01":
-                                        skip = True
-
-                                for value in prompts:
-                                    if not self.sensitive_values[app].get(value, ""):
-                                        if not skip:
-                                            empty_fields.append(value)
-
-                # check for empty secret key fields (some apps don't have secret keys)
-                secret_keys = metadata['argo'].get('secret_keys', None)
-                if secret_keys:
-                    for key, value in secret_keys.items():
+                if app not in self.invalid_fields:
+                    self.invalid_fields[app] = self.check_app_for_invalid_inputs(
+                            app, metadata
+                            )
+
+                if self.invalid_fields[app]:
+                    invalid_apps[app] = self.invalid_fields[app]
+
+        return invalid_apps
+
+    def check_app_for_invalid_inputs(self, app: str, metadata: dict) -> list:
+        """
+        check one app for any empty init or secret key fields
+        """
+        empty_fields = []
+
+        # check for empty init fields (some apps don't support init at all)
+        init_dict = metadata.get('init', None)
+        if init_dict:
+            # make sure init is enabled before checking
+            if init_dict['enabled']:
+                # regular yaml inputs
+                init_values = init_dict.get('values', None)
+                if init_values:
+                    for key, value in init_values.items():
                         if not value:
                             empty_fields.append(key)
 
-                if empty_fields:
-                    invalid_apps[app] = empty_fields
+                # sensitive inputs
+                init_sensitive_values = init_dict.get('sensitive_values', None)
+                if init_sensitive_values:
+
+                    prompts = self.check_for_env_vars(app, metadata)
+                    if prompts:
+                        skip = False
+
+                        # cert manager is special
+                        if app == "cert_manager":
+                            solver = init_values['cluster_issuer_acme_challenge_solver']
+                            if solver == "http01":
+                                skip = True
+
+                        for value in prompts:
+                            if not self.sensitive_values[app].get(value, ""):
+                                if not skip:
+                                    empty_fields.append(value)
+
+        # check for empty secret key fields (some apps don't have secret keys)
+        secret_keys = metadata['argo'].get('secret_keys', None)
+        if secret_keys:
+            for key, value in secret_keys.items():
+                if not value:
+                    empty_fields.append(key)
 
-        return invalid_apps
+        return empty_fields
+
+    @on(Input.Changed)
+    @on(Switch.Changed)
+    @on(Button.Pressed)
+    def app_config_changed(self, event) -> None:
+        """
+        anything changing in an app's pane means it needs to be validated again
+        """
+        for node in event.control.ancestors:
+            if isinstance(node, AppInputs):
+                self.invalid_fields.pop(node.app_name, None)
+                return
 
     def check_for_env_vars(self, app: str, app_cfg: dict = {}) -> list:
         """
@@ -364,20 +398,28 @@ class AppsConfigScreen(Screen):
         app_inputs_pane = self.get_widget_by_id("app-config-pane")
         app_inputs_pane.border_title = app_cfg_title
 
-        if self.previous_app != "":
-            app_input = self.get_widget_by_id(f"{self.previous_app}-app-widget")
-            app_input.display = False
+        if self.previous_app in self.app_panes:
+            self.app_panes[self.previous_app].display = False
 
-        try:
-            app_input = self.get_widget_by_id(f"{highlighted_app}-app-widget")
+        # app panes are only built the first time they're highlighted
+        app_input = self.app_panes.get(highlighted_app, None)
+        if app_input:
+            self.app_panes.move_to_end(highlighted_app)
             app_input.display = True
-        except NoMatches:
+        else:
             app_metadata = self.cfg[highlighted_app]
             app_input = AppInputs(highlighted_app, app_metadata,
                                   id=f"{highlighted_app}-app-widget")
+            self.app_panes[highlighted_app] = app_input
 
             self.get_widget_by_id("app-config-pane").mount(app_input)
 
+            # unmount the least recently used panes. Their values are all in
+            # the config (or sensitive_values), so they can be rebuilt later
+            while len(self.app_panes) > MAX_MOUNTED_APP_PANES:
+                _, old_app_input = self.app_panes.popitem(last=False)
+                old_app_input.remove()
+
         # select-apps styling - bottom
         app_desc = self.get_widget_by_id("app-notes-container")
         app_desc.border_title = f"📓 {app_title} [i]notes[/i]"
@@ -403,33 +445,21 @@ class AppsConfigScreen(Screen):
 
     def action_sync_argocd_app(self) -> None:
         """
-        syncs an existing Argo CD application
+        syncs an existing Argo CD application in the background
         """
         app = self.previous_app.replace("_","-")
 
         # sync the app
         self.log(f"♻️ Syncing {app} via the TUI...")
-        res = self.argocd.sync_app(app, spinner=False)
-
-        if res:
-            severity = "information"
-            if isinstance(res, list):
-                response = "\n".join(res)
-            else:
-                response = res
-        else:
-            response = "No response recieved from Argo CD sync app... 🤔"
-            severity = "warning"
-
-        # if result is not valid, notify the user why
-        self.notify(response,
-                    timeout=10,
-                    severity=severity,
-                    title=f"🦑 Argo CD Sync [#87ff89]{self.previous_app}[/] Response\n")
+        self.app.operations.run(
+                f"🦑 Argo CD sync {app}",
+                lambda operation: self.argocd.sync_app(
+                    app, spinner=False, on_output=operation.output)
+                )
 
     def action_delete_argocd_app(self) -> None:
         """
-        deletes an existing Argo CD application
+        deletes an existing Argo CD application in the background
         """
 
         def delete_app(modal_res = tuple):
@@ -442,26 +472,15 @@ class AppsConfigScreen(Screen):
                 return
             else:
                 app = self.previous_app.replace("_","-")
-                # sync the app
                 self.log(f"🗑️  Deleting {app} via the TUI...")
-                res = self.argocd.delete_app(app,
-                                             spinner=False,
-                                             force=modal_res[1])
-                if res:
-                    severity = "information"
-                    if isinstance(res, list):
-                        response = "\n".join(res)
-                    else:
-                        response = res
-                else:
-                    response = "No response recieved from Argo CD delete app... 🤔"
-                    severity = "warning"
-
-                # if result is not valid, notify the user why
-                self.notify(response,
-                            timeout=10,
-                            severity=severity,
-                            title=f"🦑 Argo CD Delete {self.previous_app} Response\n")
+                self.app.operations.run(
+                        f"🦑 Argo CD delete {app}",
+                        lambda operation: self.argocd.delete_app(
+                            app,
+                            spinner=False,
+                            force=modal_res[1],
+                            on_output=operation.output)
+                        )
 
         self.app.push_screen(DeleteAppModalScreen(self.previous_app),
                              delete_app)
@@ -1,27 +1,26 @@
 # smol-k8s-lab libraries
+# NOTE: every other screen, and the k8s libraries, are imported only once
+# they're needed, so that the start screen can be drawn as soon as possible
 from smol_k8s_lab.constants import INITIAL_USR_CONFIG, XDG_CONFIG_FILE, VERSION
-from smol_k8s_lab.k8s_distros import check_all_contexts
-from smol_k8s_lab.tui.apps_screen import AppsConfigScreen
 from smol_k8s_lab.tui.base_widgets.audio_widget import SmolAudio
-from smol_k8s_lab.tui.base_widgets.cluster_modal import ClusterModalScreen
 from smol_k8s_lab.tui.base_widgets.new_cluster_input import NewClusterInput
-from smol_k8s_lab.tui.confirm_screen import ConfirmConfig
-from smol_k8s_lab.tui.distro_screen import DistroConfigScreen
-from smol_k8s_lab.tui.distro_widgets.add_nodes import NodesConfigScreen
-from smol_k8s_lab.tui.help_screen import HelpScreen
-from smol_k8s_lab.tui.smol_k8s_config_screen import SmolK8sLabConfig
-from smol_k8s_lab.tui.tui_config_screen import TuiConfigScreen
+from smol_k8s_lab.tui.config_writer import ConfigWriter
+from smol_k8s_lab.tui.operations import (Operations, OperationsScreen,
+                                         TextualRenderer)
+from smol_k8s_lab.utils.events import EVENTS
 
 # external libraries
 from pyfiglet import Figlet
 from rich.text import Text
 from ruamel.yaml import YAML
-from textual import on
+from textual import on, work
 from textual.app import App, ComposeResult
+from textual.css.query import NoMatches
 from textual.events import DescendantFocus
 from textual.binding import Binding
 from textual.containers import Grid
 from textual.widgets import Footer, DataTable, Label
+from textual.widgets.data_table import CellDoesNotExist
 
 
 class BaseApp(App):
@@ -51,7 +50,12 @@ class BaseApp(App):
                     key_display="n",
                     description=" New Cluster",
                     action="app.new_cluster",
-                    show=True)
+                    show=True),
+            Binding(key="o",
+                    key_display="o",
+                    description=" Operations",
+                    action="app.request_operations",
+                    show=False)
             ]
 
     CSS_PATH = ["./css/base.tcss", "./css/help.tcss"]
@@ -66,6 +70,12 @@ class BaseApp(App):
         self.bell_on_error = accessibility['bell']['on_error']
         self.speak_on_focus = accessibility['text_to_speech']['on_focus']
 
+        # long running things like syncs and backups run here in the background
+        self.operations = Operations(self)
+
+        # saves config changes at most every half second, instead of every keystroke
+        self.config_writer = ConfigWriter(self, XDG_CONFIG_FILE)
+
         super().__init__()
 
     def compose(self) -> ComposeResult:
@@ -79,8 +89,8 @@ class BaseApp(App):
             footer.display = False
         yield footer
 
-        # full screen container
-        with Grid(id="base-screen-container"):
+        # full screen container, without a cluster table until we find one
+        with Grid(id="base-screen-container", classes="no-cluster-table"):
             yield Label(Figlet(font="standard").renderText("smol-k8s-lab"),
                         id="smol-k8s-lab-header")
 
@@ -106,14 +116,22 @@ class BaseApp(App):
         title = "[#ffaff9]Create[/] a [i]new[/] [#C1FF87]cluster[/] with the name below"
         self.get_widget_by_id("base-new-cluster-input-box-grid").border_title = title
 
-        # get all clusters
-        clusters = check_all_contexts()
+        # show progress events from background operations in their output
+        self.events_renderer = TextualRenderer(self.operations)
+        EVENTS.subscribe(self.events_renderer)
 
-        if clusters:
-            self.generate_cluster_table(clusters)
+        # the cluster table is filled in after the first frame is drawn
+        self.check_clusters()
+
+    def show_clusters(self, cluster_rows: list) -> None:
+        """
+        show the cluster table, if there's any clusters, and then say the screen
+        title, which is different if there's a cluster table
+        """
+        if cluster_rows:
+            self.generate_cluster_table(cluster_rows)
             self.call_after_refresh(self.play_screen_audio, screen="base", alt=True)
         else:
-            self.get_widget_by_id("base-screen-container").add_class("no-cluster-table")
             self.call_after_refresh(self.play_screen_audio, screen="base")
 
     def generate_cluster_table(self, clusters: list) -> None:
@@ -128,10 +146,10 @@ class BaseApp(App):
                                cursor_type="row")
 
         # then fill in the cluster table
-        data_table.add_column(Text("Cluster", justify="center"))
-        data_table.add_column(Text("Distro", justify="center"))
-        data_table.add_column(Text("Version", justify="center"))
-        data_table.add_column(Text("Platform", justify="center"))
+        data_table.add_column(Text("Cluster", justify="center"), key="cluster")
+        data_table.add_column(Text("Distro", justify="center"), key="distro")
+        data_table.add_column(Text("Version", justify="center"), key="version")
+        data_table.add_column(Text("Platform", justify="center"), key="platform")
 
         for row in clusters:
             # we use an extra line to center the rows vertically
@@ -154,9 +172,52 @@ class BaseApp(App):
                                   "delete[/] an [i]existing[/] [#C1FF87]cluster[/]")
 
         cluster_container = self.get_widget_by_id("cluster-boxes")
-        self.get_widget_by_id("base-screen-container").add_class("with-cluster-table")
+        screen = self.get_widget_by_id("base-screen-container")
+        screen.remove_class("no-cluster-table")
+        screen.add_class("with-cluster-table")
         cluster_container.mount(main_grid, before="#base-new-cluster-input-box-grid")
 
+    @work(thread=True, group="check-clusters-workers")
+    def check_clusters(self) -> None:
+        """
+        gets all clusters straight from the kubeconfig, so we can show them
+        right away, and then asks every cluster for its version at the same
+        time, updating each row of the cluster table as soon as it answers
+        """
+        from smol_k8s_lab.k8s_distros import (check_all_contexts,
+                                              get_kube_contexts,
+                                              guess_distro)
+
+        cluster_names = get_kube_contexts()
+        self.call_from_thread(
+                self.show_clusters,
+                [(name, guess_distro(name), "checking...", "checking...")
+                 for name in cluster_names]
+                )
+        if not cluster_names:
+            return
+
+        def update_row(context_tuple: tuple) -> None:
+            self.call_from_thread(self.update_cluster_row, context_tuple)
+
+        check_all_contexts(on_result=update_row)
+
+    def update_cluster_row(self, context_tuple: tuple) -> None:
+        """
+        update a cluster's distro, version, and platform in the cluster table
+        """
+        cluster_name = context_tuple[0]
+        try:
+            data_table = self.get_widget_by_id("clusters-data-table")
+            for column, cell in zip(["distro", "version", "platform"],
+                                    context_tuple[1:]):
+                data_table.update_cell(cluster_name,
+                                       column,
+                                       Text(str("\n" + cell), justify="center"))
+        # the cluster may have been deleted while we were checking on it
+        except (NoMatches, CellDoesNotExist):
+            return
+
     @on(DataTable.RowSelected)
     def cluster_row_selected(self, event: DataTable.RowSelected) -> None:
         """
@@ -195,6 +256,7 @@ class BaseApp(App):
             self.current_cluster = cluster_name
 
             # launch modal UI to ask if they'd like to modify or delete a cluster
+            from smol_k8s_lab.tui.base_widgets.cluster_modal import ClusterModalScreen
             self.app.push_screen(ClusterModalScreen(cluster_name,
                                                     distro,
                                                     event.row_key),
@@ -223,6 +285,7 @@ class BaseApp(App):
         """
         launches the argo app config screen
         """
+        from smol_k8s_lab.tui.apps_screen import AppsConfigScreen
         self.app.push_screen(AppsConfigScreen(self.cfg['apps'],
                                               app_to_highlight,
                                               modify_cluster))
@@ -233,6 +296,7 @@ class BaseApp(App):
         """
         launches the argo app config screen
         """
+        from smol_k8s_lab.tui.distro_widgets.add_nodes import NodesConfigScreen
         nodes = self.cfg['k8s_distros'][distro]['nodes']
         self.app.push_screen(NodesConfigScreen(nodes,
                                                modify_cluster))
@@ -241,6 +305,7 @@ class BaseApp(App):
         """
         launches the k8s distro (k3s,k3d,kind) config screen
         """
+        from smol_k8s_lab.tui.distro_screen import DistroConfigScreen
         self.app.push_screen(DistroConfigScreen(self.cfg['k8s_distros']))
 
     def action_request_smol_k8s_cfg(self) -> None:
@@ -248,24 +313,35 @@ class BaseApp(App):
         launches the smol-k8s-lab config for the program itself for things like
         the TUI, but also logging and password management
         """
+        from smol_k8s_lab.tui.smol_k8s_config_screen import SmolK8sLabConfig
         self.app.push_screen(SmolK8sLabConfig(self.cfg['smol_k8s_lab']))
 
     def action_request_confirm(self) -> None:
         """
         show confirmation screen
         """
+        from smol_k8s_lab.tui.confirm_screen import ConfirmConfig
         self.app.push_screen(ConfirmConfig(self.cfg))
 
     def action_request_help(self,) -> None:
         """
         if the user presses 'h' or '?', show the help modal screen
         """
+        from smol_k8s_lab.tui.help_screen import HelpScreen
         self.push_screen(HelpScreen())
 
+    def action_request_operations(self) -> None:
+        """
+        if the user pressed 'o', show the background operations screen
+        """
+        if not isinstance(self.screen, OperationsScreen):
+            self.push_screen(OperationsScreen())
+
     def action_request_config(self,) -> None:
         """
         if the user pressed 'c', show the TUI config screen
         """
+        from smol_k8s_lab.tui.tui_config_screen import TuiConfigScreen
         self.push_screen(TuiConfigScreen(self.cfg['smol_k8s_lab']['tui']))
 
     def action_toggle_footer(self) -> None:
@@ -288,12 +364,36 @@ class BaseApp(App):
 
     def write_yaml(self, config_file: str = XDG_CONFIG_FILE) -> None:
         """
-        dump current self.cfg to user's smol-k8s-lab config.yaml
+        save current self.cfg to user's smol-k8s-lab config.yaml. Writes to the
+        default config file are debounced, see ConfigWriter
         """
-        yaml = YAML()
-
-        with open(config_file, 'w') as smol_k8s_config:
-            yaml.dump(self.cfg, smol_k8s_config)
+        if config_file == self.config_writer.config_file:
+            self.config_writer.mark_dirty()
+        else:
+            with open(config_file, 'w') as smol_k8s_config:
+                YAML().dump(self.cfg, smol_k8s_config)
+
+    def push_screen(self, *args, **kwargs):
+        # always save pending config changes before changing screens
+        self.config_writer.flush()
+        return super().push_screen(*args, **kwargs)
+
+    def pop_screen(self):
+        self.config_writer.flush()
+        return super().pop_screen()
+
+    def switch_screen(self, *args, **kwargs):
+        self.config_writer.flush()
+        return super().switch_screen(*args, **kwargs)
+
+    def exit(self, *args, **kwargs) -> None:
+        # and always save pending config changes before we exit
+        self.config_writer.flush()
+        super().exit(*args, **kwargs)
+
+    def on_unmount(self) -> None:
+        # stop sending progress events to the TUI once it's gone
+        EVENTS.unsubscribe(self.events_renderer)
 
     def play_screen_audio(self,
                           screen: str,
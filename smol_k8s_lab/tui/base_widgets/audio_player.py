@@ -0,0 +1,229 @@
+#!/usr/bin/env python3.11
+"""
+Says things for the TUI, one at a time, from a single playback queue in a
+background thread, so the TUI never waits on audio. Pre-generated speech clips
+are played with pygame, with a small cache of decoded clips so we don't
+re-decode the same mp3 from disk every time it's said, and text is said with
+the user's own speech program.
+"""
+from collections import OrderedDict, deque
+from os import listdir, path
+from shlex import split
+from subprocess import DEVNULL, Popen
+from threading import Condition, Lock, Thread
+import logging as log
+
+
+class SoundCache():
+    """
+    LRU cache of decoded pygame Sounds, keyed by audio file path
+    """
+    def __init__(self, fallback_file: str, max_size: int = 96) -> None:
+        self.fallback_file = fallback_file
+        self.max_size = max_size
+        self.sounds = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, audio_file: str):
+        """
+        returns the decoded pygame Sound for audio_file, or the fallback "um"
+        if the file doesn't exist
+        """
+        from pygame import mixer, error
+
+        with self.lock:
+            if audio_file in self.sounds:
+                self.sounds.move_to_end(audio_file)
+                return self.sounds[audio_file]
+
+        try:
+            sound = mixer.Sound(audio_file)
+        except (FileNotFoundError, error):
+            log.debug(f"audio file not found :( audio file is '{audio_file}'")
+            if audio_file == self.fallback_file:
+                raise
+            return self.get(self.fallback_file)
+
+        with self.lock:
+            self.sounds[audio_file] = sound
+            self.sounds.move_to_end(audio_file)
+            while len(self.sounds) > self.max_size:
+                self.sounds.popitem(last=False)
+        return sound
+
+    def preload(self, audio_files: list) -> None:
+        """
+        decode audio files ahead of time, skipping any that don't exist
+        """
+        for audio_file in audio_files[:self.max_size]:
+            if path.exists(audio_file):
+                self.get(audio_file)
+
+
+class PlaybackQueue():
+    """
+    A single playback queue of (kind, item) pairs, said in order by a
+    background thread. Queueing items of a kind drops any pending items of the
+    same kind, and cuts off the item that's being said if it's that kind too,
+    so that only the latest screen description or focused element is ever said.
+    """
+    def __init__(self) -> None:
+        self.items = deque()
+        self.condition = Condition()
+        # which kind of item is being said, and bumped every time it's cut off
+        self.playing_kind = ""
+        self.generation = 0
+        # set if setup() fails, so that we stop queueing things
+        self.disabled = False
+
+        Thread(target=self.run, name="smol-audio-player", daemon=True).start()
+
+    def play(self, items: list, kind: str = "") -> None:
+        """
+        queue items to be said after everything else that's queued, replacing
+        anything of the same kind that hasn't been said yet
+        """
+        with self.condition:
+            if self.disabled:
+                return
+            if kind:
+                self.items = deque(item for item in self.items
+                                   if item[0] != kind)
+                if self.playing_kind == kind:
+                    self.generation += 1
+                    self.cut_off()
+
+            self.items.extend((kind, item) for item in items)
+            self.condition.notify()
+
+    def stop(self) -> None:
+        """
+        stop saying anything and drop everything that's queued
+        """
+        with self.condition:
+            self.items.clear()
+            self.generation += 1
+            self.cut_off()
+            self.condition.notify()
+
+    def run(self) -> None:
+        """
+        say items from the queue until the app exits, sleeping until there's
+        something to say
+        """
+        if not self.setup():
+            with self.condition:
+                self.disabled = True
+                self.items.clear()
+            return
+
+        while True:
+            with self.condition:
+                while not self.items:
+                    self.playing_kind = ""
+                    self.condition.wait()
+                kind, item = self.items.popleft()
+                self.playing_kind = kind
+                generation = self.generation
+
+            try:
+                self.say_item(item, generation)
+            except Exception as e:
+                log.debug(f"couldn't say {item}: {e}")
+
+    def setup(self) -> bool:
+        """
+        runs in the player's thread before anything is said, so slow setup
+        never holds up the TUI. Returns False if we can't say anything
+        """
+        return True
+
+    def say_item(self, item: str, generation: int) -> None:
+        """
+        say one item, returning once it's done or cut off. Each kind of
+        player says things its own way
+        """
+
+    def cut_off(self) -> None:
+        """
+        stop saying the current item. Called with self.condition held
+        """
+
+
+class AudioPlayer(PlaybackQueue):
+    """
+    plays audio files with pygame
+    """
+    def __init__(self, sound_cache: SoundCache, preload: list = []) -> None:
+        self.cache = sound_cache
+        self.preload = preload
+        self.channel = None
+        super().__init__()
+
+    def setup(self) -> bool:
+        # pygame is slow to import and initialize, so we only do it in here
+        from pygame import mixer, error
+        try:
+            mixer.init()
+        except error:
+            log.info("No audio device found")
+            return False
+
+        self.channel = mixer.Channel(0)
+        # decode the clips we say most often in the background
+        Thread(target=self.cache.preload,
+               args=(self.preload,),
+               daemon=True).start()
+        return True
+
+    def say_item(self, audio_file: str, generation: int) -> None:
+        sound = self.cache.get(audio_file)
+
+        with self.condition:
+            if generation != self.generation:
+                return
+            self.channel.play(sound)
+            # wake up when the clip is over, or as soon as it's cut off
+            self.condition.wait_for(lambda: self.generation != generation,
+                                    timeout=sound.get_length())
+
+    def cut_off(self) -> None:
+        if self.channel:
+            self.channel.stop()
+
+
+class SpeechPlayer(PlaybackQueue):
+    """
+    says text with an external speech program, like say or espeak. The text
+    is passed as an argument, never through a shell
+    """
+    def __init__(self, speech_program: str) -> None:
+        self.command = split(speech_program)
+        self.process: Popen = None
+        super().__init__()
+
+    def say_item(self, text: str, generation: int) -> None:
+        with self.condition:
+            if generation != self.generation:
+                return
+            process = Popen(self.command + [text],
+                            stdout=DEVNULL,
+                            stderr=DEVNULL)
+            self.process = process
+        # cut_off() terminates the process, so this returns right away
+        process.wait()
+
+    def cut_off(self) -> None:
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+
+
+def list_audio_files(directory: str) -> list:
+    """
+    returns the full path to every mp3 in a directory, if it exists
+    """
+    if not path.isdir(directory):
+        return []
+    return [path.join(directory, audio_file)
+            for audio_file in sorted(listdir(directory))
+            if audio_file.endswith(".mp3")]
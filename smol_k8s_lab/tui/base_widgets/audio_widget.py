@@ -1,17 +1,28 @@
 # smol-k8s-lab libraries
 from smol_k8s_lab.constants import SPEECH_TEXT, SPEECH_MP3_DIR, load_yaml
 
+from smol_k8s_lab.tui.base_widgets.audio_player import (AudioPlayer,
+                                                        SoundCache,
+                                                        SpeechPlayer,
+                                                        list_audio_files)
+
 # external libraries
-from os import system, path
+from contextlib import contextmanager
+from functools import cached_property
+from os import path
 from textual import work
 from textual.app import Widget
 from textual.containers import VerticalScroll
 from textual.events import DescendantFocus
 from textual.widgets import (Button, DataTable, Input, Switch, Select,
                              SelectionList, _collapsible)
-from textual.worker import Worker
-from pygame import mixer, error
-import logging as log
+from textual.worker import Worker, NoActiveWorker, get_current_worker
+from threading import local
+
+# phrases said for nearly every element, so we decode them on startup
+PRELOAD_PHRASES = ["element", "element_collapsible", "element_tab", "input",
+                   "button", "switch", "switch_on", "switch_off", "drop_down",
+                   "value", "row", "highlighted", "um"]
 
 class SmolAudio(Widget):
     """
@@ -38,69 +49,110 @@ class SmolAudio(Widget):
 
         # core audio files
         self.tts_files = path.join(SPEECH_MP3_DIR, f"{tts['language']}")
-        self.tts_texts = load_yaml(path.join(SPEECH_TEXT,
-                                             f"{tts['language']}.yml"))
+        self.tts_texts_file = path.join(SPEECH_TEXT, f"{tts['language']}.yml")
         self.screen_audio = path.join(self.tts_files, 'screens')
         self.apps_audio = path.join(self.tts_files, 'apps')
         self.cluster_audio = path.join(self.tts_files, 'cluster_names')
         self.k3s_audio = path.join(self.cluster_audio, 'k3s.mp3')
         self.element_audio = path.join(self.tts_files, 'phrases/element.mp3')
 
-        # only initialize the mixer if audio is requested for something
-        if self.speak_on_focus or self.speak_screen_titles \
-                or self.speak_on_key_press or self.speak_screen_desc:
-            self.core_mixer = mixer
-            try:
-                self.core_mixer.init()
-            except error:
-                log.info("No audio device found")
+        # clips said by the current thread's utterance, see self.utterance()
+        self.local = local()
+
+        # only set up audio if it's requested for something. The player
+        # initializes the mixer in its own thread, so we don't wait on it
+        self.player = None
+        if not (self.speak_on_focus or self.speak_screen_titles
+                or self.speak_on_key_press or self.speak_screen_desc):
+            pass
+        elif self.speech_program:
+            self.player = SpeechPlayer(self.speech_program)
+        else:
+            preload = [path.join(self.tts_files, f'phrases/{phrase}.mp3')
+                       for phrase in PRELOAD_PHRASES]
+            preload.extend(list_audio_files(self.screen_audio))
+            self.player = AudioPlayer(
+                    SoundCache(path.join(self.tts_files, 'phrases/um.mp3')),
+                    preload
+                    )
 
         super().__init__()
 
+    @cached_property
+    def tts_texts(self) -> dict:
+        """
+        the text for every screen, only loaded if a speech program needs it
+        """
+        return load_yaml(self.tts_texts_file)
+
     def on_mount(self) -> None:
         self.log("SmolAudio widget has been mounted")
 
-    @work(group="pygame-play-workers")
-    async def pyg_play(self, audio_file: str):
+    def queue(self, audio_file_or_text: str, kind: str = "") -> None:
+        """
+        queue an audio file to be played with pygame, or text to be said by the
+        speech program. If we're in the middle of an utterance, it's said as
+        part of that instead
+        """
+        clips = getattr(self.local, 'clips', None)
+        if clips is not None:
+            clips.append(audio_file_or_text)
+        elif self.player:
+            self.player.play([audio_file_or_text], kind)
+
+    @contextmanager
+    def utterance(self, kind: str):
         """
-        play audio file with pygame
+        collect every audio file or text said in this block, and then queue
+        them all at once, replacing anything of the same kind that's still
+        queued. If we're in a worker that's been cancelled, because something
+        newer needs saying, nothing is said at all
         """
+        # if we're already in an utterance, this is just part of it
+        if getattr(self.local, 'clips', None) is not None:
+            yield
+            return
+
+        self.local.clips = []
         try:
-            audio = self.core_mixer.Sound(audio_file)
-        except FileNotFoundError:
-            self.log(f"audio file not found :( audio file is '{audio_file}'")
-            audio = self.core_mixer.Sound(path.join(self.tts_files, 'phrases/um.mp3'))
+            yield
+            clips = self.local.clips
+        finally:
+            self.local.clips = None
 
-        while True:
-            if not self.core_mixer.get_busy():
-                break
-        audio.play()
+        try:
+            if get_current_worker().is_cancelled:
+                self.log(f"dropping stale {kind} audio")
+                return
+        except NoActiveWorker:
+            pass
+
+        if self.player and clips:
+            self.player.play(clips, kind)
 
     def say(self, text: str = "", audio_file: str = "") -> None:
         """
         Use the configured speech program to read a string aloud.
         """
-        say = self.speech_program
-        if say:
+        if self.speech_program:
             if text:
-                text_for_speech = text.replace("(", "").replace(")", "")
-                tts = text_for_speech.replace("[i]", "").replace("[/]", "")
-                system(f"{say} {tts}")
-
-            elif not text:
-                # if the use pressed f5, the key to read the widget ID aloud
-                if self.speak_on_key_press:
-                    focused = self.app.focused
+                # the text is passed straight to the program, not to a shell
+                self.queue(text.replace("[i]", "").replace("[/]", ""))
+
+            # if the use pressed f5, the key to read the widget ID aloud
+            elif self.speak_on_key_press:
+                focused = self.app.focused
+                with self.utterance("element"):
                     if isinstance(focused, _collapsible.CollapsibleTitle):
-                        system(f"{say} element is a Collapsible called {focused.label}.")
+                        self.queue(f"element is a Collapsible called {focused.label}.")
                     else:
-                        system(f"{say} element is {focused.id}")
+                        self.queue(f"element is {focused.id}")
 
-                    # if it's a data table, read out the row content
-                    if isinstance(focused, DataTable):
-                        self.say_row(focused)
+                # if it's a data table, read out the row content
+                if isinstance(focused, DataTable):
+                    self.say_row(focused)
         else:
-            self.pyg_play(audio_file)
+            self.queue(audio_file)
 
     def play_screen_audio(self,
                           screen: str,
@@ -116,24 +168,23 @@ class SmolAudio(Widget):
             title = "alt_title"
             desc = "alt_description"
 
-        if self.speak_screen_titles and say_title:
-            if not self.speech_program:
-                audio_file = path.join(self.screen_audio,
-                                       f'{screen}_{title}.mp3')
-                self.say(audio_file=audio_file)
-            else:
-                self.say(text=self.tts_texts['screens'][f'{screen}'][title])
-
-        if self.speak_screen_desc and say_desc:
-            if not self.speech_program:
-                number_of_workers = len(self.workers)
-                while number_of_workers > 1:
-                    self.log(f"play screen audio number of workers is {number_of_workers}")
-                audio_file = path.join(self.screen_audio,
-                                       f'{screen}_{desc}.mp3')
-                self.say(audio_file=audio_file)
-            else:
-                self.say(text=self.tts_texts['screens'][f'{screen}'][desc])
+        # a new screen's title and description replace the last screen's
+        with self.utterance("screen"):
+            if self.speak_screen_titles and say_title:
+                if not self.speech_program:
+                    audio_file = path.join(self.screen_audio,
+                                           f'{screen}_{title}.mp3')
+                    self.say(audio_file=audio_file)
+                else:
+                    self.say(text=self.tts_texts['screens'][f'{screen}'][title])
+
+            if self.speak_screen_desc and say_desc:
+                if not self.speech_program:
+                    audio_file = path.join(self.screen_audio,
+                                           f'{screen}_{desc}.mp3')
+                    self.say(audio_file=audio_file)
+                else:
+                    self.say(text=self.tts_texts['screens'][f'{screen}'][desc])
 
 
     def on_worker_state_changed(self, event: Worker.StateChanged) -> None:
@@ -450,11 +501,18 @@ class SmolAudio(Widget):
 
         self.say_phrase('input.mp3')
 
-    @work(exclusive=True, thread=True)
+    @work(exclusive=True, thread=True, group="speech-workers")
     def speak_element(self):
         """
         speak the currently focused element ID, if the user pressed f5
         """
+        with self.utterance("element"):
+            self.say_focused_element()
+
+    def say_focused_element(self):
+        """
+        say the currently focused element ID, and its value if it has one
+        """
         focused = self.app.focused
         self.log("😘🐶🐶🐶🐶🐶🐶🐶🐶🐶🐶🐶🐶🐶")
         self.log(focused)
@@ -577,20 +635,43 @@ class SmolAudio(Widget):
                 # say name of app
                 self.say(audio_file=path.join(self.apps_audio, f'{highlighted_app}.mp3'))
 
-            # if this is a datatable, just call self.say_row
+            # if this is a datatable, just call self.say_row_content
             elif isinstance(focused, DataTable):
                 self.say_phrase(f'{focused_id}.mp3')
-                self.say_row(focused)
+                self.say_row_content(focused)
 
             # if not any special element then play the id of the element
             else:
                 self.say_phrase(f'{focused_id}.mp3')
 
-    @work(exclusive=True, thread=True)
+    @work(exclusive=True, thread=True, group="speech-workers")
     def say_row(self, data_table: DataTable) -> None:
         """
         get the column names and row content of a DataTable and read aloud
         """
+        with self.utterance("row"):
+            self.say_row_content(data_table)
+
+    def say_row_text(self, data_table: DataTable) -> None:
+        """
+        say each column name and value of a DataTable's row with the speech
+        program
+        """
+        row = data_table.get_row_at(data_table.cursor_row)
+        columns = list(data_table.columns.values())
+        for column, cell in zip(columns, row):
+            value = cell.plain.strip() if hasattr(cell, 'plain') else str(cell)
+            self.say(text=f"{column.label.plain} is {value}")
+
+    def say_row_content(self, data_table: DataTable) -> None:
+        """
+        say the column names and row content of a DataTable
+        """
+        # the speech program can just read out every column and value
+        if self.speech_program:
+            self.say_row_text(data_table)
+            return
+
         row_index = data_table.cursor_row
         row = data_table.get_row_at(row_index)
 
@@ -603,8 +684,6 @@ class SmolAudio(Widget):
 
         # get the column names
         columns = list(data_table.columns.values())
-        column1 = columns[0].label
-        column2 = columns[1].label
 
         # TODO: make node name, node labels, and node taints more capable
         # right now just says um i don't know that word
@@ -723,52 +802,44 @@ class SmolAudio(Widget):
         elif data_table.id == "clusters-data-table":
             row_column3 = row[2].plain.strip()
             row_column4 = row[3].plain.strip()
-            column3 = columns[2].label
-            column4 = columns[3].label
 
-            if self.speech_program:
-                system(f"{self.speech_program} Selected row is "
-                       f"{column1}: {row_column1}. "
-                       f"{column2}: {row_column2}. {column3}: {row_column3}. "
-                       f"{column4}: {row_column4}.")
-            else:
-                self.say_phrase('row.mp3')
-                # cluster name
-                for name in row_column1.split("-"):
-                    if name:
-                        self.say(audio_file=path.join(self.cluster_audio, f'{name}.mp3'))
+            self.say_phrase('row.mp3')
+            # cluster name
+            for name in row_column1.split("-"):
+                if name:
+                    self.say(audio_file=path.join(self.cluster_audio, f'{name}.mp3'))
 
-                # distro name
-                self.say_phrase('distro.mp3')
-                self.say(audio_file=path.join(self.cluster_audio, f'{row_column2}.mp3'))
+            # distro name
+            self.say_phrase('distro.mp3')
+            self.say(audio_file=path.join(self.cluster_audio, f'{row_column2}.mp3'))
 
-                # version
-                self.say_phrase('version.mp3')
+            # version
+            self.say_phrase('version.mp3')
 
-                if row_column3 == "unknown":
+            if row_column3 == "unknown":
+                self.say(audio_file=path.join(self.tts_files,
+                                   "phrases/unknown_version.mp3"))
+            else:
+                version = row_column3.replace("+k3s1",
+                                              "").lstrip("v").split(".")
+                last_item = version[-1]
+                for number in version:
                     self.say(audio_file=path.join(self.tts_files,
-                                       "phrases/unknown_version.mp3"))
-                else:
-                    version = row_column3.replace("+k3s1",
-                                                  "").lstrip("v").split(".")
-                    last_item = version[-1]
-                    for number in version:
-                        self.say(audio_file=path.join(self.tts_files,
-                                           f'numbers/{number}.mp3'))
-                        # say "point" between numbers
-                        if number != last_item:
-                            self.say_phrase('point.mp3')
-
-                # say what platform we're running on
-                self.say_phrase('platform.mp3')
-                if row_column4 == "linux/arm64":
-                    self.say(audio_file=path.join(self.cluster_audio, 'linux_arm.mp3'))
-                elif row_column4 == "linux/amd64":
-                    self.say(audio_file=path.join(self.cluster_audio, 'linux_amd.mp3'))
-                elif row_column4 == "Darwin/arm64":
-                    self.say(audio_file=path.join(self.cluster_audio, 'macos_arm.mp3'))
-                else:
-                    self.say(audio_file=path.join(self.tts_files, 'phrases/um.mp3'))
+                                       f'numbers/{number}.mp3'))
+                    # say "point" between numbers
+                    if number != last_item:
+                        self.say_phrase('point.mp3')
+
+            # say what platform we're running on
+            self.say_phrase('platform.mp3')
+            if row_column4 == "linux/arm64":
+                self.say(audio_file=path.join(self.cluster_audio, 'linux_arm.mp3'))
+            elif row_column4 == "linux/amd64":
+                self.say(audio_file=path.join(self.cluster_audio, 'linux_amd.mp3'))
+            elif row_column4 == "Darwin/arm64":
+                self.say(audio_file=path.join(self.cluster_audio, 'macos_arm.mp3'))
+            else:
+                self.say(audio_file=path.join(self.tts_files, 'phrases/um.mp3'))
 
     def on_focus(self, event: DescendantFocus) -> None:
         """
@@ -779,28 +850,30 @@ class SmolAudio(Widget):
             self.app.bell()
 
         if self.speak_on_focus and self.speech_program:
-            id = event.widget.id
-            self.say(text=f"element is {id}")
-
-            # input fields
-            if isinstance(event.widget, Input):
-                content = event.widget.value
-                placeholder = event.widget.placeholder
-                if content:
-                    self.say(text=f"value is {content}")
-                elif placeholder:
-                    self.say(text=f"place holder text is {placeholder}")
-
-            # buttons
-            elif isinstance(event.widget, Button):
-                self.say(text=f"button text is {event.widget.label}")
-
-            # switches
-            elif isinstance(event.widget, Switch) or isinstance(event.widget,
-                                                                Select):
-                self.say(text=f"value is {event.widget.value}")
-
-            # also read the tooltip if there is one
-            tooltip = event.widget.tooltip
-            if tooltip:
-                self.say(text=f"tooltip is {tooltip}")
+            # moving focus again cuts this off, so we never fall behind
+            with self.utterance("element"):
+                id = event.widget.id
+                self.say(text=f"element is {id}")
+
+                # input fields
+                if isinstance(event.widget, Input):
+                    content = event.widget.value
+                    placeholder = event.widget.placeholder
+                    if content:
+                        self.say(text=f"value is {content}")
+                    elif placeholder:
+                        self.say(text=f"place holder text is {placeholder}")
+
+                # buttons
+                elif isinstance(event.widget, Button):
+                    self.say(text=f"button text is {event.widget.label}")
+
+                # switches
+                elif isinstance(event.widget, Switch) or isinstance(event.widget,
+                                                                    Select):
+                    self.say(text=f"value is {event.widget.value}")
+
+                # also read the tooltip if there is one
+                tooltip = event.widget.tooltip
+                if tooltip:
+                    self.say(text=f"tooltip is {tooltip}")
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# measures how long the TUI takes to start with a textual pilot, the same way
+# make_screenshots.py drives the TUI, and fails if the first frame is too slow
+# usage: python smol_k8s_lab/tui/benchmark_startup.py [TARGET_SECONDS]
+from time import perf_counter
+
+# measure from before we import anything from smol-k8s-lab
+START = perf_counter()
+
+from smol_k8s_lab.tui.base import BaseApp
+import asyncio
+from statistics import median
+import sys
+
+IMPORTED = perf_counter()
+
+# seconds from starting python to the first frame of the start screen
+TARGET = 2.0
+RUNS = 5
+
+
+async def time_startup() -> tuple[float, float]:
+    """
+    returns how long it took for the start screen to be ready, and then how
+    long until every cluster in the cluster table was checked
+    """
+    start = perf_counter()
+    async with BaseApp().run_test(size=(87, 47)) as pilot:
+        first_frame = perf_counter() - start
+        await pilot.app.workers.wait_for_complete()
+        clusters_checked = perf_counter() - start
+    return first_frame, clusters_checked
+
+
+async def benchmark() -> float:
+    """
+    start the TUI RUNS times and print how long each part of startup took
+    """
+    import_time = IMPORTED - START
+    results = [await time_startup() for _ in range(RUNS)]
+
+    first_frame = import_time + median(result[0] for result in results)
+    clusters_checked = import_time + median(result[1] for result in results)
+    print(f"imports:          {import_time:0.3f}s")
+    print(f"first frame:      {first_frame:0.3f}s (median of {RUNS})")
+    print(f"clusters checked: {clusters_checked:0.3f}s (median of {RUNS})")
+    return first_frame
+
+
+if __name__ == "__main__":
+    target = float(sys.argv[1]) if len(sys.argv) > 1 else TARGET
+    first_frame = asyncio.run(benchmark())
+    if first_frame > target:
+        print(f"❌ first frame took longer than the {target:0.3f}s target")
+        sys.exit(1)
+    print(f"✅ first frame was within the {target:0.3f}s target")
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3.11
+"""
+Saves the TUI's config.yaml without rewriting the whole file on every
+keystroke: changes are coalesced for a short debounce window, written
+atomically, and skipped entirely if nothing actually changed.
+"""
+from smol_k8s_lab.utils.artifacts import write_atomically
+
+from hashlib import sha256
+from io import StringIO
+from os import path
+from ruamel.yaml import YAML
+from threading import Lock, current_thread, main_thread
+from textual.timer import Timer
+
+
+class ConfigWriter():
+    """
+    debounced, atomic writer for a textual app's config dict
+    """
+    def __init__(self, app, config_file: str, delay: float = 0.5) -> None:
+        self.app = app
+        self.config_file = config_file
+        self.delay = delay
+        self.dirty = False
+        self.timer: Timer = None
+        self.lock = Lock()
+        self.yaml = YAML()
+
+        # so we don't rewrite the file with exactly what's already in it
+        self.last_hash = ""
+        if path.exists(config_file):
+            with open(config_file, 'rb') as existing_config:
+                self.last_hash = sha256(existing_config.read()).hexdigest()
+
+    def mark_dirty(self) -> None:
+        """
+        the config changed, so write it once no more changes come in for delay
+        seconds. Safe to call from worker threads
+        """
+        if current_thread() is not main_thread():
+            self.app.call_from_thread(self.mark_dirty)
+            return
+
+        self.dirty = True
+        if self.timer:
+            self.timer.reset()
+        else:
+            self.timer = self.app.set_timer(self.delay, self.flush)
+
+    def flush(self) -> None:
+        """
+        write the config now, if it changed. Called when the debounce timer
+        fires, and on screen changes and exit
+        """
+        with self.lock:
+            if self.timer:
+                self.timer.stop()
+                self.timer = None
+
+            if not self.dirty:
+                return
+            self.dirty = False
+
+            config = StringIO()
+            self.yaml.dump(self.app.cfg, config)
+            content = config.getvalue().encode()
+
+            digest = sha256(content).hexdigest()
+            if digest == self.last_hash:
+                return
+
+            write_atomically(self.config_file, content)
+            self.last_hash = digest
+
@@ -77,6 +77,7 @@ class HelpScreen(ModalScreen):
                 "meta+click": link_help,
                 "esc or q": "leave current screen and go home",
                 "c": "launch the config screen",
+                "o": "show background operations, like syncs and backups",
                 "f5": "read aloud current focused element ID",
                 "f": "toggle showing the footer"
                 }
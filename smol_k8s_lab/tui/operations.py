@@ -0,0 +1,265 @@
+#!/usr/bin/env python3.11
+"""
+Runs long operations for the TUI, like Argo CD syncs, deletes, and backups,
+as background thread workers so the TUI never freezes. Each operation streams
+its output to an operations log, and can be cancelled between steps.
+Progress events from an operation's thread, like each command it runs, are
+shown in its log too.
+"""
+from smol_k8s_lab.utils.events import WAIT_PROGRESS, describe
+
+from asyncio import get_running_loop
+from rich.text import Text
+from textual.app import ComposeResult
+from textual.binding import Binding
+from textual.containers import Grid
+from textual.screen import ModalScreen
+from textual.widgets import DataTable, RichLog
+from textual.worker import Worker
+from collections.abc import Callable
+from datetime import datetime
+from threading import get_ident
+
+
+class OperationCancelled(Exception):
+    """
+    raised inside an operation's thread when it's been cancelled
+    """
+
+
+class Operation():
+    """
+    one background operation, its status, and everything it has output so far
+    """
+    def __init__(self, operations, title: str) -> None:
+        self.operations = operations
+        self.title = title
+        self.status = "running"
+        self.started = datetime.now()
+        self.lines = []
+        self.worker: Worker = None
+        # the thread the operation runs in, so we know which events are its own
+        self.thread = None
+
+    def output(self, line: str) -> None:
+        """
+        stream a line of output from the operation's thread to the TUI. Raises
+        OperationCancelled if the operation has been cancelled
+        """
+        if self.worker and self.worker.is_cancelled:
+            raise OperationCancelled(f"{self.title} was cancelled")
+
+        if line:
+            self.operations.app.call_from_thread(self.operations.emit,
+                                                 self,
+                                                 str(line).strip())
+
+    def cancel(self) -> None:
+        """
+        cancel the operation. It stops the next time it outputs anything
+        """
+        if self.status == "running" and self.worker:
+            self.worker.cancel()
+            self.status = "cancelling"
+            self.operations.emit(self, "cancelling...")
+
+
+class Operations():
+    """
+    A shared service for running many operations at once in thread workers.
+    Screens can listen for output from every operation to show it live.
+    """
+    def __init__(self, app) -> None:
+        self.app = app
+        self.operations = []
+        self.listeners = []
+
+    def run(self,
+            title: str,
+            task: Callable,
+            on_done: Callable = None) -> Operation:
+        """
+        runs task(operation) in a thread worker. When it's done, the user is
+        notified of the result, and on_done(result, error) is called on the
+        main thread, where error is an empty string if it succeeded
+        """
+        operation = Operation(self, title)
+        self.operations.append(operation)
+
+        def run_task() -> None:
+            operation.thread = get_ident()
+            try:
+                result = task(operation)
+            except OperationCancelled as e:
+                self.app.call_from_thread(self.finish, operation, None,
+                                          str(e), "cancelled", on_done)
+            except Exception as e:
+                self.app.call_from_thread(self.finish, operation, None,
+                                          str(e), "failed", on_done)
+            else:
+                self.app.call_from_thread(self.finish, operation, result,
+                                          "", "done", on_done)
+
+        operation.worker = self.app.run_worker(run_task,
+                                               name=title,
+                                               group="operation-workers",
+                                               thread=True,
+                                               exit_on_error=False)
+        self.emit(operation, "started")
+        self.app.notify("\nRunning in the background. Press [gold3]o[/] to "
+                        "see its progress 👍",
+                        title=f"⏳ {title}",
+                        timeout=5)
+        return operation
+
+    def finish(self,
+               operation: Operation,
+               result: str | list | None,
+               error: str,
+               status: str,
+               on_done: Callable = None) -> None:
+        """
+        record how an operation went and let the user know
+        """
+        operation.status = status
+        if isinstance(result, list):
+            result = "\n".join(result)
+
+        if error:
+            self.emit(operation, error)
+            self.app.notify(f"\n{error}",
+                            title=f"❌ {operation.title} {status}",
+                            severity="error" if status == "failed" else "warning",
+                            timeout=10)
+        else:
+            self.emit(operation, result or "done")
+            self.app.notify(f"\n{result or 'No response recieved... 🤔'}",
+                            title=f"✅ {operation.title} done",
+                            severity="information" if result else "warning",
+                            timeout=10)
+
+        if on_done:
+            on_done(result, error)
+
+    def emit(self, operation: Operation, line: str) -> None:
+        """
+        save a line of output and pass it to anyone listening
+        """
+        operation.lines.append(line)
+        for listener in self.listeners:
+            listener(operation, line)
+
+    def running(self) -> list:
+        """
+        returns all operations that are still running
+        """
+        return [operation for operation in self.operations
+                if operation.status in ["running", "cancelling"]]
+
+
+class TextualRenderer():
+    """
+    renders progress events in the TUI, by adding them to the output of the
+    operation whose thread emitted them. Has to be created on the main thread
+    """
+    live = False
+
+    def __init__(self, operations: Operations) -> None:
+        self.operations = operations
+        self.loop = get_running_loop()
+
+    def on_event(self, event: dict) -> None:
+        # these come in too fast to be useful in a log
+        if event['type'] == WAIT_PROGRESS:
+            return
+
+        for operation in self.operations.running():
+            if operation.thread == event['thread']:
+                # never wait on the TUI, so we don't hold up the other renderers
+                self.loop.call_soon_threadsafe(self.operations.emit,
+                                               operation,
+                                               describe(event))
+                return
+
+
+class OperationsScreen(ModalScreen):
+    """
+    dialog screen to show every background operation and its live output
+    """
+    CSS_PATH = ["./css/operations.tcss"]
+
+    BINDINGS = [
+            Binding(key="o,q,escape",
+                    key_display="q",
+                    action="app.pop_screen",
+                    description=" Close",
+                    show=True),
+            Binding(key="x",
+                    key_display="x",
+                    action="cancel_operation",
+                    description=" Cancel operation",
+                    show=True),
+            Binding(key="f5",
+                    key_display="f5",
+                    description=" Speak",
+                    action="app.speak_element",
+                    show=True),
+            ]
+
+    def compose(self) -> ComposeResult:
+        with Grid(id="operations-container"):
+            yield DataTable(zebra_stripes=True,
+                            id="operations-table",
+                            cursor_type="row")
+            yield RichLog(id="operations-log", wrap=True, markup=False)
+
+    def on_mount(self) -> None:
+        container = self.get_widget_by_id("operations-container")
+        container.border_title = "⏳ Background [#C1FF87]operations[/]"
+
+        data_table = self.get_widget_by_id("operations-table")
+        data_table.add_column("Operation", key="title")
+        data_table.add_column("Started", key="started")
+        data_table.add_column("Status", key="status")
+
+        log = self.get_widget_by_id("operations-log")
+        for index, operation in enumerate(self.app.operations.operations):
+            data_table.add_row(operation.title,
+                               operation.started.strftime("%H:%M:%S"),
+                               operation.status,
+                               key=str(index))
+            for line in operation.lines:
+                log.write(Text(f"{operation.title}: {line}"))
+
+        self.app.operations.listeners.append(self.on_output)
+
+    def on_unmount(self) -> None:
+        self.app.operations.listeners.remove(self.on_output)
+
+    def on_output(self, operation: Operation, line: str) -> None:
+        """
+        show new output and keep the status column up to date
+        """
+        self.get_widget_by_id("operations-log").write(
+                Text(f"{operation.title}: {line}")
+                )
+
+        data_table = self.get_widget_by_id("operations-table")
+        index = str(self.app.operations.operations.index(operation))
+        if index in data_table.rows:
+            data_table.update_cell(index, "status", operation.status)
+        else:
+            data_table.add_row(operation.title,
+                               operation.started.strftime("%H:%M:%S"),
+                               operation.status,
+                               key=index)
+
+    def action_cancel_operation(self) -> None:
+        """
+        cancel the highlighted operation
+        """
+        data_table = self.get_widget_by_id("operations-table")
+        if not data_table.row_count:
+            return
+        operation = self.app.operations.operations[data_table.cursor_row]
+        operation.cancel()
@@ -203,6 +203,15 @@ class NewOptionModal(ModalScreen):
         self.dismiss(input.value)
 
 
+def get_sensitive_value(screen, app_name: str, key: str) -> str:
+    """
+    returns a sensitive value the user already typed in for an app on a
+    screen, in case the widget it was typed into is being rebuilt
+    """
+    sensitive_values = getattr(screen, "sensitive_values", {})
+    return sensitive_values.get(app_name, {}).get(key, "")
+
+
 def format_description(description: str = ""):
     """
     change description to dimmed colors
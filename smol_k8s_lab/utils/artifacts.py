@@ -0,0 +1,198 @@
+"""
+A local, content addressed cache for the installers and manifests we download
+while bootstrapping a cluster, so rebuilding a cluster doesn't depend on
+GitHub being fast, or even up.
+
+Files are stored by their sha256 in ~/.cache/smol-k8s-lab/artifacts/, with an
+index of which url points to which file. Cached urls are revalidated with
+ETag/Last-Modified headers once they're older than max_age, and in offline
+mode, only cached artifacts are ever used.
+"""
+# internal libraries
+from smol_k8s_lab.constants import XDG_CACHE_DIR
+
+# external libraries
+from hashlib import sha256
+from json import dumps, loads
+import logging as log
+from os import chmod, fdopen, path, remove, replace, stat
+from pathlib import Path
+import requests
+from tempfile import mkstemp
+from threading import Lock
+from time import time
+
+ARTIFACT_DIR = path.join(XDG_CACHE_DIR, 'artifacts')
+INDEX_FILE = path.join(ARTIFACT_DIR, 'index.json')
+INDEX_LOCK = Lock()
+
+# set by --offline, to only ever use cached artifacts
+OFFLINE = False
+
+
+def set_offline(offline: bool = True) -> None:
+    """
+    turn offline mode on or off for every artifact fetched after this
+    """
+    global OFFLINE
+    OFFLINE = offline
+    if offline:
+        log.info("Offline mode: only using cached installers and manifests")
+
+
+def is_url(location: str) -> bool:
+    """
+    True if location is an http(s) url instead of a local file
+    """
+    return location.startswith("https://") or location.startswith("http://")
+
+
+def blob_path(digest: str) -> str:
+    """
+    returns the path to a cached file for a sha256 digest
+    """
+    return path.join(ARTIFACT_DIR, 'sha256', digest)
+
+
+def load_index() -> dict:
+    """
+    returns the {url: {sha256, etag, last_modified, fetched}} artifact index
+    """
+    if not path.exists(INDEX_FILE):
+        return {}
+
+    try:
+        with open(INDEX_FILE, 'r') as index_file:
+            return loads(index_file.read())
+    except (ValueError, OSError) as e:
+        log.warning(f"Couldn't read the artifact cache index, ignoring it: {e}")
+        return {}
+
+
+def write_atomically(file_path: str, content: bytes) -> None:
+    """
+    writes to a tmp file and then moves it into place, so readers never see
+    half a file. Each write gets its own tmp file, so threads writing the same
+    file at once can't mix their writes together. An existing file keeps its
+    permissions
+    """
+    directory = path.dirname(file_path)
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    tmp_fd, tmp_file = mkstemp(dir=directory or None,
+                               prefix=f".{path.basename(file_path)}.",
+                               suffix=".tmp")
+    try:
+        with fdopen(tmp_fd, 'wb') as tmp:
+            tmp.write(content)
+        if path.exists(file_path):
+            chmod(tmp_file, stat(file_path).st_mode)
+        replace(tmp_file, file_path)
+    except BaseException:
+        if path.exists(tmp_file):
+            remove(tmp_file)
+        raise
+
+
+def update_index(url: str, entry: dict) -> None:
+    """
+    updates one url in the index. Re-reads the index first, since other
+    threads may have added artifacts too
+    """
+    with INDEX_LOCK:
+        index = load_index()
+        index[url] = entry
+        write_atomically(INDEX_FILE, dumps(index, indent=2).encode())
+
+
+def get_cached(url: str) -> tuple[dict, str]:
+    """
+    returns the index entry and path of a cached url, if the cached file still
+    matches its checksum, otherwise ({}, "")
+    """
+    entry = load_index().get(url, {})
+    if not entry:
+        return {}, ""
+
+    cached_file = blob_path(entry['sha256'])
+    if not path.exists(cached_file):
+        return {}, ""
+
+    with open(cached_file, 'rb') as artifact_file:
+        if sha256(artifact_file.read()).hexdigest() != entry['sha256']:
+            log.warning(f"Cached copy of {url} doesn't match its checksum")
+            return {}, ""
+
+    return entry, cached_file
+
+
+def fetch_file(url: str, max_age: int = 3600, executable: bool = False) -> str:
+    """
+    returns the path to a cached copy of url, downloading it if it's not
+    cached, or revalidating it if it's older than max_age seconds. Falls back
+    to the cached copy if we can't reach the url.
+
+    raises an Exception in offline mode, if the url was never cached
+    """
+    entry, cached_file = get_cached(url)
+
+    if OFFLINE:
+        if not cached_file:
+            raise Exception(f"{url} isn't cached yet, so it can't be used offline."
+                            " Run once without --offline to cache it.")
+        log.debug(f"Offline mode, using cached {url}")
+    elif cached_file and time() - entry.get('fetched', 0) < max_age:
+        log.debug(f"Using cached {url}")
+    else:
+        cached_file = download(url, entry, cached_file)
+
+    if executable:
+        chmod(cached_file, 0o700)
+    return cached_file
+
+
+def fetch_text(url: str, max_age: int = 3600) -> str:
+    """
+    returns the contents of url as text, using the artifact cache
+    """
+    with open(fetch_file(url, max_age), 'r') as artifact_file:
+        return artifact_file.read()
+
+
+def download(url: str, entry: dict, cached_file: str) -> str:
+    """
+    downloads url, or only revalidates it if we already have a cached copy.
+    returns the path to the cached file
+    """
+    headers = {}
+    if cached_file:
+        if entry.get('etag', ""):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified', ""):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    try:
+        response = requests.get(url, headers=headers, timeout=30)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        if cached_file:
+            log.warning(f"Couldn't reach {url}, using cached copy: {e}")
+            return cached_file
+        raise
+
+    if response.status_code == 304:
+        log.debug(f"Cached {url} is still up to date")
+        entry['fetched'] = time()
+        update_index(url, entry)
+        return cached_file
+
+    log.info(f"Downloaded {url}")
+    digest = sha256(response.content).hexdigest()
+    cached_file = blob_path(digest)
+    if not path.exists(cached_file):
+        write_atomically(cached_file, response.content)
+
+    update_index(url, {"sha256": digest,
+                       "etag": response.headers.get('ETag', ""),
+                       "last_modified": response.headers.get('Last-Modified', ""),
+                       "fetched": time()})
+    return cached_file
@@ -0,0 +1,273 @@
+"""
+A shared bus for progress events, like a phase or command starting and
+ending, progress while waiting on something, or the status of a resource, so
+that the CLI and the TUI can both show what's going on without each bit of
+work printing its own spinners and progress bars over the top of each other.
+
+Emitting an event never blocks: events are put on a queue and passed to each
+renderer in a single background thread. If nothing is subscribed, emitting is
+just one check.
+"""
+from contextlib import contextmanager
+from json import dumps
+from queue import SimpleQueue
+from rich.markup import escape
+from threading import Event, Lock, Thread, get_ident
+from time import monotonic, time
+import logging as log
+
+# every type of event we emit
+PHASE_START = "phase_start"
+PHASE_END = "phase_end"
+COMMAND_START = "command_start"
+COMMAND_END = "command_end"
+WAIT_START = "wait_start"
+WAIT_PROGRESS = "wait_progress"
+WAIT_END = "wait_end"
+RESOURCE_STATUS = "resource_status"
+
+
+class EventBus():
+    """
+    passes events to every subscribed renderer, from one background thread.
+    A renderer is anything with an on_event(event) method, and a live
+    attribute if it draws to the terminal
+    """
+    def __init__(self) -> None:
+        self.renderers = []
+        self.queue = SimpleQueue()
+        self.lock = Lock()
+        self.thread: Thread = None
+
+    @property
+    def live(self) -> bool:
+        """
+        True if a renderer is drawing progress to the terminal, in which case
+        nothing else should draw its own spinners or progress bars
+        """
+        return any(getattr(renderer, "live", False) for renderer in self.renderers)
+
+    def subscribe(self, renderer) -> None:
+        """
+        start passing events to renderer
+        """
+        with self.lock:
+            self.renderers = self.renderers + [renderer]
+            if not self.thread:
+                self.thread = Thread(target=self.dispatch,
+                                     name="smol-events",
+                                     daemon=True)
+                self.thread.start()
+
+    def unsubscribe(self, renderer) -> None:
+        """
+        stop passing events to renderer, once it has every event emitted so far
+        """
+        self.flush()
+        with self.lock:
+            if renderer in self.renderers:
+                self.renderers = [r for r in self.renderers if r is not renderer]
+        if hasattr(renderer, "close"):
+            renderer.close()
+
+    def emit(self, event_type: str, name: str, **fields) -> None:
+        """
+        queue an event for the renderers. Returns right away
+        """
+        if not self.renderers:
+            return
+        self.queue.put({"type": event_type,
+                        "name": name,
+                        "time": time(),
+                        "thread": get_ident(),
+                        **fields})
+
+    def flush(self, timeout: float = 5) -> None:
+        """
+        wait until every event emitted so far has been rendered
+        """
+        if not self.thread:
+            return
+        done = Event()
+        self.queue.put(done)
+        done.wait(timeout)
+
+    def dispatch(self) -> None:
+        """
+        pass each event to every renderer, until the program exits
+        """
+        while True:
+            event = self.queue.get()
+            if isinstance(event, Event):
+                event.set()
+                continue
+
+            for renderer in self.renderers:
+                try:
+                    renderer.on_event(event)
+                except Exception as e:
+                    log.debug(f"{type(renderer).__name__} couldn't render "
+                              f"{event['type']} for {event['name']}: {e}")
+
+
+# the one event bus for all of smol-k8s-lab
+EVENTS = EventBus()
+
+
+@contextmanager
+def phase(name: str):
+    """
+    emits a phase_start event, and then a phase_end event with how long the
+    phase took and the error, if it raised one
+    """
+    start = monotonic()
+    EVENTS.emit(PHASE_START, name)
+    try:
+        yield
+    except BaseException as e:
+        EVENTS.emit(PHASE_END, name, duration=monotonic() - start, error=str(e))
+        raise
+    EVENTS.emit(PHASE_END, name, duration=monotonic() - start, error="")
+
+
+def describe(event: dict) -> str:
+    """
+    returns a one line, plain text description of an event
+    """
+    event_type = event['type']
+    name = event['name']
+    duration = event.get('duration', 0)
+
+    if event_type == PHASE_START:
+        return f"started {name}"
+    if event_type == PHASE_END:
+        if event.get('error'):
+            return f"{name} failed after {duration:.1f}s: {event['error']}"
+        return f"finished {name} in {duration:.1f}s"
+    if event_type == COMMAND_START:
+        return f"running: {name}"
+    if event_type == COMMAND_END:
+        if event.get('error'):
+            return f"{name} failed after {duration:.1f}s: {event['error']}"
+        return f"finished {name} in {duration:.1f}s"
+    if event_type == WAIT_START:
+        return f"waiting for {name}"
+    if event_type == WAIT_PROGRESS:
+        return f"{name}: {event.get('completed', 0)}/{event.get('total', '?')}"
+    if event_type == WAIT_END:
+        state = "done" if event.get('ok', True) else "gave up"
+        return f"{state} waiting for {name} after {duration:.1f}s"
+    return f"{name}: {event.get('status', '')}"
+
+
+class JsonLinesRenderer():
+    """
+    writes each event as a line of json to a file, for other tools to follow
+    """
+    live = False
+
+    def __init__(self, file_path: str) -> None:
+        self.file = open(file_path, 'a', buffering=1)
+
+    def on_event(self, event: dict) -> None:
+        self.file.write(dumps(event, default=str) + "\n")
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class RichLiveRenderer():
+    """
+    shows every running phase, command, wait, and resource as a task in one
+    rich live progress display, since rich can only show one live display
+    per console at a time
+    """
+    live = True
+
+    def __init__(self, console=None) -> None:
+        from rich.progress import (Progress, BarColumn, SpinnerColumn,
+                                   TaskProgressColumn, TextColumn,
+                                   TimeElapsedColumn)
+        from smol_k8s_lab.utils.rich_cli.console_logging import CONSOLE
+
+        self.console = console or CONSOLE
+        self.progress = Progress(SpinnerColumn(spinner_name='aesthetic',
+                                               speed=0.75),
+                                 TextColumn("{task.description}"),
+                                 BarColumn(),
+                                 TaskProgressColumn(),
+                                 TimeElapsedColumn(),
+                                 console=self.console,
+                                 transient=True)
+        # {(thread, type of task, name): rich task id}
+        self.tasks = {}
+
+    def on_event(self, event: dict) -> None:
+        event_type = event['type']
+        name = event['name']
+        thread = event['thread']
+        # commands and resource names can have [brackets] rich would eat
+        label = escape(name)
+
+        if event_type == PHASE_START:
+            self.add((thread, "phase", name), f"[cyan]{label}")
+        elif event_type == PHASE_END:
+            self.remove((thread, "phase", name))
+            if event.get('error'):
+                self.console.print(f"[danger]✗[/] {escape(describe(event))}")
+            else:
+                self.console.print(f"[grn]✓[/] {label} [dim]{event['duration']:.1f}s")
+
+        elif event_type == COMMAND_START:
+            self.add((thread, "command", name), f"[green]Running:[/] {label}")
+        elif event_type == COMMAND_END:
+            self.remove((thread, "command", name))
+
+        elif event_type == WAIT_START:
+            self.add((thread, "wait", name), f"[green]{label}...",
+                     total=event.get('total', None))
+        elif event_type == WAIT_PROGRESS:
+            task_id = self.tasks.get((thread, "wait", name), None)
+            if task_id is not None:
+                self.progress.update(task_id,
+                                     completed=event.get('completed', 0),
+                                     total=event.get('total', None))
+        elif event_type == WAIT_END:
+            self.remove((thread, "wait", name))
+
+        elif event_type == RESOURCE_STATUS:
+            # resources aren't tied to a thread, since anything can check on them
+            key = (0, "resource", name)
+            if event.get('final', False):
+                self.remove(key)
+                self.console.print(f"[info]{escape(describe(event))}")
+            elif key in self.tasks:
+                self.progress.update(self.tasks[key],
+                                     description=escape(describe(event)))
+            else:
+                self.add(key, escape(describe(event)))
+
+    def add(self, key: tuple, description: str, total: float = None) -> None:
+        """
+        add a task, starting the live display if it's the first one
+        """
+        if not self.tasks:
+            self.progress.start()
+        if key in self.tasks:
+            self.progress.remove_task(self.tasks[key])
+        self.tasks[key] = self.progress.add_task(description, total=total)
+
+    def remove(self, key: tuple) -> None:
+        """
+        remove a task, stopping the live display if it was the last one
+        """
+        task_id = self.tasks.pop(key, None)
+        if task_id is None:
+            return
+        self.progress.remove_task(task_id)
+        if not self.tasks:
+            self.progress.stop()
+
+    def close(self) -> None:
+        self.tasks.clear()
+        self.progress.stop()
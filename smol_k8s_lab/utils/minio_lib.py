@@ -1,10 +1,15 @@
+from datetime import datetime
 from json import load, dump, dumps
 import logging as log
 from os.path import exists, join
 from os import makedirs
 from minio import Minio, MinioAdmin
 from minio.credentials.providers import MinioClientConfigProvider
+from minio.datatypes import EventIterable, Object
+from minio.error import S3Error
 from shutil import which
+from threading import Event, Thread
+from time import monotonic
 
 from smol_k8s_lab.constants import HOME_DIR, XDG_CACHE_DIR
 from smol_k8s_lab.bitwarden.bw_cli import BwCLI
@@ -34,6 +39,9 @@ class BetterMinio:
         self.admin_client = MinioAdmin(api_hostname, minio_provider)
         self.client = Minio(api_hostname, access_key, secret_key)
 
+        # cnpg backups per (bucket, cluster), see get_backup_catalog()
+        self.backup_catalogs = {}
+
     def get_object(self, bucket: str, s3_object: str, save_file: str = ""):
         """
         get an s3_object from an s3 endpoint
@@ -57,6 +65,187 @@ class BetterMinio:
 
         return self.client.list_objects(**obj_args)
 
+    def stat_object(self, bucket: str, s3_object: str) -> Object | None:
+        """
+        get the metadata of a single s3_object, without listing anything.
+        Returns None if the object doesn't exist
+        """
+        try:
+            return self.client.stat_object(bucket, s3_object)
+        except S3Error as e:
+            if e.code in ["NoSuchKey", "NoSuchObject"]:
+                return None
+            raise
+
+    def object_exists(self, bucket: str, prefix: str) -> bool:
+        """
+        checks if any object starts with prefix, using a single list request
+        """
+        objects = self.client.list_objects(bucket, prefix=prefix, recursive=True)
+        return next(iter(objects), None) is not None
+
+    def wal_exists(self, bucket: str, cluster_name: str, wal: str) -> bool:
+        """
+        checks if a CNPG WAL archive exists, based on the barman layout of:
+        <cluster_name>/wals/<timeline and segment, first 16 chars of wal>/<wal>
+        """
+        wal_path = f"{cluster_name}/wals/{wal[:16]}/{wal}"
+        if self.stat_object(bucket, wal_path):
+            return True
+
+        # compressed wals have a suffix, e.g. .gz, so we check the prefix too
+        return self.object_exists(bucket, wal_path)
+
+    def wait_for_object(self,
+                        bucket: str,
+                        prefix: str,
+                        poll_interval: int = 10,
+                        timeout: int = 0,
+                        notifications: bool = False,
+                        notification_prefix: str = "") -> bool:
+        """
+        waits for an object starting with prefix to exist in bucket, checking
+        with one request every poll_interval seconds.
+
+        if notifications is True, we also listen for bucket notifications on
+        notification_prefix (defaults to prefix), so we find out as soon as the
+        object is created, and polling is then only a slow fallback. For s3
+        providers that don't support bucket notifications, like AWS S3, we
+        just poll every poll_interval seconds.
+
+        Returns True when the object exists, or False if timeout seconds passed
+        """
+        found = Event()
+        done = Event()
+        if notifications:
+            try:
+                events = self.client.listen_bucket_notification(
+                        bucket,
+                        prefix=notification_prefix or prefix,
+                        events=("s3:ObjectCreated:*",)
+                        )
+            except (ValueError, S3Error) as e:
+                # e.g. AWS S3, which doesn't support listening for notifications
+                log.debug(f"Can't listen for bucket notifications on {bucket}, "
+                          f"so we'll just poll: {e}")
+            else:
+                Thread(target=self.listen_for_object,
+                       args=(events, bucket, prefix, found, done),
+                       daemon=True).start()
+                poll_interval *= 6
+
+        deadline = monotonic() + timeout if timeout else None
+        try:
+            while not self.object_exists(bucket, prefix):
+                if deadline and monotonic() > deadline:
+                    return False
+                found.wait(poll_interval)
+            return True
+        finally:
+            done.set()
+
+    def listen_for_object(self,
+                          events: EventIterable,
+                          bucket: str,
+                          prefix: str,
+                          found: Event,
+                          done: Event) -> None:
+        """
+        sets found when an object starting with prefix is created in bucket.
+        Stops at the first notification after done is set, and closes the
+        events stream on the way out
+        """
+        try:
+            with events:
+                for event in events:
+                    if done.is_set():
+                        return
+                    for record in event.get("Records", []):
+                        if record["s3"]["object"]["key"].startswith(prefix):
+                            found.set()
+        except Exception as e:
+            log.debug(f"Couldn't listen for bucket notifications on {bucket}: {e}")
+
+    def get_backup_catalog(self,
+                           bucket: str,
+                           cluster_name: str,
+                           refresh: bool = False) -> list:
+        """
+        lists the CNPG (barman) backups of a cluster, oldest to newest, by
+        listing only the backup directories directly under <cluster_name>/base/
+
+        Returns list of dicts like:
+            {"backup_id": "20240507T122317",
+             "timestamp": datetime(2024, 5, 7, 12, 23, 17),
+             "info_path": "matrix-postgres/base/20240507T122317/backup.info"}
+
+        The catalog is cached per bucket and cluster unless refresh is True
+        """
+        catalog_key = (bucket, cluster_name)
+        if not refresh and catalog_key in self.backup_catalogs:
+            return self.backup_catalogs[catalog_key]
+
+        base_dir = f"{cluster_name}/base/"
+        backups = []
+        for backup_dir in self.client.list_objects(bucket, prefix=base_dir):
+            if not backup_dir.is_dir:
+                continue
+
+            backup_id = backup_dir.object_name[len(base_dir):].strip("/")
+            try:
+                timestamp = datetime.strptime(backup_id, "%Y%m%dT%H%M%S")
+            except ValueError:
+                log.debug(f"Skipping {backup_dir.object_name}, not a backup id")
+                continue
+
+            backups.append({"backup_id": backup_id,
+                            "timestamp": timestamp,
+                            "info_path": f"{base_dir}{backup_id}/backup.info"})
+
+        backups.sort(key=lambda backup: backup["timestamp"])
+        self.backup_catalogs[catalog_key] = backups
+        return backups
+
+    def read_backup_info(self, bucket: str, info_path: str) -> dict:
+        """
+        reads a barman backup.info file in memory and returns it as a dict
+        """
+        response = self.client.get_object(bucket, info_path)
+        try:
+            backup_info = response.data.decode("utf-8")
+        finally:
+            response.close()
+            response.release_conn()
+
+        info = {}
+        for line in backup_info.splitlines():
+            key, separator, value = line.partition("=")
+            if separator:
+                info[key.strip()] = value.strip()
+        return info
+
+    def get_latest_backup(self,
+                          bucket: str,
+                          cluster_name: str,
+                          refresh: bool = False) -> dict | None:
+        """
+        returns the newest completed CNPG backup from get_backup_catalog(),
+        with its backup.info contents under the "info" key, or None
+        """
+        for backup in reversed(self.get_backup_catalog(bucket, cluster_name, refresh)):
+            if "info" not in backup:
+                try:
+                    backup["info"] = self.read_backup_info(bucket, backup["info_path"])
+                except S3Error as e:
+                    # backups that are still running don't have a backup.info yet
+                    log.debug(f"Skipping backup {backup['backup_id']}: {e}")
+                    continue
+
+            if backup["info"].get("status", "DONE") == "DONE":
+                return backup
+
+        return None
+
     def delete_object(self,
                       bucket_name: str,
                       object_name: str,
@@ -425,3 +614,4 @@ def create_minio_alias(minio_alias: str,
     # write out the config file when we're done
     with open(minio_config_file, 'w') as minio_config_contents:
         dump(minio_cfg_obj, minio_config_contents)
+
@@ -44,7 +44,22 @@ def options_help():
         'Run command immediately after smol-k8s-lab before main cli phase',
 
         'version':
-        f'Print the version of smol-k8s-lab (v{VERSION})'
+        f'Print the version of smol-k8s-lab (v{VERSION})',
+
+        'backup':
+        '💾 Back up all enabled apps with backups configured, then exit',
+
+        'apps':
+        'Comma separated list of apps to back up with --backup. Defaults to all',
+
+        'parallel':
+        'Max number of apps to back up at the same time with --backup. Default: 4',
+
+        'offline':
+        'Only use cached installers and manifests, instead of downloading them',
+
+        'events':
+        'Write progress events, like each phase and command, as JSON lines to this file'
         }
 
     if RECORD:
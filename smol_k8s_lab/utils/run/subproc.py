@@ -4,13 +4,16 @@ so during long running commands, the user isn't wondering what's going on,
 even if you don't actually output anything from stdout/stderr of the command.
 """
 import logging as log
+from smol_k8s_lab.utils.events import (EVENTS, COMMAND_START, COMMAND_END,
+                                       WAIT_START, WAIT_PROGRESS, WAIT_END)
 from subprocess import Popen, PIPE
 import re
 from rich.console import Console
 from rich.markup import MarkupError
 from rich.theme import Theme
 from rich.progress import Progress
-from time import sleep
+from threading import Lock
+from time import monotonic, sleep
 
 
 soft_theme = Theme({"info": "dim cornflower_blue",
@@ -18,6 +21,9 @@ soft_theme = Theme({"info": "dim cornflower_blue",
                     "danger": "bold magenta"})
 console = Console(theme=soft_theme)
 
+# rich can only show one live display at a time, so threads take turns
+LOADING_BAR_LOCK = Lock()
+
 
 def basic_syntax(bash_string: str):
     """
@@ -65,25 +71,43 @@ def subproc(commands: list, **kwargs):
             # make sure I'm not about to print a password, oof
             if 'password' not in cmd.lower():
                 status_line += printed_cmd
+                event_cmd = cmd
             else:
                 status_line += printed_cmd.split('assword')[0] + \
                     'assword[warn]:warning: TRUNCATED'
+                event_cmd = cmd.split('assword')[0] + 'assword TRUNCATED'
         else:
             cmd_parts = printed_cmd.split(' ')
             msg = '[green]Running [i]secret[/i] command:[b] ' + cmd_parts[0]
             status_line = " ".join([msg, cmd_parts[1], '[dim]...'])
+            event_cmd = cmd.split(' ')[0] + ' ...'
         status_line += '\n'
 
-        # Sometimes we need to not use a little loading bar
-        if not spinner:
-            log.info(status_line, extra={"markup": True})
-            output = run_subprocess(cmd, **kwargs)
-        else:
-            log.debug(cmd)
-            with console.status(status_line,
-                                spinner='aesthetic',
-                                speed=0.75) as status:
+        EVENTS.emit(COMMAND_START, event_cmd)
+        start = monotonic()
+        error = ""
+        try:
+            # the progress events are already being drawn, so no spinner
+            if EVENTS.live:
+                log.debug(cmd)
                 output = run_subprocess(cmd, **kwargs)
+            # Sometimes we need to not use a little loading bar
+            elif not spinner:
+                log.info(status_line, extra={"markup": True})
+                output = run_subprocess(cmd, **kwargs)
+            else:
+                log.debug(cmd)
+                with console.status(status_line,
+                                    spinner='aesthetic',
+                                    speed=0.75) as status:
+                    output = run_subprocess(cmd, **kwargs)
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            EVENTS.emit(COMMAND_END, event_cmd,
+                        duration=monotonic() - start,
+                        error=error)
 
     return output
 
@@ -172,7 +196,12 @@ def simple_loading_bar(tasks: dict, time_to_wait: int = 120) -> None:
         https://rich.readthedocs.io/en/stable/progress.html
     """
     for task_name, task_command in tasks.items():
-        with Progress(transient=True) as progress:
+        # the progress events are already being drawn, so don't draw a bar too
+        if EVENTS.live:
+            wait_for_command(task_name, task_command, time_to_wait)
+            continue
+
+        with LOADING_BAR_LOCK, Progress(transient=True) as progress:
             task1 = progress.add_task(f"[green]{task_name}...",
                                       total=time_to_wait)
             while not progress.finished:
@@ -193,3 +222,26 @@ def simple_loading_bar(tasks: dict, time_to_wait: int = 120) -> None:
                     break
     print('')
     return
+
+
+def wait_for_command(task_name: str, task_command: str, time_to_wait: int) -> None:
+    """
+    retries a command until it succeeds, like simple_loading_bar, but only
+    reports how long we've waited as progress events
+    """
+    start = monotonic()
+    ok = False
+    EVENTS.emit(WAIT_START, task_name, total=time_to_wait)
+    while monotonic() - start < time_to_wait:
+        try:
+            subproc([task_command], spinner=False)
+        except Exception as reason:
+            log.debug(f"Encountered Exception: {reason}")
+            sleep(3)
+            EVENTS.emit(WAIT_PROGRESS, task_name,
+                        completed=min(monotonic() - start, time_to_wait),
+                        total=time_to_wait)
+            continue
+        ok = True
+        break
+    EVENTS.emit(WAIT_END, task_name, duration=monotonic() - start, ok=ok)
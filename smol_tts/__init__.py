@@ -1,16 +1,16 @@
-from .constants import DEFAULT_SAVE_PATH, SPEECH_TEXT_DIRECTORY
+from .constants import DEFAULT_SAVE_PATH
 
 # external libs
 import click
 from click import option, command, Choice
-from os import environ, path, system
+from os import environ, path
 from rich.console import Console
 from rich.highlighter import RegexHighlighter
 from rich.panel import Panel
 from rich.table import Table
 from rich.text import Text
 from rich.theme import Theme
-from smol_k8s_lab.utils.rich_cli.console_logging import header, sub_header
+from smol_k8s_lab.utils.rich_cli.console_logging import header
 import time
 from xdg_base_dirs import xdg_cache_home
 
@@ -119,6 +119,11 @@ class RichCommand(click.Command):
         default=DEFAULT_SAVE_PATH,
         type=str,
         help="override the default path to save generated audio files to")
+@option("--workers", "-w",
+        metavar="NUMBER",
+        default=0,
+        type=int,
+        help="number of processes to generate audio with. Defaults to one per CPU core, or one if using a GPU")
 @option("--tar", "-t",
         is_flag=True,
         help="tar (compress) all the sound files and put them into sound dir. Used mostly for releases")
@@ -128,6 +133,7 @@ class RichCommand(click.Command):
 def tts_gen(category: str = "",
             language: str = "",
             save_path: str = "",
+            workers: int = 0,
             tar: bool = False,
             untar: bool = False):
     """
@@ -155,16 +161,15 @@ def tts_gen(category: str = "",
     if not untar:
         # internal libs
         from .audio_generation import AudioGenerator
-        import asyncio
 
         header(f"Saving files to {save_path}", "💾")
 
-        cached_cfg_path = path.join(xdg_cache_home(), "smol_tts")
         lang_obj = AudioGenerator(languages=language,
                                   category=category,
                                   save_path=save_path,
-                                  cached_cfg=cached_cfg_path)
-        asyncio.run(lang_obj.process_all_languages())
+                                  cache_dir=path.join(xdg_cache_home(), "smol_tts"),
+                                  workers=workers)
+        lang_obj.process_all_languages()
 
         # tar the directory and save it in the release directory if needed
         if tar:
@@ -177,10 +182,6 @@ def tts_gen(category: str = "",
             tarball.close()
 
 
-        sub_header("Caching config for checking diff next time.")
-        lang_path = path.join(SPEECH_TEXT_DIRECTORY, f"{language}.yml")
-        system(f"cp {lang_path} {cached_cfg_path}")
-
 
     # print how long everything took
     elapsed = time.perf_counter() - s
@@ -1,11 +1,21 @@
-# NOTE: this will only work if you already have ffmpeg installed
 from .constants import DEFAULT_SAVE_PATH, SPEECH_TEXT_DIRECTORY
 
 # external libs
-from os import path, makedirs, remove, uname
-from pydub import AudioSegment
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed)
+from multiprocessing import get_context
+from hashlib import sha256
+from json import dumps, loads
+from threading import Lock
+from os import cpu_count, listdir, path, makedirs, remove, uname
+from rich.progress import (Progress, BarColumn, MofNCompleteColumn, TextColumn,
+                           TimeElapsedColumn)
 from ruamel.yaml import YAML
-from smol_k8s_lab.utils.rich_cli.console_logging import header, sub_header
+from smol_k8s_lab.utils.artifacts import write_atomically
+import lameenc
+import numpy
+from smol_k8s_lab.utils.rich_cli.console_logging import CONSOLE, header, sub_header
+import time
 import torch
 from TTS.api import TTS
 
@@ -22,236 +32,353 @@ else:
 TTS_MODELS = {'en': "tts_models/en/jenny/jenny",
               'nl': "tts_models/nl/css10/vits"}
 
+# every category of text in the speech config files
+CATEGORIES = ["apps", "cluster_names", "numbers", "phrases", "screens"]
+
+# the TTS models loaded in this worker process, by language
+WORKER_TTS = {}
+
+
+def init_worker() -> None:
+    """
+    runs once in each synthesis process. On the CPU we already run one
+    process per core, so each one only needs one torch thread
+    """
+    if DEVICE == "cpu":
+        torch.set_num_threads(1)
+
+
+def get_worker_tts(language: str) -> TTS:
+    """
+    returns this worker process's TTS model for a language, loading it the
+    first time it's needed
+    """
+    if language not in WORKER_TTS:
+        WORKER_TTS[language] = TTS(model_name=TTS_MODELS[language]).to(DEVICE)
+    return WORKER_TTS[language]
+
+
+def synthesize_batch(language: str, clips: list) -> list:
+    """
+    runs in a synthesis process: synthesises each (text, mp3 file) in a batch
+    of clips, and returns a list of (mp3 file, pcm samples, sample rate) to
+    encode. Nothing is written to disk here
+    """
+    tts = get_worker_tts(language)
+    sample_rate = tts.synthesizer.output_sample_rate
+    return [(mp3_file, to_pcm(tts.tts(text=text)), sample_rate)
+            for text, mp3_file in clips]
+
+
+def to_pcm(samples: list) -> bytes:
+    """
+    converts float samples from the model to 16 bit mono pcm, normalised the
+    same way TTS does when it saves a .wav
+    """
+    samples = numpy.asarray(samples, dtype=numpy.float32)
+    peak = max(0.01, float(numpy.max(numpy.abs(samples)))) if samples.size else 1
+    return (samples * (32767 / peak)).astype(numpy.int16).tobytes()
+
+
+def encode_batch(clips: list) -> list:
+    """
+    encodes a batch of (mp3 file, pcm samples, sample rate) to mp3s in this
+    process with LAME, and returns the list of mp3 files written
+    """
+    mp3_files = []
+    for mp3_file, pcm, sample_rate in clips:
+        encoder = lameenc.Encoder()
+        encoder.set_bit_rate(64)
+        encoder.set_in_sample_rate(sample_rate)
+        encoder.set_channels(1)
+        encoder.set_quality(2)
+        write_atomically(mp3_file, encoder.encode(pcm) + encoder.flush())
+        mp3_files.append(mp3_file)
+    return mp3_files
+
 
 class AudioGenerator():
     """
-    for each file in the speech config directory, open the file and generate .wav
-    files before converting them all to smaller mp3s. takes two optional args:
+    for each file in the speech config directory, open the file and generate
+    mp3s for all of its text. takes these optional args:
       languages:  list of 2 character language codes like ["en","nl"]
       categories: str of specific category for generation of audio, e.g. screens
       save_path:  defaults to XDG_DATA_HOME (~/.local/share/smol-k8s-lab)
+      cache_dir:  where to keep the manifest of what each file was made from
+      workers:    number of synthesis processes, defaults to one per core
+      batch_size: number of clips each synthesis process generates at once
     """
 
     def __init__(self,
                  languages: list|str = None,
                  category: str = "all",
                  save_path: str = DEFAULT_SAVE_PATH,
-                 cached_cfg: str = ""):
+                 cache_dir: str = "",
+                 workers: int = 0,
+                 batch_size: int = 8):
         self.category = category
         self.languages = languages
         self.save_path = save_path
-        self.cached_dir = cached_cfg
-        self.cached_cfg = {}
+        self.cache_dir = cache_dir
+        self.batch_size = batch_size
+
+        # the GPU is shared, so more than one process only gets in the way
+        if not workers:
+            workers = cpu_count() if DEVICE == "cpu" else 1
+        self.workers = workers
 
-        # immediately initialize a dict of TTS models to use
-        self.tts = {}
+        # {language: {mp3 file: hash of what it was generated from}}
+        self.manifests = {}
+        # {mp3 file: hash} for clips that are being generated
+        self.pending = {}
 
         # this is using yaml
         self.yaml = YAML()
 
-    async def process_all_languages(self,):
-        if not self.languages:
-            for language, model in TTS_MODELS.items():
-                # keep track of the tts instance with each language's model
-                self.tts[language] = TTS(model_name=model).to(DEVICE)
-                # kick off each language's config concurrently
-                await self.process_audio_config(language, self.category)
+    def process_all_languages(self) -> None:
+        """
+        collect the clips that need generating for every language, and then
+        generate them all at once
+        """
+        if not self.languages or self.languages == "all":
+            languages = list(TTS_MODELS.keys())
+        elif isinstance(self.languages, list):
+            languages = self.languages
         else:
-            if isinstance(self.languages, list):
-                for language in self.languages:
-                    self.tts[language] = TTS(model_name=TTS_MODELS[language]).to(DEVICE)
-                    await self.process_audio_config(language, self.category)
-            else:
-                self.tts[self.languages] = TTS(model_name=TTS_MODELS[self.languages]).to(DEVICE)
-                await self.process_audio_config(self.languages, self.category)
+            languages = [self.languages]
+
+        clips = {}
+        for language in languages:
+            self.manifests[language] = load_manifest(self.manifest_path(language))
+            clips[language] = self.process_audio_config(language, self.category)
 
-    async def process_audio_config(self,
-                                   lang: str = "",
-                                   category: str = None) -> None:
+        try:
+            self.generate_clips(clips)
+        finally:
+            # save what we did generate, even if something failed part way
+            for language in languages:
+                write_manifest(self.manifest_path(language),
+                               self.manifests[language])
+
+    def manifest_path(self, language: str) -> str:
+        """
+        returns the path to a language's cache manifest
+        """
+        return path.join(self.cache_dir, f"{language}-manifest.json")
+
+    def process_audio_config(self,
+                             lang: str = "",
+                             category: str = None) -> list:
         """
-        process an audio config file for a given language and category
+        process an audio config file for a given language and category.
+        Returns a list of (text, mp3 file) clips that are new or changed
         """
         # open the list of things to generate speech files for
         lang_file_path = path.join(SPEECH_TEXT_DIRECTORY, f"{lang}.yml")
-        # this is for comparing the old config
-        try:
-            with open(path.join(self.cached_cfg, f"{lang}.yml"), 'r') as yml_f:
-                self.cached_cfg = self.yaml.load(yml_f)
-        except Exception as e:
-            self.cached_cfg = {}
 
+        if not category or category == "all":
+            categories = CATEGORIES
+        else:
+            categories = [category]
+
+        clips = []
         header(f"Opening {lang_file_path} to process speech text categories...")
         with open(lang_file_path, 'r') as yaml_file:
             yaml_obj = self.yaml.load(yaml_file)
 
-            if not category or category == "apps":
-                # generate audio files for apps
-                apps = yaml_obj.get('apps', None)
-                if apps:
-                    header(f"Processing [green]apps[/] category for {lang} lang.")
-                    if apps != self.cached_cfg.get('apps', {}):
-                        await self.process_apps(lang, apps)
-                    else:
-                        sub_header("Looks like the apps category hasn't actually changed, so moving on...")
-
-            if not category or category == "cluster_names":
-                # generate audio files for cluster names
-                cluster_names = yaml_obj.get('cluster_names', None)
-                if cluster_names:
-                    header(f"processing [green]cluster_names[/] category for {lang} lang.")
-                    if cluster_names != self.cached_cfg.get('cluster_names', {}):
-                        await self.process_cluster_names(lang, cluster_names)
-                    else:
-                        sub_header("Looks like the cluster_names category hasn't actually changed, so moving on...")
-
-            if not category or category == "screens":
-                # generate audio files for screens
-                header(f"processing [green]screens[/] category for {lang} lang.")
-                screens = yaml_obj.get('screens', {})
-                if screens != self.cached_cfg.get('screens', {}):
-                    await self.process_screens(lang, screens)
-                else:
-                    sub_header("Looks like the screens category hasn't actually changed, so moving on...")
-
-            if not category or category == "phrases":
-                # generate audio files for phrases
-                phrases = yaml_obj.get('phrases', {})
-                if phrases:
-                    header(f"processing [green]phrases[/] category for {lang} lang.")
-                    if phrases != self.cached_cfg.get('phrases', {}):
-                        await self.process_phrases(lang, phrases)
-                    else:
-                        sub_header("Looks like the phrases category hasn't actually changed, so moving on...")
-
-            if not category or category == "numbers":
-                # generate audio files for phrases
-                numbers = yaml_obj.get('numbers', {})
-                if numbers:
-                    header(f"processing [green]numbers[/] category for {lang} lang.")
-                    if numbers != self.cached_cfg.get('numbers', {}):
-                        await self.process_numbers(lang, numbers)
-                    else:
-                        sub_header("Looks like the numbers category hasn't actually changed, so moving on...")
-
-    async def process_apps(self, language: str, apps: dict):
-        """
-        process just the apps
-        """
-        save_path_base = path.join(self.save_path, f"{language}/apps")
-        if not path.exists(save_path_base):
-            sub_header(f"{save_path_base} didn't exist, so we're creating it now...")
-            makedirs(save_path_base, exist_ok=True)
+        for category_name in categories:
+            texts = yaml_obj.get(category_name, {})
+            if not texts:
+                continue
 
-        # for each screen and it's titles,
-        for app, app_text in apps.items():
+            header(f"processing [green]{category_name}[/] category for {lang} lang.")
+            save_path_base = self.get_save_path_base(lang, category_name)
 
-            mp3_exists = path.exists(path.join(save_path_base, f"{app}.mp3"))
-            cached_app = self.cached_cfg.get('apps', {}).get(app, "") == app
+            # screens have a title and description each, so they're nested
+            if category_name == "screens":
+                wanted = {f"{screen}_{title}.mp3": text
+                          for screen, titles in texts.items()
+                          for title, text in titles.items()}
+            else:
+                wanted = {f"{name}.mp3": text for name, text in texts.items()}
 
-            if not mp3_exists or not cached_app:
-                await self.generate_single_audio_file(self.tts[language],
-                                                      save_path_base,
-                                                      app,
-                                                      app_text)
+            category_clips = self.get_changed_clips(lang, save_path_base, wanted)
+            if not category_clips:
+                sub_header(f"Looks like the {category_name} category hasn't "
+                           "actually changed, so moving on...")
+            clips.extend(category_clips)
+            self.prune_orphans(lang, save_path_base, wanted)
 
-    async def process_cluster_names(self, language: str, cluster_names: dict):
+        return clips
+
+    def get_save_path_base(self, language: str, category: str) -> str:
         """
-        process just the cluster names
+        returns the directory for a category's audio files, creating it if
+        needed
         """
-        save_path_base = path.join(self.save_path, f"{language}/cluster_names")
+        save_path_base = path.join(self.save_path, f"{language}/{category}")
         if not path.exists(save_path_base):
             sub_header(f"{save_path_base} didn't exist, so we're creating it now...")
             makedirs(save_path_base, exist_ok=True)
+        return save_path_base
 
-        await self.generate_audio_files_from_dict(self.tts[language],
-                                                  save_path_base,
-                                                  cluster_names)
-
-    async def process_numbers(self, language: str, numbers: dict):
+    def get_changed_clips(self,
+                          language: str,
+                          save_path_base: str,
+                          wanted: dict) -> list:
         """
-        process just the numbers
+        returns a (text, mp3 file) clip for each {mp3 file name: text} that
+        doesn't have an mp3 yet, or whose text or model changed since its mp3
+        was generated
         """
-        save_path_base = path.join(self.save_path, f"{language}/numbers")
-        if not path.exists(save_path_base):
-            sub_header(f"{save_path_base} didn't exist, so we're creating it now...")
-            makedirs(save_path_base, exist_ok=True)
-
-        await self.generate_audio_files_from_dict(self.tts[language],
-                                                  save_path_base,
-                                                  numbers)
-
-    async def process_phrases(self, language: str, phrases: dict):
+        manifest = self.manifests[language]
+        clips = []
+        for sound_file, text in wanted.items():
+            mp3_file = path.join(save_path_base, sound_file)
+            digest = clip_hash(language, str(text))
+
+            if path.exists(mp3_file) and manifest.get(mp3_file) == digest:
+                continue
+
+            self.pending[mp3_file] = digest
+            clips.append((str(text), mp3_file))
+        return clips
+
+    def prune_orphans(self,
+                      language: str,
+                      save_path_base: str,
+                      wanted: dict) -> None:
         """
-        process just the common phrases
+        removes mp3s from a category's directory that aren't in the speech
+        config anymore
         """
-        save_path_base = path.join(self.save_path, f"{language}/phrases")
-        if not path.exists(save_path_base):
-            sub_header(f"{save_path_base} didn't exist, so we're creating it now...")
-            makedirs(save_path_base, exist_ok=True)
+        manifest = self.manifests[language]
+        for sound_file in listdir(save_path_base):
+            if not sound_file.endswith(".mp3") or sound_file in wanted:
+                continue
 
-        await self.generate_audio_files_from_dict(self.tts[language],
-                                                  save_path_base,
-                                                  phrases)
+            mp3_file = path.join(save_path_base, sound_file)
+            sub_header(f"Removing {mp3_file}, since it's not in the config anymore")
+            remove(mp3_file)
+            manifest.pop(mp3_file, None)
 
-    async def process_screens(self, language: str, screen_texts: dict):
+    def generate_clips(self, clips: dict) -> None:
         """
-        calls generate method to create a .wav audio file for each screen's
-        title and description and save them to a directory based on the language
+        generates every clip in {language: [(text, mp3 file)]}. Batches of clips
+        are synthesised in a pool of processes that each hold their own TTS
+        model, while each finished batch is encoded to mp3s in a thread pool
+        at the same time
         """
-        save_path_base = path.join(self.save_path, f"{language}/screens")
-        if not path.exists(save_path_base):
-            sub_header(f"{save_path_base} didn't exist, so we're creating it now...")
-            makedirs(save_path_base, exist_ok=True)
+        batches = []
+        for language, language_clips in clips.items():
+            for index in range(0, len(language_clips), self.batch_size):
+                batches.append((language,
+                                language_clips[index:index + self.batch_size]))
+
+        total = sum(len(language_clips) for language_clips in clips.values())
+        if not total:
+            sub_header("Nothing to generate, every audio file is up to date.")
+            return
+
+        header(f"Generating {total} audio files with {self.workers} workers on {DEVICE}")
+        progress = Progress(TextColumn("[green]{task.description}"),
+                            BarColumn(),
+                            MofNCompleteColumn(),
+                            TextColumn("{task.fields[rate]}"),
+                            TimeElapsedColumn(),
+                            console=CONSOLE)
+        start = time.perf_counter()
+
+        # spawn, so each process loads its own model instead of forking torch
+        with progress, \
+                ProcessPoolExecutor(max_workers=self.workers,
+                                    mp_context=get_context("spawn"),
+                                    initializer=init_worker) as synth_pool, \
+                ThreadPoolExecutor(max_workers=self.workers) as encode_pool:
+            task = progress.add_task("Generating audio", total=total, rate="")
+
+            synth_futures = {synth_pool.submit(synthesize_batch, language, batch): language
+                             for language, batch in batches}
+
+            # one running count of written clips, shared by the encode threads
+            completed = 0
+            lock = Lock()
+
+            def record_encode(future, language: str) -> None:
+                """
+                mark each clip of a batch as generated as soon as its mp3 is
+                written, so a later failure can't lose it
+                """
+                nonlocal completed
+                if future.exception():
+                    return
+                with lock:
+                    for mp3_file in future.result():
+                        self.manifests[language][mp3_file] = self.pending.pop(mp3_file)
+                    completed += len(future.result())
+                    progress.update(task,
+                                    completed=completed,
+                                    rate=clip_rate(completed, start))
+
+            encode_futures = []
+            failed = []
+            for future in as_completed(synth_futures):
+                # keep encoding the other batches if one fails to synthesise
+                if future.exception():
+                    failed.append(future)
+                    continue
+
+                # the encodes run on while we wait for the next batch
+                language = synth_futures[future]
+                encode_future = encode_pool.submit(encode_batch, future.result())
+                encode_future.add_done_callback(
+                        lambda f, language=language: record_encode(f, language)
+                        )
+                encode_futures.append(encode_future)
+
+            # raise the first batch that failed, once the rest are written
+            for future in failed + encode_futures:
+                future.result()
+
+        elapsed = time.perf_counter() - start
+        sub_header(f"Generated {total} audio files at "
+                   f"{total / elapsed:0.2f} clips per second.")
+
+
+def clip_rate(completed: int, start: float) -> str:
+    """
+    returns how many clips per second we're generating since start
+    """
+    elapsed = time.perf_counter() - start
+    if not elapsed or not completed:
+        return ""
+    return f"{completed / elapsed:0.2f} clips/s"
 
-        # for each screen and it's titles,
-        for screen, titles in screen_texts.items():
-            await self.generate_audio_files_from_dict(self.tts[language],
-                                                      save_path_base,
-                                                      titles,
-                                                      screen)
-
-    async def generate_single_audio_file(self,
-                                         tts: TTS,
-                                         save_path_base: str,
-                                         file_name: str,
-                                         text_to_speak: str):
-        """
-        generate an audio .wav format for a single string and then converts it to
-        an mp3 # NOTE: this will only work if you already have ffmpeg installed
-        """
-        save_path = path.join(save_path_base, f"{file_name}.wav")
-        tts.tts_to_file(text=text_to_speak, file_path=save_path)
-        # convert the .wav to .mp3
-        # may consider adding codec="libmp3lame"
-        AudioSegment.from_wav(save_path).export(save_path.replace(".wav", ".mp3"),
-                                                format="mp3",
-                                                bitrate="64k")
-        remove(save_path)
-
-    async def generate_audio_files_from_dict(self,
-                                             tts: TTS,
-                                             save_path_base: str,
-                                             text_dict: dict,
-                                             prefix: str = ""):
-        """
-        generate an audio .wav format and then converts it to an mp3 for each
-        thing in a dictionary
-        # NOTE: this will only work if you already have ffmpeg installed
-        """
-        for text_category, text in text_dict.items():
-            if prefix:
-                sound_file = f"{prefix}_{text_category}.wav"
-            else:
-                sound_file = f"{text_category}.wav"
 
-            save_path = path.join(save_path_base, sound_file)
-            mp3_file = save_path.replace("wav", "mp3")
+def clip_hash(language: str, text: str) -> str:
+    """
+    returns a hash of everything a clip is generated from
+    """
+    return sha256(f"{language}\0{TTS_MODELS[language]}\0{text}".encode()).hexdigest()
 
-            if not path.exists(mp3_file):
-                tts.tts_to_file(text=text, file_path=save_path)
-                AudioSegment.from_wav(save_path).export(mp3_file,
-                                                        format="mp3",
-                                                        bitrate="64k")
-                remove(save_path)
-            else:
-                sub_header(f"{mp3_file} already exists, continuing...")
+
+def load_manifest(manifest_path: str) -> dict:
+    """
+    returns the {mp3 file: clip hash} manifest, or {} if there isn't one yet
+    """
+    if not path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, 'r') as manifest_file:
+            return loads(manifest_file.read())
+    except (ValueError, OSError) as e:
+        sub_header(f"Couldn't read {manifest_path}, so regenerating everything: {e}")
+        return {}
+
+
+def write_manifest(manifest_path: str, manifest: dict) -> None:
+    """
+    atomically writes the manifest, so an interrupted run can't corrupt it
+    """
+    write_atomically(manifest_path,
+                     dumps(manifest, indent=2, sort_keys=True).encode())